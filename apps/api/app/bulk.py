@@ -0,0 +1,346 @@
+"""Converts a directory (or a list file) of images offline, without the HTTP API.
+
+Images are decoded and preprocessed by a pool of ``--loaders`` threads ahead
+of generation and converted in batches of ``--batch-size``. The model,
+runner, settings and result cache are the API's, so results are shared
+with it. Each batch is appended to a JSONL checkpoint and flushed, so an
+interrupted run resumes where it stopped and retries the images that failed
+to load; a ``.parquet`` output (``pip install -e ".[bulk]"``) is written
+from the checkpoint at the end. ``--num-shards`` splits the images between
+processes, each writing its own output:
+
+    cd apps/api
+    python -m app.bulk ~/equations --output equations.jsonl
+    python -m app.bulk ~/equations --output equations.parquet --batch-size 16 --loaders 8
+    for i in 0 1 2 3; do python -m app.bulk files.txt --output out.jsonl --num-shards 4 --shard-index $i & done
+"""
+import os
+import sys
+import json
+import time
+import argparse
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
+
+project_root = Path(__file__).parent.parent.parent.parent
+sys.path.insert(0, str(project_root))
+
+from models.inference.preprocess import PreprocessConfig, load_image
+from models.inference.result_cache import hash_file
+
+# Settings are read when the app is imported, so its modules are imported
+# in the functions below, after main() has configured them
+
+
+# Every record has these keys, so Parquet columns do not depend on which
+# record comes first
+RECORD_FIELDS = (
+    ("path", "string"),
+    ("image_hash", "string"),
+    ("latex", "string"),
+    ("tokens", "int64"),
+    ("time_ms", "int64"),
+    ("vision_tokens", "int64"),
+    ("stop_reason", "string"),
+    ("cached", "bool_"),
+    ("error", "string"),
+)
+
+
+def make_record(
+    path: str,
+    image_hash: Optional[str] = None,
+    result: Optional[Dict[str, Any]] = None,
+    cached: bool = False,
+    error: Optional[str] = None,
+) -> Dict[str, Any]:
+    result = result or {"tokens": 0}
+    record = {name: result.get(name) for name, _ in RECORD_FIELDS}
+    record.update(path=path, image_hash=image_hash, cached=cached, error=error)
+    return record
+
+
+def list_images(source: str) -> List[str]:
+    """Images under a directory, or the paths listed in a text file, sorted."""
+    from app.services.uploads import IMAGE_EXTENSIONS
+
+    if os.path.isdir(source):
+        paths = [
+            os.path.join(root, name)
+            for root, _, names in os.walk(source)
+            for name in names
+            if name.lower().endswith(IMAGE_EXTENSIONS)
+        ]
+    else:
+        with open(source, 'r') as f:
+            paths = [line.strip() for line in f if line.strip()]
+    return sorted(paths)
+
+
+def shard_path(output: str, num_shards: int, shard_index: int) -> str:
+    if num_shards <= 1:
+        return output
+    stem, ext = os.path.splitext(output)
+    return f"{stem}.shard-{shard_index:05d}-of-{num_shards:05d}{ext}"
+
+
+class Checkpoint:
+    """Append-only JSONL of finished images.
+
+    A line cut short by a crash, and the records of images that failed to
+    load, are dropped when the checkpoint is opened, and those images
+    converted again.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.done: Set[str] = set()
+        if os.path.exists(path):
+            kept = []
+            dropped = False
+            with open(path, 'rb') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        dropped = True
+                        break
+                    if not line.endswith(b"\n"):
+                        dropped = True
+                        break
+                    if record.get("error") is not None:
+                        dropped = True
+                        continue
+                    self.done.add(record["path"])
+                    kept.append(line)
+            if dropped:
+                tmp_path = f"{path}.tmp"
+                with open(tmp_path, 'wb') as f:
+                    f.writelines(kept)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, path)
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._file = open(path, 'a', encoding='utf-8')
+
+    def write(self, records: List[Dict[str, Any]]):
+        for record in records:
+            self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+            if record.get("error") is None:
+                self.done.add(record["path"])
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        self._file.close()
+
+
+def write_parquet(checkpoint_path: str, output: str):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise SystemExit(f"Writing Parquet needs pyarrow (pip install -e \".[bulk]\"); the results are in {checkpoint_path}")
+    with open(checkpoint_path, 'r', encoding='utf-8') as f:
+        records = [json.loads(line) for line in f]
+    schema = pa.schema([(name, getattr(pa, type_name)()) for name, type_name in RECORD_FIELDS])
+    pq.write_table(pa.Table.from_pylist(records, schema=schema), output)
+    os.remove(checkpoint_path)
+
+
+def _load(path: str, preprocess: Optional[PreprocessConfig]):
+    try:
+        image, info = load_image(path, preprocess)
+        return hash_file(path), image, info, None
+    except Exception as e:
+        return None, None, None, f"{type(e).__name__}: {e}"
+
+
+def prefetch(paths: List[str], preprocess: Optional[PreprocessConfig], loaders: int, lookahead: int) -> Iterator[Tuple[str, Any]]:
+    """Yields (path, (hash, image, info, error)) in order, loading up to ``lookahead`` images ahead."""
+    with ThreadPoolExecutor(max_workers=max(1, loaders), thread_name_prefix="bulk-loader") as pool:
+        pending: "deque[Tuple[str, Future]]" = deque()
+        remaining = iter(paths)
+        for path in remaining:
+            pending.append((path, pool.submit(_load, path, preprocess)))
+            if len(pending) >= lookahead:
+                break
+        while pending:
+            path, future = pending.popleft()
+            for next_path in remaining:
+                pending.append((next_path, pool.submit(_load, next_path, preprocess)))
+                break
+            yield path, future.result()
+
+
+class Progress:
+    def __init__(self, total: int, label: str, interval: float):
+        self.total = total
+        self.label = label
+        self.interval = interval
+        self.done = 0
+        self.cached = 0
+        self.errors = 0
+        self.tokens = 0
+        self.started = time.perf_counter()
+        self._reported = self.started
+
+    def add(self, records: List[Dict[str, Any]]):
+        for record in records:
+            self.done += 1
+            self.cached += bool(record.get("cached"))
+            self.errors += record.get("error") is not None
+            if not record.get("cached"):
+                self.tokens += record.get("tokens") or 0
+        if time.perf_counter() - self._reported >= self.interval:
+            self.report()
+
+    def summary(self) -> Dict[str, Any]:
+        elapsed = time.perf_counter() - self.started
+        return {
+            "images": self.done,
+            "cached": self.cached,
+            "errors": self.errors,
+            "tokens": self.tokens,
+            "seconds": round(elapsed, 3),
+            "images_per_s": self.done / elapsed if elapsed else 0.0,
+            "tokens_per_s": self.tokens / elapsed if elapsed else 0.0,
+        }
+
+    def report(self):
+        self._reported = time.perf_counter()
+        summary = self.summary()
+        rate = summary["images_per_s"]
+        eta = (self.total - self.done) / rate if rate else 0.0
+        percent = 100.0 * self.done / self.total if self.total else 100.0
+        print(
+            f"{self.label}{self.done}/{self.total} ({percent:.1f}%) {rate:.2f} img/s "
+            f"{summary['tokens_per_s']:.1f} tok/s cached {self.cached} errors {self.errors} eta {eta:.0f}s",
+            file=sys.stderr,
+            flush=True,
+        )
+
+
+def convert(
+    paths: List[str],
+    checkpoint: Checkpoint,
+    adapter_path: Optional[str] = None,
+    batch_size: int = 8,
+    loaders: int = 4,
+    progress: Optional[Progress] = None,
+    generation: Optional[Dict[str, Any]] = None,
+) -> None:
+    from app.services.infer import (
+        get_generation_settings,
+        get_preprocess_config,
+        is_deterministic,
+        result_cache,
+        result_cache_key,
+        runner,
+    )
+
+    generation = generation or get_generation_settings()
+    preprocess = get_preprocess_config()
+    progress = progress or Progress(len(paths), "", float("inf"))
+
+    batch: List[Tuple[str, str, Optional[str], Any, Dict[str, Any]]] = []
+
+    def flush():
+        started = time.perf_counter()
+        results = runner.run_batch([item[3] for item in batch], generation, adapter_path)
+        time_ms = int((time.perf_counter() - started) * 1000)
+        records = []
+        for (path, image_hash, cache_key, _, info), (text, tokens, _, reason) in zip(batch, results):
+            result = {
+                "latex": text,
+                "tokens": tokens,
+                "time_ms": time_ms,
+                "vision_tokens": info["vision_tokens"],
+                "stop_reason": reason,
+            }
+            if cache_key is not None:
+                result_cache.set(cache_key, result)
+            records.append(make_record(path, image_hash, result))
+        checkpoint.write(records)
+        progress.add(records)
+        batch.clear()
+
+    for path, (image_hash, image, info, error) in prefetch(paths, preprocess, loaders, lookahead=2 * batch_size):
+        if error is not None:
+            record = make_record(path, error=error)
+            checkpoint.write([record])
+            progress.add([record])
+            continue
+        cache_key = None
+        if result_cache is not None and is_deterministic(generation):
+            cache_key = result_cache_key(image_hash, generation, adapter_path, preprocess)
+        cached = result_cache.get(cache_key) if cache_key is not None else None
+        if cached is not None:
+            record = make_record(path, image_hash, cached, cached=True)
+            checkpoint.write([record])
+            progress.add([record])
+            continue
+        batch.append((path, image_hash, cache_key, image, info))
+        if len(batch) >= batch_size:
+            flush()
+    if batch:
+        flush()
+
+
+def main():
+    # Generations run in this process, not in the API's inference workers
+    os.environ["INFERENCE_WORKERS"] = "0"
+    os.environ["CONTROL_PLANE_ONLY"] = "false"
+    from models.inference.model_manager import model_manager
+    from app.core.config import settings
+    from app.services.infer import DECODING_MODES, get_generation_settings
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("source", help="Directory of images, or a text file with one image path per line")
+    parser.add_argument("--output", required=True, help="Results as .jsonl or .parquet")
+    parser.add_argument("--adapter", help="Adapter job id or path, or base (default: the current default)")
+    parser.add_argument("--batch-size", type=int, default=settings.batch_max_size)
+    parser.add_argument("--loaders", type=int, default=4, help="Threads decoding and preprocessing images")
+    parser.add_argument("--num-shards", type=int, default=1)
+    parser.add_argument("--shard-index", type=int, default=0)
+    parser.add_argument("--progress-interval", type=float, default=10.0, help="Seconds between progress lines")
+    parser.add_argument("--max-new-tokens", type=int, help="Token limit per image (default: MAX_NEW_TOKENS)")
+    parser.add_argument("--decoding", choices=DECODING_MODES, help="Only greedy results are cached (default: DECODING)")
+    parser.add_argument("--temperature", type=float)
+    parser.add_argument("--min-p", type=float)
+    args = parser.parse_args()
+    if not 0 <= args.shard_index < args.num_shards:
+        parser.error("--shard-index must be between 0 and --num-shards - 1")
+    try:
+        adapter_path = model_manager.resolve_adapter(args.adapter)
+        generation = get_generation_settings(args.max_new_tokens, args.decoding, args.temperature, args.min_p)
+    except ValueError as e:
+        parser.error(str(e))
+
+    output = shard_path(args.output, args.num_shards, args.shard_index)
+    parquet = output.endswith(".parquet")
+    if parquet:
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            parser.error('Writing Parquet needs pyarrow (pip install -e ".[bulk]"); write .jsonl instead')
+    checkpoint = Checkpoint(f"{output}.partial.jsonl" if parquet else output)
+
+    paths = list_images(args.source)[args.shard_index::args.num_shards]
+    todo = [path for path in paths if path not in checkpoint.done]
+    label = f"[shard {args.shard_index}/{args.num_shards}] " if args.num_shards > 1 else ""
+    progress = Progress(len(todo), label, args.progress_interval)
+    try:
+        convert(todo, checkpoint, adapter_path, args.batch_size, args.loaders, progress, generation)
+    finally:
+        checkpoint.close()
+    progress.report()
+    if parquet:
+        write_parquet(checkpoint.path, output)
+    print(json.dumps({**progress.summary(), "skipped": len(paths) - len(todo), "output": output}))
+
+
+if __name__ == "__main__":
+    main()
@@ -4,10 +4,84 @@ import os
 class Settings:
     def __init__(self):
         self.database_url = os.getenv("DATABASE_URL", "sqlite:///./app.db")
+        self.db_workers = int(os.getenv("DB_WORKERS", "4"))
+        self.db_busy_timeout_ms = int(os.getenv("DB_BUSY_TIMEOUT_MS", "5000"))
+        self.db_write_batch_size = int(os.getenv("DB_WRITE_BATCH_SIZE", "64"))
+        self.db_write_max_wait_ms = float(os.getenv("DB_WRITE_MAX_WAIT_MS", "5"))
+        self.history_max_page_size = int(os.getenv("HISTORY_MAX_PAGE_SIZE", "100"))
+        # Defaults of the requests that do not set their own, within the limits below
         self.max_new_tokens = int(os.getenv("MAX_NEW_TOKENS", "256"))
+        self.decoding = os.getenv("DECODING", "greedy").lower()
         self.temperature = float(os.getenv("TEMPERATURE", "0.7"))
         self.min_p = float(os.getenv("MIN_P", "0.1"))
+        self.max_new_tokens_limit = int(os.getenv("MAX_NEW_TOKENS_LIMIT", "1024"))
+        self.max_temperature = float(os.getenv("MAX_TEMPERATURE", "2"))
+        self.page_min_line_gap = int(os.getenv("PAGE_MIN_LINE_GAP", "16"))
+        self.page_min_column_gap = int(os.getenv("PAGE_MIN_COLUMN_GAP", "48"))
+        self.page_max_regions = int(os.getenv("PAGE_MAX_REGIONS", "64"))
+        self.stop_on_repetition = os.getenv("STOP_ON_REPETITION", "true").lower() in ("1", "true", "yes")
+        self.stop_repetition_max_ngram = int(os.getenv("STOP_REPETITION_MAX_NGRAM", "16"))
+        self.stop_repetition_min_tokens = int(os.getenv("STOP_REPETITION_MIN_TOKENS", "32"))
+        self.stop_on_complete_latex = os.getenv("STOP_ON_COMPLETE_LATEX", "false").lower() in ("1", "true", "yes")
+        self.adaptive_token_budget = os.getenv("ADAPTIVE_TOKEN_BUDGET", "true").lower() in ("1", "true", "yes")
+        self.token_budget_base = int(os.getenv("TOKEN_BUDGET_BASE", "64"))
+        self.token_budget_per_vision_token = float(os.getenv("TOKEN_BUDGET_PER_VISION_TOKEN", "0.5"))
+        self.token_budget_per_aspect = float(os.getenv("TOKEN_BUDGET_PER_ASPECT", "8"))
         self.upload_dir = os.getenv("UPLOAD_DIR", "./uploads")
+        self.max_upload_bytes = int(os.getenv("MAX_UPLOAD_BYTES", str(10 * 1024 * 1024)))
+        self.max_upload_pixels = int(os.getenv("MAX_UPLOAD_PIXELS", str(50_000_000)))
+        self.max_request_bytes = int(os.getenv("MAX_REQUEST_BYTES", str(256 * 1024 * 1024)))
+        self.upload_max_total_bytes = int(os.getenv("UPLOAD_MAX_TOTAL_BYTES", str(5 * 1024 * 1024 * 1024)))
+        self.upload_retention_days = float(os.getenv("UPLOAD_RETENTION_DAYS", "30"))
+        self.upload_retention_interval = float(os.getenv("UPLOAD_RETENTION_INTERVAL", "3600"))
+        self.upload_grace_seconds = float(os.getenv("UPLOAD_GRACE_SECONDS", "3600"))
+        self.upload_cache_max_age = int(os.getenv("UPLOAD_CACHE_MAX_AGE", str(365 * 24 * 3600)))
+        self.thumbnail_size = int(os.getenv("THUMBNAIL_SIZE", "256"))
+        self.thumbnail_format = os.getenv("THUMBNAIL_FORMAT", "webp").lower()
+        self.thumbnail_quality = int(os.getenv("THUMBNAIL_QUALITY", "80"))
+        self.thumbnail_on_upload = os.getenv("THUMBNAIL_ON_UPLOAD", "false").lower() in ("1", "true", "yes")
+        self.inference_timeout = float(os.getenv("INFERENCE_TIMEOUT", "60"))
+        self.batch_max_size = int(os.getenv("BATCH_MAX_SIZE", "8"))
+        self.batch_max_wait_ms = float(os.getenv("BATCH_MAX_WAIT_MS", "10"))
+        # 0: one full batch per replica or worker
+        self.admission_max_concurrency = int(os.getenv("ADMISSION_MAX_CONCURRENCY", "0"))
+        self.admission_max_queue = int(os.getenv("ADMISSION_MAX_QUEUE", "32"))
+        self.admission_queue_timeout = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "10"))
+        self.admission_bulk_share = float(os.getenv("ADMISSION_BULK_SHARE", "0.5"))
+        self.batch_job_max_items = int(os.getenv("BATCH_JOB_MAX_ITEMS", "1000"))
+        self.batch_job_chunk_size = int(os.getenv("BATCH_JOB_CHUNK_SIZE", "32"))
+        self.batch_job_retention = int(os.getenv("BATCH_JOB_RETENTION", "100"))
+        self.preload_model = os.getenv("PRELOAD_MODEL", "false").lower() in ("1", "true", "yes")
+        self.preload_adapter = os.getenv("PRELOAD_ADAPTER") or None
+        self.warmup_sample = os.getenv("WARMUP_SAMPLE", "quadratic_formula.png")
+        self.warmup_max_new_tokens = int(os.getenv("WARMUP_MAX_NEW_TOKENS", "16"))
+        self.preprocess = os.getenv("PREPROCESS", "true").lower() in ("1", "true", "yes")
+        self.preprocess_crop = os.getenv("PREPROCESS_CROP", "true").lower() in ("1", "true", "yes")
+        self.preprocess_max_pixels = int(os.getenv("PREPROCESS_MAX_PIXELS", str(1024 * 28 * 28)))
+        self.preprocess_max_vision_tokens = int(os.getenv("PREPROCESS_MAX_VISION_TOKENS", "512"))
+        self.preprocess_grayscale = os.getenv("PREPROCESS_GRAYSCALE", "false").lower() in ("1", "true", "yes")
+        self.prompt_prefix_cache = os.getenv("PROMPT_PREFIX_CACHE", "true").lower() in ("1", "true", "yes")
+        self.vision_cache_max_bytes = int(os.getenv("VISION_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+        self.vision_cache_dir = os.getenv("VISION_CACHE_DIR", "")
+        self.vision_cache_disk_max_bytes = int(os.getenv("VISION_CACHE_DISK_MAX_BYTES", str(1024 * 1024 * 1024)))
+        self.inference_runner = os.getenv("INFERENCE_RUNNER", "model")
+        self.control_plane_only = os.getenv("CONTROL_PLANE_ONLY", "false").lower() in ("1", "true", "yes")
+        self.cpu_profile = os.getenv("CPU_PROFILE", "fp32").lower()
+        self.cpu_compile = os.getenv("CPU_COMPILE", "false").lower() in ("1", "true", "yes")
+        self.torch_intra_op_threads = int(os.getenv("TORCH_INTRA_OP_THREADS", "0"))
+        self.torch_inter_op_threads = int(os.getenv("TORCH_INTER_OP_THREADS", "0"))
+        self.stub_prefill_ms = float(os.getenv("STUB_PREFILL_MS", "0"))
+        self.stub_token_ms = float(os.getenv("STUB_TOKEN_MS", "0"))
+        self.stub_tokens = int(os.getenv("STUB_TOKENS", "16"))
+        self.inference_workers = int(os.getenv("INFERENCE_WORKERS", "0"))
+        self.inference_worker_threads = int(os.getenv("INFERENCE_WORKER_THREADS", "0"))
+        self.inference_worker_pin_cpus = os.getenv("INFERENCE_WORKER_PIN_CPUS", "true").lower() in ("1", "true", "yes")
+        self.inference_worker_health_timeout = float(os.getenv("INFERENCE_WORKER_HEALTH_TIMEOUT", "30"))
+        self.result_cache_backend = os.getenv("RESULT_CACHE_BACKEND", "sqlite")
+        self.result_cache_dir = os.getenv("RESULT_CACHE_DIR", "./cache")
+        self.result_cache_memory_entries = int(os.getenv("RESULT_CACHE_MEMORY_ENTRIES", "1024"))
+        self.result_cache_max_bytes = int(os.getenv("RESULT_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+        self.result_cache_ttl = float(os.getenv("RESULT_CACHE_TTL", str(7 * 24 * 3600)))
 
 
 settings = Settings() 
\ No newline at end of file
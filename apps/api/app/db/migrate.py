@@ -0,0 +1,25 @@
+from sqlalchemy import inspect, text
+
+from .base import engine
+from .models import Base, InferenceRecord
+
+
+def init_db():
+    """Creates the tables, and the columns and indexes added since they were created.
+
+    Runs when the API starts; ``python -m app.db.migrate`` runs it on its own.
+    """
+    Base.metadata.create_all(bind=engine)
+    # create_all skips columns and indexes added to tables that already exist
+    existing_columns = {column["name"] for column in inspect(engine).get_columns(InferenceRecord.__tablename__)}
+    with engine.begin() as connection:
+        for column in InferenceRecord.__table__.columns:
+            if column.name not in existing_columns:
+                column_type = column.type.compile(dialect=engine.dialect)
+                connection.execute(text(f"ALTER TABLE {InferenceRecord.__tablename__} ADD COLUMN {column.name} {column_type}"))
+    for index in InferenceRecord.__table__.indexes:
+        index.create(bind=engine, checkfirst=True)
+
+
+if __name__ == "__main__":
+    init_db()
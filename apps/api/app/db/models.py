@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, Text
+from sqlalchemy import JSON, Column, Integer, String, DateTime, Text
 from sqlalchemy.sql import func
 
 from .base import Base
@@ -12,5 +12,9 @@ class InferenceRecord(Base):
     latex_output = Column(Text, nullable=False)
     tokens_used = Column(Integer, nullable=False)
     time_ms = Column(Integer, nullable=False)
+    # Milliseconds per stage, as in the /api/infer response
+    timings = Column(JSON, nullable=True)
+    # Why generation ended: eos, length, budget, repetition, complete or cancelled
+    stop_reason = Column(String, nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
@@ -1,3 +1,4 @@
+from typing import Optional
 from sqlalchemy.orm import Session
 from .models import InferenceRecord
 
@@ -17,7 +18,19 @@ class InferenceRepository:
         return record
 
     @staticmethod
-    def get_recent(db: Session, limit: int = 10) -> list[InferenceRecord]:
-        return db.query(InferenceRecord).order_by(InferenceRecord.created_at.desc()).limit(limit).all()
-
+    def create_many(db: Session, rows: list[dict]) -> list[int]:
+        records = [InferenceRecord(**row) for row in rows]
+        db.add_all(records)
+        db.flush()
+        ids = [record.id for record in records]
+        db.commit()
+        return ids
 
+    @staticmethod
+    def get_page(db: Session, limit: int = 10, before: Optional[int] = None) -> list[InferenceRecord]:
+        # Ids grow with insertion time, so walking the primary key backwards
+        # is newest-first and each page is an index range scan
+        query = db.query(InferenceRecord)
+        if before is not None:
+            query = query.filter(InferenceRecord.id < before)
+        return query.order_by(InferenceRecord.id.desc()).limit(limit).all()
@@ -1,36 +1,116 @@
+import asyncio
+from contextlib import asynccontextmanager
 from pathlib import Path
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import JSONResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+from starlette.datastructures import Headers
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 
-from app.db.base import engine
-from app.db.models import Base
-from app.routers import infer, history, models
+from app.db.migrate import init_db
+from app.core.config import settings
+from app.routers import infer, batch, history, models
+from app.routers.uploads import UploadFiles
+from app.services.infer import refresh_metrics, worker_pool
+from app.services.uploads import run_upload_retention
+from app.services.warmup import readiness, warm_start
 
-Base.metadata.create_all(bind=engine)
 
-app = FastAPI(title="img2LaTeX AI API")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    init_db()
+    warmup_task = None
+    if settings.preload_model and not settings.control_plane_only:
+        readiness.phase = "starting"
+        # Loading runs in the background so /health and /ready answer meanwhile
+        warmup_task = asyncio.create_task(warm_start())
+    retention_task = asyncio.create_task(run_upload_retention())
+    yield
+    if warmup_task is not None and not warmup_task.done():
+        warmup_task.cancel()
+    retention_task.cancel()
+    if worker_pool is not None:
+        await asyncio.to_thread(worker_pool.stop)
+
+
+app = FastAPI(title="img2LaTeX AI API", lifespan=lifespan)
 
 static_dir = Path(__file__).parent.parent / "static"
 app.mount("/static", StaticFiles(directory=str(static_dir)), name="static")
 
-uploads_dir = Path(__file__).parent.parent / "uploads"
-uploads_dir.mkdir(exist_ok=True)
-app.mount("/api/uploads", StaticFiles(directory=str(uploads_dir)), name="uploads")
+uploads_dir = Path(settings.upload_dir)
+uploads_dir.mkdir(parents=True, exist_ok=True)
+app.mount("/api/uploads", UploadFiles(directory=str(uploads_dir)), name="uploads")
+
+
+class LimitRequestSize:
+    """Rejects request bodies over ``MAX_REQUEST_BYTES`` with 413.
+
+    A larger Content-Length is rejected before the body is read. Starlette
+    spools multipart bodies to disk before a route sees them, so bodies
+    without one are counted as they arrive and cut off once they pass the
+    limit, instead of being spooled in full.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        limit = settings.max_request_bytes
+        detail = f"Request body exceeds {limit} bytes"
+        length = Headers(scope=scope).get("content-length")
+        if length and length.isdigit() and int(length) > limit:
+            return await JSONResponse(status_code=413, content={"detail": detail})(scope, receive, send)
+
+        received = 0
 
+        async def limited_receive() -> Message:
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    # Passed through by FastAPI's body parsing as a 413 response
+                    raise HTTPException(status_code=413, detail=detail)
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+
+app.add_middleware(LimitRequestSize)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
 app.include_router(infer.router, prefix="/api")
+app.include_router(batch.router, prefix="/api")
 app.include_router(history.router, prefix="/api")
 app.include_router(models.router, prefix="/api")
 
 
 @app.get("/health")
 def health():
-    return {"ok": True} 
\ No newline at end of file
+    return {"ok": True}
+
+
+@app.get("/metrics")
+def get_metrics():
+    refresh_metrics()
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+
+@app.get("/ready")
+def ready():
+    return JSONResponse(
+        status_code=200 if readiness.ready else 503,
+        content=readiness.to_dict()
+    ) 
\ No newline at end of file
@@ -0,0 +1,113 @@
+import os
+import asyncio
+import zipfile
+from typing import Dict, Any, List, Optional, Tuple
+from fastapi import APIRouter, Depends, UploadFile, File, Form, HTTPException
+from fastapi.responses import StreamingResponse
+
+from app.core.config import settings
+from app.routers.infer import generation_form, sse_event
+from app.services.infer import require_inference, resolve_adapter
+from app.services.jobs import job_manager
+from app.services.uploads import IMAGE_EXTENSIONS, StoredUpload, store_file
+
+router = APIRouter()
+
+
+def is_zip(upload: UploadFile) -> bool:
+    return upload.content_type in ("application/zip", "application/x-zip-compressed") or (
+        upload.filename or ""
+    ).lower().endswith(".zip")
+
+
+def _store_uploads(images: List[UploadFile]) -> List[Tuple[str, StoredUpload]]:
+    stored: List[Tuple[str, StoredUpload]] = []
+    for upload in images:
+        if is_zip(upload):
+            try:
+                archive = zipfile.ZipFile(upload.file)
+            except zipfile.BadZipFile:
+                raise HTTPException(status_code=400, detail=f"{upload.filename} is not a valid zip archive")
+            with archive:
+                for member in archive.infolist():
+                    name = os.path.basename(member.filename)
+                    if member.is_dir() or not name.lower().endswith(IMAGE_EXTENSIONS):
+                        continue
+                    check_batch_size(len(stored) + 1)
+                    with archive.open(member) as source:
+                        stored.append((name, store_file(source, name)))
+        elif upload.content_type and upload.content_type.startswith("image/"):
+            check_batch_size(len(stored) + 1)
+            stored.append((upload.filename, store_file(upload.file, upload.filename)))
+        else:
+            raise HTTPException(status_code=400, detail=f"{upload.filename} must be an image or a zip archive")
+    return stored
+
+
+def check_batch_size(count: int):
+    if count > settings.batch_job_max_items:
+        raise HTTPException(
+            status_code=413,
+            detail=f"A batch may contain at most {settings.batch_job_max_items} images"
+        )
+
+
+async def collect_uploads(images: List[UploadFile]) -> List[Dict[str, Any]]:
+    stored = await asyncio.to_thread(_store_uploads, images)
+    if not stored:
+        raise HTTPException(status_code=400, detail="No images found in upload")
+
+    return [
+        {"filename": filename, "upload": upload}
+        for filename, upload in stored
+    ]
+
+
+@router.post("/infer/batch", status_code=202, dependencies=[Depends(require_inference)])
+async def create_batch(
+    images: List[UploadFile] = File(...),
+    adapter: Optional[str] = Form(None),
+    generation: Dict[str, Any] = Depends(generation_form)
+) -> Dict[str, Any]:
+    resolve_adapter(adapter)
+    uploads = await collect_uploads(images)
+    job = job_manager.submit(uploads, adapter=adapter, generation=generation)
+    return job.summary()
+
+
+def get_job_or_404(job_id: str):
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+@router.get("/infer/batch/{job_id}")
+async def get_batch(job_id: str) -> Dict[str, Any]:
+    return get_job_or_404(job_id).to_dict()
+
+
+@router.post("/infer/batch/{job_id}/cancel")
+async def cancel_batch(job_id: str) -> Dict[str, Any]:
+    job = get_job_or_404(job_id)
+    job_manager.cancel(job_id)
+    if job.task is not None and not job.task.done():
+        # Let the job record which items were cancelled
+        await asyncio.wait({job.task})
+    return job.summary()
+
+
+@router.get("/infer/batch/{job_id}/events")
+async def stream_batch(job_id: str) -> StreamingResponse:
+    job = get_job_or_404(job_id)
+
+    async def events():
+        async for event in job.events():
+            data = dict(event)
+            yield sse_event(data.pop("type"), data)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
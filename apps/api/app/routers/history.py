@@ -1,33 +1,38 @@
-from typing import List, Dict, Any
-from fastapi import APIRouter, Depends, Query
-from sqlalchemy.orm import Session
+from typing import List, Dict, Any, Optional
+from fastapi import APIRouter, Query, Response
 
-from ..db.base import get_db
+from ..core.config import settings
+from ..db.base import run_db
 from ..db.repository import InferenceRepository
+from ..services.thumbnails import thumbnail_path
+from ..services.uploads import upload_url
 
 router = APIRouter()
 
 
 @router.get("/history")
 async def get_history(
-    limit: int = Query(default=10, ge=1, le=50),
-    db: Session = Depends(get_db)
+    response: Response,
+    limit: int = Query(default=10, ge=1, le=settings.history_max_page_size),
+    before: Optional[int] = Query(default=None, ge=1)
 ) -> List[Dict[str, Any]]:
-    records = InferenceRepository.get_recent(db, limit=limit)
+    # One extra row tells whether another page follows
+    records = await run_db(InferenceRepository.get_page, limit + 1, before)
+    if len(records) > limit:
+        records = records[:limit]
+        response.headers["X-Next-Cursor"] = str(records[-1].id)
     
     history_items = []
-    import os
     for record in records:
-        filename = os.path.basename(record.image_path)
-        image_url = f"/api/uploads/{filename}"
-        
         history_items.append({
             "id": record.id,
-            "image_path": image_url,
-            "thumbnail_url": image_url,
+            "image_path": upload_url(record.image_path),
+            "thumbnail_url": upload_url(thumbnail_path(record.image_path)),
             "latex": record.latex_output,
             "tokens": record.tokens_used,
             "time_ms": record.time_ms,
+            "timings": record.timings,
+            "stop_reason": record.stop_reason,
             "created_at": record.created_at.isoformat() if record.created_at else None
         })
     
@@ -1,56 +1,175 @@
 import os
+import json
 import time
-from typing import Dict, Any
-from fastapi import APIRouter, UploadFile, File, HTTPException, Depends
-from sqlalchemy.orm import Session
+import asyncio
+from contextlib import aclosing
+from typing import Awaitable, Dict, Any, Optional, TypeVar
+from fastapi import APIRouter, Depends, Request, UploadFile, File, Form, HTTPException
+from fastapi.responses import StreamingResponse
 
-from app.db.base import get_db
-from app.db.repository import InferenceRepository
-from app.core.config import settings
-from app.services.infer import run_inference_service
+from app.services import metrics
+from app.services.infer import (
+    admission,
+    get_inference_stats,
+    require_inference,
+    resolve_generation,
+    run_inference_service,
+    run_page_inference_service,
+    stream_inference_service,
+)
+from app.services.records import record_writer, save_record
+from app.services.uploads import save_upload
 
 router = APIRouter()
 
+T = TypeVar("T")
 
-@router.post("/infer")
+
+def sse_event(event: str, data: Dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+async def cancel_on_disconnect(request: Request, awaitable: Awaitable[T]) -> T:
+    """Awaits ``awaitable``, cancelling it if the client disconnects first.
+
+    Cancelling the inference service stops its generation, so an abandoned
+    request does not keep a batch slot busy. The request body must have
+    been read already.
+    """
+
+    async def disconnected():
+        # Once the body has been read the server only sends the disconnect
+        while (await request.receive())["type"] != "http.disconnect":
+            pass
+
+    task = asyncio.ensure_future(awaitable)
+    watcher = asyncio.ensure_future(disconnected())
+    try:
+        await asyncio.wait({task, watcher}, return_when=asyncio.FIRST_COMPLETED)
+        if task.done():
+            return task.result()
+        task.cancel()
+        raise HTTPException(status_code=499, detail="Client disconnected")
+    finally:
+        task.cancel()
+        watcher.cancel()
+
+
+def generation_form(
+    max_new_tokens: Optional[int] = Form(None),
+    decoding: Optional[str] = Form(None),
+    temperature: Optional[float] = Form(None),
+    min_p: Optional[float] = Form(None),
+) -> Dict[str, Any]:
+    """Generation settings of one request, from its optional form fields."""
+    return resolve_generation(max_new_tokens=max_new_tokens, decoding=decoding, temperature=temperature, min_p=min_p)
+
+
+@router.post("/infer", dependencies=[Depends(require_inference)])
 async def infer(
+    request: Request,
     image: UploadFile = File(...),
-    db: Session = Depends(get_db)
+    adapter: Optional[str] = Form(None),
+    generation: Dict[str, Any] = Depends(generation_form)
 ) -> Dict[str, Any]:
-    if not image.content_type.startswith("image/"):
-        raise HTTPException(status_code=400, detail="File must be an image")
+    # Turned away before the upload is stored if the queue is full
+    admission.check()
+    upload = await save_upload(image)
     
-    upload_dir = settings.upload_dir
-    os.makedirs(upload_dir, exist_ok=True)
+    result = await cancel_on_disconnect(
+        request, run_inference_service(upload.path, adapter=adapter, image_hash=upload.sha256, generation=generation)
+    )
+    db_start = time.perf_counter()
+    record_id = await save_record(
+        image_path=upload.path,
+        latex_output=result["latex"],
+        tokens_used=result["tokens"],
+        time_ms=result["time_ms"],
+        timings=result["timings"],
+        stop_reason=result["stop_reason"]
+    )
+    result["timings"]["db_write_ms"] = round((time.perf_counter() - db_start) * 1000, 1)
+    metrics.observe_stages({"db_write_ms": result["timings"]["db_write_ms"]})
     
-    timestamp = int(time.time())
-    filename = f"{timestamp}_{image.filename}"
-    file_path = os.path.join(upload_dir, filename)
+    return {**result, "id": record_id}
+
+
+@router.post("/infer/page", dependencies=[Depends(require_inference)])
+async def infer_page(
+    request: Request,
+    image: UploadFile = File(...),
+    adapter: Optional[str] = Form(None),
+    generation: Dict[str, Any] = Depends(generation_form)
+) -> Dict[str, Any]:
+    """Converts each equation of a page separately, in reading order with bounding boxes."""
+    admission.check()
+    upload = await save_upload(image)
+
+    result = await cancel_on_disconnect(
+        request, run_page_inference_service(upload.path, adapter=adapter, image_hash=upload.sha256, generation=generation)
+    )
+    db_start = time.perf_counter()
+    record_id = await save_record(
+        image_path=upload.path,
+        latex_output=result["latex"],
+        tokens_used=result["tokens"],
+        time_ms=result["time_ms"],
+        timings=result["timings"]
+    )
+    result["timings"]["db_write_ms"] = round((time.perf_counter() - db_start) * 1000, 1)
+    metrics.observe_stages({"db_write_ms": result["timings"]["db_write_ms"]})
+
+    return {**result, "id": record_id}
+
+
+@router.post("/infer/stream", dependencies=[Depends(require_inference)])
+async def infer_stream(
+    image: UploadFile = File(...),
+    adapter: Optional[str] = Form(None),
+    generation: Dict[str, Any] = Depends(generation_form)
+) -> StreamingResponse:
+    # Streams report later rejections as error events, after the 200
+    admission.check()
+    upload = await save_upload(image)
     
-    with open(file_path, "wb") as buffer:
-        content = await image.read()
-        buffer.write(content)
+    async def events():
+        try:
+            async with aclosing(stream_inference_service(upload.path, adapter=adapter, image_hash=upload.sha256, generation=generation)) as stream:
+                async for event in stream:
+                    if event["type"] == "token":
+                        yield sse_event("token", {"text": event["text"]})
+                        continue
+                    db_start = time.perf_counter()
+                    record_id = await save_record(
+                        image_path=upload.path,
+                        latex_output=event["latex"],
+                        tokens_used=event["tokens"],
+                        time_ms=event["time_ms"],
+                        timings=event["timings"],
+                        stop_reason=event["stop_reason"]
+                    )
+                    done = {key: value for key, value in event.items() if key != "type"}
+                    done["timings"] = {**done["timings"], "db_write_ms": round((time.perf_counter() - db_start) * 1000, 1)}
+                    metrics.observe_stages({"db_write_ms": done["timings"]["db_write_ms"]})
+                    yield sse_event("done", {**done, "id": record_id})
+        except HTTPException as e:
+            error = {"status": e.status_code, "detail": e.detail}
+            if e.headers and "Retry-After" in e.headers:
+                error["retry_after"] = int(e.headers["Retry-After"])
+            yield sse_event("error", error)
+        except Exception as e:
+            yield sse_event("error", {"status": 500, "detail": f"Inference failed: {str(e)}"})
     
-    try:
-        latex_output, tokens_used, time_ms = await run_inference_service(file_path)
-    except HTTPException:
-        if os.path.exists(file_path):
-            os.remove(file_path)
-        raise
-    record = InferenceRepository.create(
-        db=db,
-        image_path=file_path,
-        latex_output=latex_output,
-        tokens_used=tokens_used,
-        time_ms=time_ms
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
     )
-    
-    return {
-        "latex": latex_output,
-        "tokens": tokens_used,
-        "time_ms": time_ms,
-        "id": record.id
-    }
+
+
+@router.get("/infer/stats")
+async def get_infer_stats() -> Dict[str, Any]:
+    return {**get_inference_stats(), "db_writes": record_writer.stats()}
 
 
 @router.get("/sample-images")
@@ -1,5 +1,6 @@
 import os
 import sys
+import asyncio
 from pathlib import Path
 from typing import Dict, Any, List
 from fastapi import APIRouter, HTTPException, Depends
@@ -11,6 +12,7 @@ project_root = Path(__file__).parent.parent.parent.parent.parent
 sys.path.insert(0, str(project_root))
 
 from models.inference.model_manager import model_manager
+from app.services.infer import clear_prompt_caches, reload_models, require_inference, resolve_generation
 
 router = APIRouter()
 
@@ -21,11 +23,12 @@ class ModelSwitchRequest(BaseModel):
 
 class GenerationSettings(BaseModel):
     max_new_tokens: int = 256
+    decoding: str = "greedy"
     temperature: float = 0.7
     min_p: float = 0.1
 
 
-@router.get("/models/current")
+@router.get("/models/current", dependencies=[Depends(require_inference)])
 async def get_current_model() -> Dict[str, Any]:
     return model_manager.get_current_model_info()
 
@@ -38,21 +41,29 @@ async def get_available_adapters() -> List[Dict[str, Any]]:
             "job_id": a["job_id"],
             "path": a["path"],
             "config": a["config"],
-            "name": os.path.basename(a["path"])
+            "name": os.path.basename(a["path"]),
+            "base_model": a["base_model"],
+            "compatible": a["compatible"],
+            "size": a["size"],
+            "checksum": a["checksum"],
+            "mtime": a["mtime"],
+            "resident": a["path"] in model_manager.resident_adapters
         }
         for a in adapters
     ]
 
 
-@router.post("/models/switch")
+@router.post("/models/switch", dependencies=[Depends(require_inference)])
 async def switch_model(request: ModelSwitchRequest) -> Dict[str, Any]:
+    # Switching waits for running generations and loads weights, so it runs off the event loop
     if request.adapter_path == "base":
-        success = model_manager.switch_to_base()
+        success = await asyncio.to_thread(model_manager.switch_to_base)
     else:
-        success = model_manager.load_adapter(request.adapter_path)
+        success = await asyncio.to_thread(model_manager.load_adapter, request.adapter_path)
     
     if not success:
         raise HTTPException(status_code=400, detail="Failed to switch model")
+    clear_prompt_caches()
     
     return {
         "message": "Model switched successfully",
@@ -60,20 +71,44 @@ async def switch_model(request: ModelSwitchRequest) -> Dict[str, Any]:
     }
 
 
+@router.post("/models/reload", dependencies=[Depends(require_inference)])
+async def reload_model() -> Dict[str, Any]:
+    try:
+        await asyncio.to_thread(reload_models)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to reload model: {str(e)}")
+    
+    return {
+        "message": "Model reloaded successfully",
+        "current_model": model_manager.get_current_model_info()
+    }
+
+
 @router.get("/models/settings")
-async def get_generation_settings() -> GenerationSettings:
-    return GenerationSettings(
-        max_new_tokens=settings.max_new_tokens,
-        temperature=settings.temperature,
-        min_p=settings.min_p
-    )
+async def get_generation_settings() -> Dict[str, Any]:
+    """The defaults of requests that do not set their own, and the limits they are checked against."""
+    return {
+        **GenerationSettings(
+            max_new_tokens=settings.max_new_tokens,
+            decoding=settings.decoding,
+            temperature=settings.temperature,
+            min_p=settings.min_p
+        ).model_dump(),
+        "limits": {
+            "max_new_tokens": settings.max_new_tokens_limit,
+            "temperature": settings.max_temperature,
+        },
+    }
 
 
 @router.put("/models/settings")
 async def update_generation_settings(
     settings_update: GenerationSettings
 ) -> GenerationSettings:
+    """Changes the server-wide defaults; a request's own form fields take precedence."""
+    resolve_generation(**settings_update.model_dump())
     settings.max_new_tokens = settings_update.max_new_tokens
+    settings.decoding = settings_update.decoding.lower()
     settings.temperature = settings_update.temperature
     settings.min_p = settings_update.min_p
     return settings_update
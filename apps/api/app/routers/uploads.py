@@ -0,0 +1,51 @@
+import os
+import re
+import asyncio
+from starlette.datastructures import Headers
+from starlette.exceptions import HTTPException
+from starlette.responses import FileResponse, Response
+from starlette.staticfiles import NotModifiedResponse, StaticFiles
+from starlette.types import Scope
+
+from ..core.config import settings
+from ..services.thumbnails import create_thumbnail, find_original
+
+# <sha256>.png and its thumbnails; their content never changes under the same name
+CONTENT_ADDRESSED = re.compile(r"^[0-9a-f]{64}(?P<thumbnail>\.thumb\d+q\d+)?\.\w+$")
+
+
+class UploadFiles(StaticFiles):
+    """Serves ``upload_dir``, rendering thumbnails on their first request."""
+
+    async def get_response(self, path: str, scope: Scope) -> Response:
+        # .tmp holds uploads that are still being written
+        if path.startswith("."):
+            raise HTTPException(status_code=404)
+        try:
+            return await super().get_response(path, scope)
+        except HTTPException as e:
+            if e.status_code != 404:
+                raise
+            original = find_original(path)
+            if original is None:
+                raise
+        try:
+            await asyncio.to_thread(create_thumbnail, original)
+        except Exception:
+            raise HTTPException(status_code=404)
+        return await super().get_response(path, scope)
+
+    def file_response(self, full_path, stat_result: os.stat_result, scope: Scope, status_code: int = 200) -> Response:
+        response = FileResponse(full_path, status_code=status_code, stat_result=stat_result)
+        name = os.path.basename(full_path)
+        match = CONTENT_ADDRESSED.match(name)
+        if match:
+            # The default ETag follows mtime, which re-uploads bump. An original
+            # is named by its hash; a thumbnail's name adds its size, quality
+            # and format, so variants of one image never share an ETag
+            etag = name if match.group("thumbnail") else os.path.splitext(name)[0]
+            response.headers["etag"] = f'"{etag}"'
+            response.headers["cache-control"] = f"public, max-age={settings.upload_cache_max_age}, immutable"
+        if self.is_not_modified(response.headers, Headers(scope=scope)):
+            return NotModifiedResponse(response.headers)
+        return response
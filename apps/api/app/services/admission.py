@@ -0,0 +1,139 @@
+import math
+import time
+import asyncio
+from collections import Counter, deque
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Deque, Dict
+from fastapi import HTTPException
+
+from app.services import metrics
+
+# In priority order: a waiting interactive request is admitted before any bulk one
+LANES = ("interactive", "bulk")
+
+
+class _Waiter:
+    __slots__ = ("lane", "weight", "future")
+
+    def __init__(self, lane: str, weight: int, future: asyncio.Future):
+        self.lane = lane
+        self.weight = weight
+        self.future = future
+
+
+class AdmissionController:
+    """Bounds the inference requests in progress and queues the rest by lane.
+
+    At most ``max_concurrency`` slots are held at a time; a request holds
+    one per image it generates. Interactive requests wait in a queue of at
+    most ``max_queue`` requests and for at most ``queue_timeout`` seconds;
+    beyond that they are turned away with 429 or 503 and a ``Retry-After``
+    estimated from how long slots are held. Bulk requests (batch jobs)
+    always wait, hold at most ``bulk_share`` of the slots, and are only
+    admitted when no interactive request is waiting, so interactive
+    requests never queue behind them.
+    """
+
+    def __init__(self, max_concurrency: int, max_queue: int = 32, queue_timeout: float = 10.0, bulk_share: float = 0.5):
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_queue = max(0, max_queue)
+        self.queue_timeout = queue_timeout
+        self.max_bulk = max(1, math.floor(self.max_concurrency * bulk_share))
+        self.in_use = {lane: 0 for lane in LANES}
+        self._waiters: Dict[str, Deque[_Waiter]] = {lane: deque() for lane in LANES}
+        self.admitted: Counter = Counter()
+        self.rejected: Counter = Counter()
+        self._wait_ms_total: Counter = Counter()
+        # Moving average of how long one slot is held, for Retry-After
+        self._hold_s = 1.0
+
+    def queued(self, lane: str) -> int:
+        return sum(1 for waiter in self._waiters[lane] if not waiter.future.done())
+
+    def _fits(self, lane: str, weight: int) -> bool:
+        used = sum(self.in_use.values())
+        if lane == "bulk" and self.in_use["bulk"] > 0 and self.in_use["bulk"] + weight > self.max_bulk:
+            return False
+        # A request heavier than the limit runs once nothing else does
+        return used + weight <= self.max_concurrency or used == 0
+
+    def _grant(self):
+        for lane in LANES:
+            waiters = self._waiters[lane]
+            while waiters and (waiters[0].future.done() or self._fits(lane, waiters[0].weight)):
+                waiter = waiters.popleft()
+                if not waiter.future.done():
+                    self.in_use[lane] += waiter.weight
+                    waiter.future.set_result(None)
+            if waiters and lane == "interactive":
+                return
+
+    def retry_after(self) -> int:
+        """Seconds until the queue ahead of a new request has likely drained."""
+        queued = sum(w.weight for waiters in self._waiters.values() for w in waiters if not w.future.done())
+        return max(1, math.ceil(self._hold_s * (queued + 1) / self.max_concurrency))
+
+    def _reject(self, lane: str, reason: str, status_code: int, detail: str):
+        self.rejected[(lane, reason)] += 1
+        metrics.admission_rejections.labels(lane, reason).inc()
+        raise HTTPException(status_code=status_code, detail=detail, headers={"Retry-After": str(self.retry_after())})
+
+    def check(self, lane: str = "interactive"):
+        """Raises 429 right away if a request on ``lane`` would be turned away now."""
+        if lane == "interactive" and self.queued(lane) >= self.max_queue and not self._fits(lane, 1):
+            self._reject(lane, "queue_full", 429, "Too many inference requests are queued")
+
+    @asynccontextmanager
+    async def slot(self, lane: str = "interactive", weight: int = 1) -> AsyncIterator[float]:
+        """Holds ``weight`` slots on ``lane``; yields how long admission took in ms."""
+        started = time.perf_counter()
+        weight = max(1, weight)
+        ahead = self.queued("interactive") if lane == "bulk" else self.queued(lane)
+        if not ahead and self._fits(lane, weight):
+            self.in_use[lane] += weight
+        else:
+            if lane == "interactive" and self.queued(lane) >= self.max_queue:
+                self._reject(lane, "queue_full", 429, "Too many inference requests are queued")
+            future = asyncio.get_running_loop().create_future()
+            self._waiters[lane].append(_Waiter(lane, weight, future))
+            timeout = self.queue_timeout if lane == "interactive" else None
+            try:
+                await asyncio.wait_for(future, timeout)
+            except asyncio.TimeoutError:
+                self._grant()
+                self._reject(lane, "queue_timeout", 503, f"No inference capacity within {self.queue_timeout}s")
+            except BaseException:
+                if future.done() and not future.cancelled():
+                    self.in_use[lane] -= weight
+                self._grant()
+                raise
+
+        waited = time.perf_counter() - started
+        self.admitted[lane] += 1
+        self._wait_ms_total[lane] += waited * 1000
+        metrics.admission_wait_seconds.labels(lane).observe(waited)
+        held_from = time.perf_counter()
+        try:
+            yield waited * 1000
+        finally:
+            self.in_use[lane] -= weight
+            self._hold_s = 0.9 * self._hold_s + 0.1 * (time.perf_counter() - held_from)
+            self._grant()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "max_bulk": self.max_bulk,
+            "retry_after_s": self.retry_after(),
+            "lanes": {
+                lane: {
+                    "in_use": self.in_use[lane],
+                    "queued": self.queued(lane),
+                    "admitted": self.admitted[lane],
+                    "rejected": {reason: count for (l, reason), count in self.rejected.items() if l == lane},
+                    "avg_wait_ms": self._wait_ms_total[lane] / self.admitted[lane] if self.admitted[lane] else 0.0,
+                }
+                for lane in LANES
+            },
+        }
@@ -0,0 +1,171 @@
+import asyncio
+import time
+import threading
+from collections import Counter, deque
+from concurrent.futures import Executor
+from typing import Any, Callable, Dict, Hashable, List, Optional
+
+
+class _Pending:
+    __slots__ = ("item", "key", "future", "enqueued_at")
+
+    def __init__(self, item: Any, key: Hashable, future: asyncio.Future):
+        self.item = item
+        self.key = key
+        self.future = future
+        self.enqueued_at = time.monotonic()
+
+
+class BatchScheduler:
+    """Collects concurrent requests into batches for a single blocking call.
+
+    ``run_batch`` receives a list of items and must return one result per
+    item, in order. It runs in a worker thread (of ``executor`` if given) so
+    the event loop stays free.
+    Only items submitted with the same ``key`` are batched together, and at
+    most ``max_concurrency`` batches (or ``reserve``d generations) run at
+    the same time.
+    """
+
+    def __init__(self, run_batch: Callable[[List[Any]], List[Any]], max_batch_size: int = 8, max_wait_ms: float = 10.0, max_concurrency: int = 1, executor: Optional[Executor] = None):
+        self.run_batch = run_batch
+        self.executor = executor
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait_ms = max(0.0, max_wait_ms)
+        self.max_concurrency = max(1, max_concurrency)
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._deferred: deque = deque()
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._tasks: set = set()
+        self._in_flight = 0
+        self._batches_total = 0
+        self._items_total = 0
+        self._batch_sizes: Counter = Counter()
+        self._queue_wait_ms_total = 0.0
+
+    def _ensure_worker(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop or self._worker is None or self._worker.done():
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            self._deferred = deque()
+            self._slots = asyncio.Semaphore(self.max_concurrency)
+            self._worker = loop.create_task(self._run())
+
+    async def submit(self, item: Any, key: Hashable = None) -> Any:
+        self._ensure_worker()
+        future = self._loop.create_future()
+        await self._queue.put(_Pending(item, key, future))
+        return await future
+
+    async def reserve(self) -> Callable[[], None]:
+        """Takes one of the ``max_concurrency`` slots for a generation run
+        outside a batch, such as a stream, so that the limit covers it too.
+
+        Returns the function that gives the slot back; it may be called from
+        any thread, and only its first call counts.
+        """
+        self._ensure_worker()
+        await self._slots.acquire()
+        self._in_flight += 1
+        loop, slots = self._loop, self._slots
+        lock = threading.Lock()
+        released = False
+
+        def release():
+            nonlocal released
+            with lock:
+                if released:
+                    return
+                released = True
+            loop.call_soon_threadsafe(self._release_reserved, slots)
+
+        return release
+
+    def _release_reserved(self, slots: asyncio.Semaphore):
+        self._in_flight -= 1
+        slots.release()
+
+    async def _collect(self, first: _Pending) -> List[_Pending]:
+        batch = [first]
+        # Items held back from earlier rounds go first, in arrival order
+        for pending in list(self._deferred):
+            if len(batch) >= self.max_batch_size:
+                break
+            if pending.key == first.key:
+                batch.append(pending)
+                self._deferred.remove(pending)
+
+        deadline = self._loop.time() + self.max_wait_ms / 1000.0
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - self._loop.time()
+            if timeout <= 0:
+                break
+            try:
+                pending = await asyncio.wait_for(self._queue.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+            if pending.key == first.key:
+                batch.append(pending)
+            else:
+                self._deferred.append(pending)
+        return batch
+
+    async def _run(self):
+        while True:
+            first = self._deferred.popleft() if self._deferred else await self._queue.get()
+            # Taken once there is work, so an idle scheduler holds no slot
+            # that a reserved generation could use; items queued meanwhile
+            # join the batch
+            await self._slots.acquire()
+            batch = await self._collect(first)
+            # Requests that timed out or were abandoned while queued are dropped
+            batch = [p for p in batch if not p.future.done()]
+            if not batch:
+                self._slots.release()
+                continue
+
+            now = time.monotonic()
+            self._batches_total += 1
+            self._items_total += len(batch)
+            self._batch_sizes[len(batch)] += 1
+            self._queue_wait_ms_total += sum((now - p.enqueued_at) * 1000 for p in batch)
+            task = self._loop.create_task(self._execute(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _execute(self, batch: List[_Pending]):
+        self._in_flight += len(batch)
+        try:
+            items = [p.item for p in batch]
+            if self.executor is not None:
+                results = await self._loop.run_in_executor(self.executor, self.run_batch, items)
+            else:
+                results = await asyncio.to_thread(self.run_batch, items)
+        except Exception as e:
+            for p in batch:
+                if not p.future.done():
+                    p.future.set_exception(e)
+        else:
+            for p, result in zip(batch, results):
+                if not p.future.done():
+                    p.future.set_result(result)
+        finally:
+            self._in_flight -= len(batch)
+            self._slots.release()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queue_depth": (self._queue.qsize() if self._queue is not None else 0) + len(self._deferred),
+            "in_flight": self._in_flight,
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait_ms,
+            "max_concurrency": self.max_concurrency,
+            "batches_total": self._batches_total,
+            "items_total": self._items_total,
+            "avg_batch_size": self._items_total / self._batches_total if self._batches_total else 0.0,
+            "avg_queue_wait_ms": self._queue_wait_ms_total / self._items_total if self._items_total else 0.0,
+            "batch_size_histogram": {str(size): count for size, count in sorted(self._batch_sizes.items())},
+        }
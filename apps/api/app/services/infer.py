@@ -1,130 +1,711 @@
-import os
 import sys
 import time
+import asyncio
+import threading
+from contextlib import aclosing
+from queue import Empty
 from pathlib import Path
-from typing import Tuple
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple
 from fastapi import HTTPException
 from PIL import Image
-import torch
 
 project_root = Path(__file__).parent.parent.parent.parent.parent
 sys.path.insert(0, str(project_root))
 
+from models.inference.cancellation import CancelToken
+from models.inference.cpu_profile import CPUProfile
 from models.inference.model_manager import model_manager
+from models.inference.layout import LayoutConfig, load_page
+from models.inference.preprocess import PreprocessConfig, load_image
+from models.inference.result_cache import build_result_cache, hash_file, make_cache_key
+from models.inference.runners import build_runner, start_stream
+from models.inference.stopping import StoppingConfig
+from models.inference.worker_pool import WorkerPool
 from app.core.config import settings
+from app.services import metrics
+from app.services.admission import AdmissionController
+from app.services.batching import BatchScheduler
 
+DECODING_MODES = ("greedy", "sample")
 
-async def run_inference_service(image_path: str) -> Tuple[str, int, int]:
+
+def get_cpu_profile() -> CPUProfile:
+    return CPUProfile(
+        settings.cpu_profile,
+        compile=settings.cpu_compile,
+        intra_op_threads=settings.torch_intra_op_threads,
+        inter_op_threads=settings.torch_inter_op_threads,
+    )
+
+
+model_manager.cpu_profile = get_cpu_profile()
+vision_cache_options = {
+    "max_bytes": settings.vision_cache_max_bytes,
+    "disk_dir": settings.vision_cache_dir,
+    "disk_max_bytes": settings.vision_cache_disk_max_bytes,
+}
+runner_options: Dict[str, Any] = {}
+if settings.inference_runner == "model":
+    runner_options = {
+        "cpu_profile": model_manager.cpu_profile,
+        "prompt_prefix_cache": settings.prompt_prefix_cache,
+        "vision_cache": vision_cache_options,
+    }
+elif settings.inference_runner == "stub":
+    runner_options = {
+        "prefill_ms": settings.stub_prefill_ms,
+        "token_ms": settings.stub_token_ms,
+        "tokens": settings.stub_tokens,
+    }
+
+worker_pool = None
+runner = None
+if settings.control_plane_only:
+    # Serves history, samples and metrics only; torch is never imported
+    model_manager.in_process = False
+elif settings.inference_workers > 0:
+    worker_pool = WorkerPool(
+        settings.inference_workers,
+        runner=settings.inference_runner,
+        runner_options=runner_options,
+        threads_per_worker=settings.inference_worker_threads,
+        pin_cpus=settings.inference_worker_pin_cpus,
+        health_timeout=settings.inference_worker_health_timeout,
+    )
+else:
+    runner = build_runner(settings.inference_runner, **runner_options)
+if worker_pool is not None or settings.inference_runner != "model":
+    model_manager.in_process = False
+model_manager.listeners.append(metrics.record_model_event)
+if worker_pool is not None:
+    worker_pool.listeners.append(metrics.record_model_event)
+
+
+def _run_batch(items: List[Tuple[Image.Image, Dict[str, Any], Optional[str], float, CancelToken]]) -> List[Tuple[str, int, Dict[str, float], str]]:
+    _, generation, adapter_path, _, _ = items[0]
+    # Rows of one batch may have different limits, see batch_key
+    generation = {**generation, "max_new_tokens": [item[1]["max_new_tokens"] for item in items]}
+    images = [item[0] for item in items]
+    cancel_tokens = [item[4] for item in items]
+    started = time.perf_counter()
+    if worker_pool is not None:
+        results = worker_pool.run_batch(images, generation, adapter_path, cancel_tokens)
+    else:
+        results = runner.run_batch(images, generation, adapter_path, cancel_tokens)
+    return [
+        (text, tokens, {**timings, "queue_ms": (started - item[3]) * 1000}, reason)
+        for (text, tokens, timings, reason), item in zip(results, items)
+    ]
+
+
+scheduler = BatchScheduler(
+    _run_batch,
+    max_batch_size=settings.batch_max_size,
+    max_wait_ms=settings.batch_max_wait_ms,
+    max_concurrency=worker_pool.num_workers if worker_pool is not None else model_manager.num_replicas,
+)
+
+# In front of the scheduler, so a burst is queued (or turned away) here
+# instead of piling up in the scheduler until every request times out
+admission = AdmissionController(
+    settings.admission_max_concurrency or scheduler.max_concurrency * scheduler.max_batch_size,
+    max_queue=settings.admission_max_queue,
+    queue_timeout=settings.admission_queue_timeout,
+    bulk_share=settings.admission_bulk_share,
+)
+
+result_cache = build_result_cache(
+    settings.result_cache_backend,
+    settings.result_cache_dir,
+    memory_entries=settings.result_cache_memory_entries,
+    max_bytes=settings.result_cache_max_bytes,
+    ttl_seconds=settings.result_cache_ttl,
+)
+
+
+def require_inference():
+    """Dependency of the routes that need the model."""
+    if settings.control_plane_only:
+        raise HTTPException(status_code=503, detail="Inference is disabled on this control-plane-only instance")
+
+
+def get_inference_stats() -> Dict[str, Any]:
+    return {
+        "scheduler": scheduler.stats(),
+        "admission": admission.stats(),
+        "models": model_manager.get_stats(),
+        "workers": worker_pool.stats() if worker_pool is not None else None,
+        "cache": result_cache.stats() if result_cache is not None else None,
+    }
+
+
+def refresh_metrics():
+    metrics.update_gauges(
+        scheduler.stats(),
+        len(model_manager.resident_adapters),
+        worker_pool.stats()["workers"] if worker_pool is not None else None,
+        admission.stats(),
+    )
+
+
+def get_preprocess_config() -> Optional[PreprocessConfig]:
+    if not settings.preprocess:
+        return None
+    return PreprocessConfig(
+        crop=settings.preprocess_crop,
+        max_pixels=settings.preprocess_max_pixels,
+        max_vision_tokens=settings.preprocess_max_vision_tokens,
+        grayscale=settings.preprocess_grayscale,
+    )
+
+
+def get_layout_config() -> LayoutConfig:
+    return LayoutConfig(
+        min_line_gap=settings.page_min_line_gap,
+        min_column_gap=settings.page_min_column_gap,
+        max_regions=settings.page_max_regions,
+    )
+
+
+def get_stopping_config() -> StoppingConfig:
+    return StoppingConfig(
+        repetition=settings.stop_on_repetition,
+        max_ngram=settings.stop_repetition_max_ngram,
+        min_repeated_tokens=settings.stop_repetition_min_tokens,
+        latex_complete=settings.stop_on_complete_latex,
+        adaptive_budget=settings.adaptive_token_budget,
+        budget_base=settings.token_budget_base,
+        budget_per_vision_token=settings.token_budget_per_vision_token,
+        budget_per_aspect=settings.token_budget_per_aspect,
+        budget_max=settings.max_new_tokens_limit,
+    )
+
+
+def get_generation_settings(
+    max_new_tokens: Optional[int] = None,
+    decoding: Optional[str] = None,
+    temperature: Optional[float] = None,
+    min_p: Optional[float] = None,
+) -> Dict[str, Any]:
+    """The generation settings of one request: the server defaults, overridden
+    by the values it sets. Raises ValueError beyond the server's limits.
+
+    Greedy decoding is deterministic, so only its results are cached. It
+    ignores ``temperature`` and ``min_p``, so greedy requests share batches
+    whatever they set them to.
+    """
+    explicit = max_new_tokens is not None
+    max_new_tokens = settings.max_new_tokens if max_new_tokens is None else max_new_tokens
+    decoding = (decoding or settings.decoding).lower()
+    if not 1 <= max_new_tokens <= settings.max_new_tokens_limit:
+        raise ValueError(f"max_new_tokens must be between 1 and {settings.max_new_tokens_limit}")
+    if decoding not in DECODING_MODES:
+        raise ValueError(f"decoding must be one of {', '.join(DECODING_MODES)}")
+    if decoding == "greedy":
+        temperature = min_p = 0.0
+    else:
+        temperature = settings.temperature if temperature is None else temperature
+        min_p = settings.min_p if min_p is None else min_p
+        if not 0 < temperature <= settings.max_temperature:
+            raise ValueError(f"temperature must be above 0 and at most {settings.max_temperature}")
+        if not 0 <= min_p < 1:
+            raise ValueError("min_p must be at least 0 and below 1")
+    stopping = get_stopping_config()
+    if explicit:
+        # The adaptive budget replaces the server default, never what a request asked for
+        stopping.adaptive_budget = False
+    return {
+        "max_new_tokens": max_new_tokens,
+        "temperature": temperature,
+        "min_p": min_p,
+        "stopping": stopping,
+    }
+
+
+def resolve_generation(**overrides: Any) -> Dict[str, Any]:
+    try:
+        return get_generation_settings(**overrides)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+def is_deterministic(generation: Dict[str, Any]) -> bool:
+    return generation["temperature"] <= 0
+
+
+def batch_key(generation: Dict[str, Any]) -> Tuple:
+    """Requests with equal keys can share a batch.
+
+    Greedy rows stop at their own ``max_new_tokens``, so it is left out of
+    their key; sampled rows share one temperature and must match exactly.
+    """
+    if is_deterministic(generation):
+        generation = {name: value for name, value in generation.items() if name != "max_new_tokens"}
+    return tuple(sorted(generation.items()))
+
+
+def resolve_adapter(adapter: Optional[str]) -> Optional[str]:
+    try:
+        return model_manager.resolve_adapter(adapter)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+def result_cache_key(
+    image_hash: str,
+    generation: Dict[str, Any],
+    adapter_path: Optional[str],
+    preprocess: Optional[PreprocessConfig],
+) -> str:
+    return make_cache_key(
+        image_hash,
+        model_manager.get_model_identity(adapter_path or "base"),
+        {
+            **generation,
+            "stopping": generation["stopping"].to_dict(),
+            "preprocess": preprocess.to_dict() if preprocess else None,
+        },
+    )
+
+
+async def _lookup_cache(
+    image_path: str,
+    generation: Dict[str, Any],
+    adapter_path: Optional[str],
+    preprocess: Optional[PreprocessConfig],
+    image_hash: Optional[str] = None,
+) -> Tuple[Optional[str], Optional[Dict[str, Any]]]:
+    # Sampled outputs differ from one request to the next
+    if result_cache is None or not is_deterministic(generation):
+        return None, None
+    if image_hash is None:
+        image_hash = await asyncio.to_thread(hash_file, image_path)
+    cache_key = result_cache_key(image_hash, generation, adapter_path, preprocess)
+    cached = await asyncio.to_thread(result_cache.get, cache_key)
+    metrics.cache_lookups.labels("miss" if cached is None else "hit").inc()
+    return cache_key, cached
+
+
+async def _store_cache(cache_key: Optional[str], result: Dict[str, Any]):
+    if cache_key is not None:
+        await asyncio.to_thread(result_cache.set, cache_key, result)
+
+
+def load_models(timeout: Optional[float] = None) -> bool:
+    """Loads the base model, or waits for every inference worker to load it."""
+    if worker_pool is not None:
+        return worker_pool.wait_ready(timeout, all_workers=True)
+    runner.load()
+    return True
+
+
+def reload_models():
+    if worker_pool is not None:
+        worker_pool.restart()
+    elif settings.inference_runner == "model":
+        model_manager.reload()
+
+
+def clear_prompt_caches():
+    """Drops the cached prompts and prompt prefixes here and in every worker."""
+    model_manager.clear_prompt_caches()
+    if worker_pool is not None:
+        worker_pool.clear_prompt_caches()
+
+
+def stage_timings(image_info: Dict[str, Any], **stages: float) -> Dict[str, float]:
+    timings = {"decode_ms": image_info["decode_ms"], "preprocess_ms": image_info["preprocess_ms"], **stages}
+    return {stage: round(ms, 1) for stage, ms in timings.items()}
+
+
+async def _ensure_model_loaded():
+    try:
+        if worker_pool is not None:
+            if not await asyncio.to_thread(worker_pool.wait_ready, 300.0):
+                raise asyncio.TimeoutError()
+            return
+        return await asyncio.wait_for(
+            asyncio.to_thread(runner.load),
+            timeout=300.0
+        )
+    except asyncio.TimeoutError:
+        raise HTTPException(
+            status_code=504,
+            detail="Model loading timed out"
+        )
+
+
+def _submit(image: Image.Image, generation: Dict[str, Any], adapter_path: Optional[str], cancel_token: CancelToken):
+    return scheduler.submit(
+        (image, generation, adapter_path, time.perf_counter(), cancel_token),
+        key=(adapter_path, batch_key(generation))
+    )
+
+
+async def run_inference_service(
+    image_path: str,
+    adapter: Optional[str] = None,
+    image_hash: Optional[str] = None,
+    endpoint: str = "infer",
+    lane: str = "interactive",
+    generation: Optional[Dict[str, Any]] = None,
+) -> Dict[str, Any]:
+    """``endpoint`` labels the request in the metrics; ``lane`` is its admission lane.
+
+    ``generation`` comes from ``get_generation_settings``; the server defaults without it.
+    """
     start_time = time.time()
-    
+    # Stops the generation if nobody is waiting for it any more: on
+    # timeout, or when the caller is cancelled (client disconnects)
+    cancel_token = CancelToken()
+
     try:
-        device = "cuda" if torch.cuda.is_available() else "cpu"
-        
-        import asyncio
-        try:
-            model, tokenizer = await asyncio.wait_for(
-                asyncio.to_thread(model_manager.get_model_and_tokenizer),
-                timeout=300.0
-            )
-        except asyncio.TimeoutError:
+        generation = generation or get_generation_settings()
+        adapter_path = resolve_adapter(adapter)
+        preprocess = get_preprocess_config()
+
+        cache_key, cached = await _lookup_cache(image_path, generation, adapter_path, preprocess, image_hash)
+        cache_ms = (time.time() - start_time) * 1000
+        if cached is not None:
+            timings = {"cache_ms": round(cache_ms, 1)}
+            metrics.observe_request(endpoint, time.time() - start_time, timings, cached=True)
+            return {
+                **cached,
+                "time_ms": int((time.time() - start_time) * 1000),
+                "cached": True,
+                "timings": timings,
+            }
+
+        async with admission.slot(lane) as admission_ms:
+            await _ensure_model_loaded()
+
+            inference_timeout = settings.inference_timeout
+
+            image, image_info = await asyncio.to_thread(load_image, image_path, preprocess)
+
+            try:
+                generated_text, tokens_used, timings, stop_reason = await asyncio.wait_for(
+                    _submit(image, generation, adapter_path, cancel_token),
+                    timeout=inference_timeout
+                )
+            except asyncio.TimeoutError:
+                cancel_token.cancel()
+                raise HTTPException(
+                    status_code=504,
+                    detail=f"Inference timed out after {inference_timeout}s"
+                )
+
+        result = {
+            "latex": generated_text,
+            "tokens": tokens_used,
+            "time_ms": int((time.time() - start_time) * 1000),
+            "vision_tokens": image_info["vision_tokens"],
+            "stop_reason": stop_reason,
+        }
+        await _store_cache(cache_key, result)
+
+        timings = stage_timings(image_info, cache_ms=cache_ms, admission_ms=admission_ms, **timings)
+        metrics.observe_request(endpoint, time.time() - start_time, timings, tokens=tokens_used, stop_reason=stop_reason)
+        return {**result, "cached": False, "timings": timings}
+
+    except asyncio.CancelledError:
+        cancel_token.cancel()
+        metrics.observe_failure(endpoint, 499)
+        raise
+    except HTTPException as e:
+        metrics.observe_failure(endpoint, e.status_code)
+        raise
+    except Exception as e:
+        metrics.observe_failure(endpoint, 500)
+        raise HTTPException(
+            status_code=500,
+            detail=f"Inference failed: {str(e)}"
+        )
+
+
+async def run_page_inference_service(
+    image_path: str,
+    adapter: Optional[str] = None,
+    image_hash: Optional[str] = None,
+    generation: Optional[Dict[str, Any]] = None,
+) -> Dict[str, Any]:
+    """Converts every equation region of a page, see models.inference.layout.
+
+    The regions are submitted together, so the scheduler batches them and
+    runs the batches in parallel. Results are in reading order.
+    """
+    start_time = time.time()
+    cancel_tokens: List[CancelToken] = []
+
+    try:
+        generation = generation or get_generation_settings()
+        adapter_path = resolve_adapter(adapter)
+        preprocess = get_preprocess_config()
+        layout = get_layout_config()
+
+        cache_key, cached = await _lookup_cache(
+            image_path, {**generation, "layout": layout.to_dict()}, adapter_path, preprocess, image_hash
+        )
+        cache_ms = (time.time() - start_time) * 1000
+        if cached is not None:
+            timings = {"cache_ms": round(cache_ms, 1)}
+            metrics.observe_request("page", time.time() - start_time, timings, cached=True)
+            return {
+                **cached,
+                "time_ms": int((time.time() - start_time) * 1000),
+                "cached": True,
+                "timings": timings,
+            }
+
+        regions, page_info = await asyncio.to_thread(load_page, image_path, layout, preprocess)
+        if len(regions) > layout.max_regions:
             raise HTTPException(
-                status_code=504,
-                detail="Model loading timed out"
+                status_code=400,
+                detail=f"Page has {len(regions)} regions, more than the limit of {layout.max_regions}"
             )
-        
-        inference_timeout = 60.0
-        
-        image = Image.open(image_path).convert('RGB')
-        
-        instruction = "Write the LaTeX representation for this image."
-        messages = [
+
+        results = []
+        admission_ms = generate_ms = 0.0
+        if regions:
+            # One slot per region, as each is a generation of its own
+            async with admission.slot("interactive", weight=len(regions)) as admission_ms:
+                await _ensure_model_loaded()
+                cancel_tokens = [CancelToken() for _ in regions]
+                generate_start = time.perf_counter()
+                inference_timeout = settings.inference_timeout
+                try:
+                    results = await asyncio.wait_for(
+                        asyncio.gather(*(
+                            _submit(crop, generation, adapter_path, token)
+                            for (_, crop, _), token in zip(regions, cancel_tokens)
+                        )),
+                        timeout=inference_timeout
+                    )
+                except asyncio.TimeoutError:
+                    for token in cancel_tokens:
+                        token.cancel()
+                    raise HTTPException(
+                        status_code=504,
+                        detail=f"Inference timed out after {inference_timeout}s"
+                    )
+                generate_ms = (time.perf_counter() - generate_start) * 1000
+
+        region_results = [
             {
-                "role": "user",
-                "content": [
-                    {"type": "text", "text": instruction},
-                    {"type": "image", "image": image}
-                ]
+                "bbox": list(box),
+                "latex": text,
+                "tokens": tokens,
+                "vision_tokens": info["vision_tokens"],
+                "stop_reason": reason,
             }
+            for (box, _, info), (text, tokens, _, reason) in zip(regions, results)
         ]
-        
-        is_processor = hasattr(tokenizer, 'tokenizer')
-        
-        if is_processor:
-            messages_qwen = [
-                {
-                    "role": "user",
-                    "content": [
-                        {"type": "image"},
-                        {"type": "text", "text": instruction}
-                    ]
-                }
-            ]
-            text = tokenizer.apply_chat_template(messages_qwen, tokenize=False, add_generation_prompt=True)
-            inputs = tokenizer(
-                text=[text],
-                images=[image],
-                return_tensors="pt",
-                padding=True
-            ).to(device)
-            eos_token_id = getattr(model.config, 'eos_token_id', None)
-            input_ids_len = inputs['input_ids'].shape[1]
-        else:
-            input_text = tokenizer.apply_chat_template(messages, add_generation_prompt=True)
-            inputs = tokenizer(
-                image, input_text,
-                add_special_tokens=False,
-                return_tensors="pt",
-            ).to(device)
-            eos_token_id = getattr(tokenizer, 'eos_token_id', None) or getattr(model.config, 'eos_token_id', None)
-            input_ids_len = inputs['input_ids'].shape[1]
-        
-        max_tokens = min(settings.max_new_tokens, 128)
-        
-        def run_generation():
-            with torch.no_grad():
-                if is_processor:
-                    # Qwen2VL requires all inputs from processor
-                    return model.generate(
-                        **inputs,
-                        max_new_tokens=max_tokens,
-                        temperature=settings.temperature,
-                        do_sample=True,
-                        eos_token_id=eos_token_id
-                    )
-                else:
-                    return model.generate(
-                        **inputs,
-                        max_new_tokens=max_tokens,
-                        use_cache=True,
-                        temperature=settings.temperature,
-                        min_p=settings.min_p,
-                        do_sample=True,
-                        pad_token_id=eos_token_id
-                    )
-        
-        try:
-            outputs = await asyncio.wait_for(
-                asyncio.to_thread(run_generation),
-                timeout=inference_timeout
-            )
-        except asyncio.TimeoutError:
-            raise HTTPException(
-                status_code=504,
-                detail=f"Inference timed out after {inference_timeout}s"
-            )
-        
-        if hasattr(tokenizer, 'decode'):
-            generated_text = tokenizer.decode(outputs[0][input_ids_len:], skip_special_tokens=True)
-        else:
-            generated_text = tokenizer.tokenizer.decode(outputs[0][input_ids_len:], skip_special_tokens=True)
-        
-        tokens_used = len(outputs[0]) - len(inputs['input_ids'][0])
-        time_ms = int((time.time() - start_time) * 1000)
-        
-        return generated_text.strip(), tokens_used, time_ms
-        
+        tokens_used = sum(region["tokens"] for region in region_results)
+        result = {
+            "latex": "\n".join(region["latex"] for region in region_results),
+            "tokens": tokens_used,
+            "time_ms": int((time.time() - start_time) * 1000),
+            "size": page_info["size"],
+            "regions": region_results,
+        }
+        await _store_cache(cache_key, result)
+
+        timings = {
+            "cache_ms": cache_ms,
+            "decode_ms": page_info["decode_ms"],
+            "layout_ms": page_info["layout_ms"],
+            "preprocess_ms": page_info["preprocess_ms"],
+            "admission_ms": admission_ms,
+            "generate_ms": generate_ms,
+        }
+        timings = {stage: round(ms, 1) for stage, ms in timings.items()}
+        metrics.observe_request("page", time.time() - start_time, timings, tokens=tokens_used)
+        for region in region_results:
+            metrics.stop_reasons.labels(region["stop_reason"]).inc()
+        return {**result, "cached": False, "timings": timings}
+
+    except asyncio.CancelledError:
+        for token in cancel_tokens:
+            token.cancel()
+        metrics.observe_failure("page", 499)
+        raise
+    except HTTPException as e:
+        metrics.observe_failure("page", e.status_code)
+        raise
     except Exception as e:
+        for token in cancel_tokens:
+            token.cancel()
+        metrics.observe_failure("page", 500)
         raise HTTPException(
             status_code=500,
             detail=f"Inference failed: {str(e)}"
         )
+
+
+async def _start_stream(
+    image: Image.Image,
+    generation: Dict[str, Any],
+    adapter_path: Optional[str],
+    inference_timeout: float,
+    cancel_token: CancelToken,
+):
+    if worker_pool is not None:
+        return worker_pool.stream(image, generation, adapter_path, timeout=inference_timeout, cancel_token=cancel_token)
+    if settings.inference_runner != "model":
+        return start_stream(runner, image, generation, adapter_path, timeout=inference_timeout, cancel_token=cancel_token)
+    handle = await asyncio.to_thread(model_manager.acquire, adapter_path or "base")
+    try:
+        # The handle is released by the generation thread once it has
+        # finished, even if this consumer goes away first
+        from models.inference.generation import generate_stream
+
+        return await asyncio.to_thread(
+            generate_stream,
+            handle.model,
+            handle.tokenizer,
+            image,
+            timeout=inference_timeout,
+            on_done=handle.release,
+            cancel_token=cancel_token,
+            prefix_cache=handle.prefix_cache,
+            vision_cache=handle.vision_cache,
+            **generation
+        )
+    except Exception:
+        handle.release()
+        raise
+
+
+def _release_when_stopped(stream, release: Callable[[], None]):
+    """Calls ``release`` once a cancelled stream's generation has stopped."""
+
+    def wait():
+        try:
+            stream.wait()
+        except Exception:
+            pass
+        finally:
+            release()
+
+    threading.Thread(target=wait, daemon=True).start()
+
+
+async def stream_inference_service(
+    image_path: str,
+    adapter: Optional[str] = None,
+    image_hash: Optional[str] = None,
+    generation: Optional[Dict[str, Any]] = None,
+) -> AsyncIterator[Dict[str, Any]]:
+    """Yields ``token`` events with decoded fragments, then one ``done`` event.
+
+    ``image_hash`` is the image's sha256 if the caller already knows it.
+    """
+    try:
+        # Closed right away if the consumer goes away, which cancels the generation
+        async with aclosing(_stream_inference(image_path, adapter, image_hash, generation)) as events:
+            async for event in events:
+                yield event
+    except (asyncio.CancelledError, GeneratorExit):
+        metrics.observe_failure("stream", 499)
+        raise
+    except HTTPException as e:
+        metrics.observe_failure("stream", e.status_code)
+        raise
+    except Exception:
+        metrics.observe_failure("stream", 500)
+        raise
+
+
+async def _stream_inference(
+    image_path: str, adapter: Optional[str], image_hash: Optional[str], generation: Optional[Dict[str, Any]]
+) -> AsyncIterator[Dict[str, Any]]:
+    start_time = time.time()
+    generation = generation or get_generation_settings()
+    adapter_path = resolve_adapter(adapter)
+    preprocess = get_preprocess_config()
+
+    cache_key, cached = await _lookup_cache(image_path, generation, adapter_path, preprocess, image_hash)
+    cache_ms = (time.time() - start_time) * 1000
+    if cached is not None:
+        timings = {"cache_ms": round(cache_ms, 1)}
+        metrics.observe_request("stream", time.time() - start_time, timings, cached=True)
+        yield {"type": "token", "text": cached["latex"]}
+        yield {
+            "type": "done",
+            **cached,
+            "time_ms": int((time.time() - start_time) * 1000),
+            "cached": True,
+            "timings": timings,
+        }
+        return
+
+    # Held until the stream finishes, or its consumer goes away
+    async with admission.slot("interactive") as admission_ms:
+        await _ensure_model_loaded()
+        image, image_info = await asyncio.to_thread(load_image, image_path, preprocess)
+        inference_timeout = settings.inference_timeout
+        deadline = start_time + inference_timeout
+
+        submitted_at = time.perf_counter()
+        # Cancelled unless the stream runs to completion, so the generation
+        # stops when the client disconnects or the stream times out
+        cancel_token = CancelToken()
+        # Counts against the scheduler's concurrency like a batch does
+        release_slot = await scheduler.reserve()
+        try:
+            stream = await _start_stream(image, generation, adapter_path, inference_timeout, cancel_token)
+        except BaseException:
+            release_slot()
+            raise
+        fragments = iter(stream)
+        completed = False
+        try:
+            while True:
+                try:
+                    text = await asyncio.to_thread(next, fragments, None)
+                except Empty:
+                    raise HTTPException(
+                        status_code=504,
+                        detail=f"Inference timed out after {inference_timeout}s"
+                    )
+                if text is None:
+                    break
+                if text:
+                    yield {"type": "token", "text": text}
+                if time.time() > deadline:
+                    raise HTTPException(
+                        status_code=504,
+                        detail=f"Inference timed out after {inference_timeout}s"
+                    )
+            tokens_used = await asyncio.to_thread(stream.wait)
+            completed = True
+            stop_reason = stream.stop_reason()
+        finally:
+            if completed:
+                release_slot()
+            else:
+                cancel_token.cancel()
+                _release_when_stopped(stream, release_slot)
+
+    timings = stream.timings()
+    # Waiting for a replica or worker is the part of the stream's lifetime
+    # that its stages do not account for
+    generation_ms = (time.perf_counter() - submitted_at) * 1000
+    queue_ms = max(0.0, generation_ms - sum(timings.values()))
+    # Without what was streamed after a complete expression or repeat loop
+    result = {
+        "latex": stream.text(),
+        "tokens": tokens_used,
+        "time_ms": int((time.time() - start_time) * 1000),
+        "vision_tokens": image_info["vision_tokens"],
+        "stop_reason": stop_reason,
+    }
+    await _store_cache(cache_key, result)
+    timings = stage_timings(image_info, cache_ms=cache_ms, admission_ms=admission_ms, queue_ms=queue_ms, **timings)
+    metrics.observe_request("stream", time.time() - start_time, timings, tokens=tokens_used, stop_reason=stop_reason)
+    yield {
+        "type": "done",
+        **result,
+        "cached": False,
+        "timings": timings,
+    }
@@ -0,0 +1,200 @@
+import time
+import uuid
+import asyncio
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Dict, List, Optional
+from fastapi import HTTPException
+
+from app.core.config import settings
+from app.db.base import run_db
+from app.db.repository import InferenceRepository
+from app.services.infer import run_inference_service
+from app.services.uploads import StoredUpload, pin_uploads, unpin_uploads
+
+
+class BatchItem:
+    def __init__(self, index: int, filename: str, upload: StoredUpload):
+        self.index = index
+        self.filename = filename
+        self.upload = upload
+        self.image_path = upload.path
+        self.status = "pending"
+        self.latex: Optional[str] = None
+        self.tokens: Optional[int] = None
+        self.time_ms: Optional[int] = None
+        self.timings: Optional[Dict[str, float]] = None
+        self.stop_reason: Optional[str] = None
+        self.error: Optional[str] = None
+        self.record_id: Optional[int] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "index": self.index,
+            "filename": self.filename,
+            "status": self.status,
+            "latex": self.latex,
+            "tokens": self.tokens,
+            "time_ms": self.time_ms,
+            "stop_reason": self.stop_reason,
+            "error": self.error,
+            "id": self.record_id,
+        }
+
+
+class BatchJob:
+    def __init__(
+        self, job_id: str, items: List[BatchItem], adapter: Optional[str] = None, generation: Optional[Dict[str, Any]] = None
+    ):
+        self.id = job_id
+        self.items = items
+        self.adapter = adapter
+        self.generation = generation
+        self.status = "queued"
+        self.created_at = time.time()
+        self.finished_at: Optional[float] = None
+        self.task: Optional[asyncio.Task] = None
+        self._events: List[Dict[str, Any]] = []
+        self._changed = asyncio.Event()
+
+    @property
+    def done(self) -> bool:
+        return self.status in ("completed", "failed", "cancelled")
+
+    def publish(self, event: Dict[str, Any]):
+        self._events.append(event)
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def summary(self) -> Dict[str, Any]:
+        counts = {"pending": 0, "succeeded": 0, "failed": 0, "cancelled": 0}
+        for item in self.items:
+            counts[item.status] += 1
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "total": len(self.items),
+            "completed": counts["succeeded"] + counts["failed"],
+            "succeeded": counts["succeeded"],
+            "failed": counts["failed"],
+            "cancelled": counts["cancelled"],
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+        }
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {**self.summary(), "items": [item.to_dict() for item in self.items]}
+
+    async def events(self) -> AsyncIterator[Dict[str, Any]]:
+        sent = 0
+        while True:
+            changed = self._changed
+            while sent < len(self._events):
+                yield self._events[sent]
+                sent += 1
+            if self.done:
+                return
+            await changed.wait()
+
+
+class JobManager:
+    def __init__(self, retention: int = 100):
+        self.retention = retention
+        self._jobs: "OrderedDict[str, BatchJob]" = OrderedDict()
+
+    def get(self, job_id: str) -> Optional[BatchJob]:
+        return self._jobs.get(job_id)
+
+    def submit(
+        self, uploads: List[Dict[str, Any]], adapter: Optional[str] = None, generation: Optional[Dict[str, Any]] = None
+    ) -> BatchJob:
+        items = [BatchItem(i, u["filename"], u["upload"]) for i, u in enumerate(uploads)]
+        job = BatchJob(uuid.uuid4().hex, items, adapter=adapter, generation=generation)
+        self._jobs[job.id] = job
+        self._evict()
+        # Upload retention must not delete images the job has yet to convert
+        paths = [item.image_path for item in items]
+        pin_uploads(paths)
+        job.task = asyncio.create_task(self._run(job))
+        job.task.add_done_callback(lambda _: unpin_uploads(paths))
+        return job
+
+    def cancel(self, job_id: str) -> Optional[BatchJob]:
+        """Stops a job; items already converted are kept."""
+        job = self._jobs.get(job_id)
+        if job is not None and not job.done and job.task is not None:
+            job.task.cancel()
+        return job
+
+    def _evict(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.done]
+        while len(self._jobs) > self.retention and finished:
+            del self._jobs[finished.pop(0)]
+
+    async def _run_item(self, job: BatchJob, item: BatchItem):
+        try:
+            result = await run_inference_service(
+                item.image_path, adapter=job.adapter, image_hash=item.upload.sha256, endpoint="batch", lane="bulk",
+                generation=job.generation
+            )
+            item.latex, item.tokens, item.time_ms = result["latex"], result["tokens"], result["time_ms"]
+            item.timings, item.stop_reason = result["timings"], result["stop_reason"]
+            item.status = "succeeded"
+        except HTTPException as e:
+            item.status = "failed"
+            item.error = e.detail
+        except Exception as e:
+            item.status = "failed"
+            item.error = str(e)
+        job.publish({"type": "item", **item.to_dict()})
+
+    async def _run(self, job: BatchJob):
+        job.status = "running"
+        try:
+            # Chunks are submitted concurrently so the scheduler can batch them
+            chunk_size = max(1, settings.batch_job_chunk_size)
+            for start in range(0, len(job.items), chunk_size):
+                chunk = job.items[start:start + chunk_size]
+                await asyncio.gather(*(self._run_item(job, item) for item in chunk))
+
+            await self._persist_succeeded(job)
+            job.status = "completed"
+        except asyncio.CancelledError:
+            # The running generations were cancelled along with their items
+            for item in job.items:
+                if item.status == "pending":
+                    item.status = "cancelled"
+                    job.publish({"type": "item", **item.to_dict()})
+            try:
+                await self._persist_succeeded(job)
+            except Exception:
+                pass
+            job.status = "cancelled"
+        except Exception:
+            job.status = "failed"
+        finally:
+            job.finished_at = time.time()
+            job.publish({"type": "done", **job.summary()})
+
+    async def _persist_succeeded(self, job: BatchJob):
+        succeeded = [item for item in job.items if item.status == "succeeded"]
+        if succeeded:
+            ids = await run_db(self._persist, succeeded)
+            for item, record_id in zip(succeeded, ids):
+                item.record_id = record_id
+
+    @staticmethod
+    def _persist(db, items: List[BatchItem]) -> List[int]:
+        return InferenceRepository.create_many(db, [
+            {
+                "image_path": item.image_path,
+                "latex_output": item.latex,
+                "tokens_used": item.tokens,
+                "time_ms": item.time_ms,
+                "timings": item.timings,
+                "stop_reason": item.stop_reason,
+            }
+            for item in items
+        ])
+
+
+job_manager = JobManager(retention=settings.batch_job_retention)
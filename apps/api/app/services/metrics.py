@@ -0,0 +1,139 @@
+import os
+from typing import Any, Dict, List, Optional
+from prometheus_client import Counter, Gauge, Histogram
+
+# Stages take from well under a millisecond (cache lookups) to tens of
+# seconds (long decodes on CPU)
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+requests_total = Counter(
+    "img2latex_inference_requests_total",
+    "Inference requests by endpoint and outcome (ok, cached, timeout, cancelled, rejected, overloaded, error)",
+    ["endpoint", "outcome"],
+)
+request_seconds = Histogram(
+    "img2latex_inference_request_seconds",
+    "End-to-end latency of successful inference requests",
+    ["endpoint"],
+    buckets=BUCKETS,
+)
+stage_seconds = Histogram(
+    "img2latex_inference_stage_seconds",
+    "Time spent in each inference stage",
+    ["stage"],
+    buckets=BUCKETS,
+)
+tokens_generated = Counter("img2latex_tokens_generated_total", "Tokens generated")
+stop_reasons = Counter("img2latex_generation_stops_total", "Generations by why they stopped", ["reason"])
+cache_lookups = Counter("img2latex_result_cache_lookups_total", "Result cache lookups", ["result"])
+model_loads = Counter("img2latex_model_loads_total", "Base model replicas and adapters loaded", ["kind"])
+model_load_seconds = Histogram(
+    "img2latex_model_load_seconds",
+    "Time spent loading base model replicas and adapters",
+    ["kind"],
+    buckets=BUCKETS,
+)
+adapter_switches = Counter("img2latex_adapter_switches_total", "Adapter switches on a model replica")
+
+admission_wait_seconds = Histogram(
+    "img2latex_admission_wait_seconds",
+    "Time inference requests waited for admission",
+    ["lane"],
+    buckets=BUCKETS,
+)
+admission_rejections = Counter(
+    "img2latex_admission_rejections_total",
+    "Inference requests turned away by admission control (queue_full, queue_timeout)",
+    ["lane", "reason"],
+)
+admission_queued = Gauge("img2latex_admission_queued", "Inference requests waiting for admission", ["lane"])
+admission_in_use = Gauge("img2latex_admission_slots_in_use", "Admission slots held by inference requests", ["lane"])
+
+queue_depth = Gauge("img2latex_scheduler_queue_depth", "Requests waiting for a generation batch")
+generations_in_flight = Gauge(
+    "img2latex_scheduler_generations_in_flight",
+    "Images being generated, counting each row of a batch and each stream",
+)
+resident_adapters = Gauge("img2latex_resident_adapters", "LoRA adapters attached to the in-process model")
+workers_ready = Gauge("img2latex_workers_ready", "Inference worker processes with a loaded model")
+worker_memory = Gauge("img2latex_worker_resident_memory_bytes", "Resident memory of inference worker processes", ["worker"])
+
+
+def observe_stages(timings: Dict[str, float]):
+    for stage, ms in timings.items():
+        stage_seconds.labels(stage.removesuffix("_ms")).observe(ms / 1000)
+
+
+def observe_request(
+    endpoint: str,
+    seconds: float,
+    timings: Dict[str, float],
+    tokens: int = 0,
+    cached: bool = False,
+    stop_reason: Optional[str] = None,
+):
+    requests_total.labels(endpoint, "cached" if cached else "ok").inc()
+    request_seconds.labels(endpoint).observe(seconds)
+    tokens_generated.inc(0 if cached else tokens)
+    if stop_reason is not None and not cached:
+        stop_reasons.labels(stop_reason).inc()
+    observe_stages(timings)
+
+
+def observe_failure(endpoint: str, status_code: int):
+    if status_code == 504:
+        outcome = "timeout"
+    elif status_code == 499:
+        # The client went away before the result was ready
+        outcome = "cancelled"
+    elif status_code in (429, 503):
+        outcome = "overloaded"
+    elif status_code < 500:
+        outcome = "rejected"
+    else:
+        outcome = "error"
+    requests_total.labels(endpoint, outcome).inc()
+
+
+def record_model_event(event: str, seconds: float):
+    """ModelManager and WorkerPool listener."""
+    if event == "base_load":
+        model_loads.labels("base").inc()
+        model_load_seconds.labels("base").observe(seconds)
+    elif event == "adapter_load":
+        model_loads.labels("adapter").inc()
+        model_load_seconds.labels("adapter").observe(seconds)
+        adapter_switches.inc()
+    elif event == "adapter_switch":
+        adapter_switches.inc()
+
+
+def resident_memory_bytes(pid: int) -> Optional[int]:
+    try:
+        with open(f"/proc/{pid}/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def update_gauges(
+    scheduler: Dict[str, Any],
+    adapters: int,
+    workers: Optional[List[Dict[str, Any]]],
+    admission: Optional[Dict[str, Any]] = None,
+):
+    queue_depth.set(scheduler["queue_depth"])
+    if admission is not None:
+        for lane, stats in admission["lanes"].items():
+            admission_queued.labels(lane).set(stats["queued"])
+            admission_in_use.labels(lane).set(stats["in_use"])
+    generations_in_flight.set(scheduler["in_flight"])
+    resident_adapters.set(adapters)
+    worker_memory.clear()
+    if workers is None:
+        return
+    workers_ready.set(sum(1 for w in workers if w["state"] in ("idle", "busy")))
+    for w in workers:
+        memory = resident_memory_bytes(w["pid"]) if w["pid"] and w["state"] != "dead" else None
+        if memory is not None:
+            worker_memory.labels(str(w["index"])).set(memory)
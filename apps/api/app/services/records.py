@@ -0,0 +1,43 @@
+from typing import Any, Dict, List, Optional
+
+from app.core.config import settings
+from app.db.base import SessionLocal, db_executor
+from app.db.repository import InferenceRepository
+from app.services.batching import BatchScheduler
+
+
+def _insert_records(rows: List[Dict[str, Any]]) -> List[int]:
+    db = SessionLocal()
+    try:
+        return InferenceRepository.create_many(db, rows)
+    finally:
+        db.close()
+
+
+# Records written within a few milliseconds of each other share one
+# transaction; SQLite takes one writer at a time anyway
+record_writer = BatchScheduler(
+    _insert_records,
+    max_batch_size=settings.db_write_batch_size,
+    max_wait_ms=settings.db_write_max_wait_ms,
+    executor=db_executor,
+)
+
+
+async def save_record(
+    image_path: str,
+    latex_output: str,
+    tokens_used: int,
+    time_ms: int,
+    timings: Optional[Dict[str, float]] = None,
+    stop_reason: Optional[str] = None,
+) -> int:
+    """Stores an inference record and returns its id once committed."""
+    return await record_writer.submit({
+        "image_path": image_path,
+        "latex_output": latex_output,
+        "tokens_used": tokens_used,
+        "time_ms": time_ms,
+        "timings": timings,
+        "stop_reason": stop_reason,
+    })
@@ -0,0 +1,89 @@
+import os
+import re
+import uuid
+from typing import Optional, Tuple
+from PIL import Image
+
+from app.core.config import settings
+
+THUMBNAIL_FORMATS = {
+    "webp": ("WEBP", ".webp"),
+    "jpeg": ("JPEG", ".jpg"),
+    "jpg": ("JPEG", ".jpg"),
+}
+
+# Extensions an original may be stored under, see uploads.IMAGE_SIGNATURES
+ORIGINAL_EXTENSIONS = (".png", ".jpg", ".jpeg", ".gif", ".bmp", ".tif", ".tiff", ".webp")
+
+# ab/<sha256>.thumb256q80.webp for content-addressed uploads, <name>.thumb256q80.webp for
+# older ones. The name holds every render parameter, so each variant has its own file
+THUMBNAIL_PATH = re.compile(
+    r"^(?:(?P<shard>[0-9a-f]{2})/)?(?P<stem>[\w-]+)\.thumb(?P<size>\d+)q(?P<quality>\d+)(?P<ext>\.\w+)$"
+)
+
+
+def thumbnail_format() -> Tuple[str, str]:
+    return THUMBNAIL_FORMATS.get(settings.thumbnail_format, THUMBNAIL_FORMATS["webp"])
+
+
+def thumbnail_path(original: str) -> str:
+    _, extension = thumbnail_format()
+    return f"{os.path.splitext(original)[0]}.thumb{settings.thumbnail_size}q{settings.thumbnail_quality}{extension}"
+
+
+def find_original(relative: str) -> Optional[str]:
+    """Returns the original a thumbnail path under ``upload_dir`` was made from.
+
+    Only thumbnails of the configured size, quality and format are accepted, so
+    requests cannot make the server render arbitrary variants.
+    """
+    match = THUMBNAIL_PATH.match(relative.replace(os.sep, "/"))
+    if not match:
+        return None
+    if (
+        int(match.group("size")) != settings.thumbnail_size
+        or int(match.group("quality")) != settings.thumbnail_quality
+        or match.group("ext") != thumbnail_format()[1]
+    ):
+        return None
+    directory = os.path.join(settings.upload_dir, match.group("shard") or "")
+    for extension in ORIGINAL_EXTENSIONS:
+        original = os.path.join(directory, match.group("stem") + extension)
+        if os.path.isfile(original):
+            return original
+    return None
+
+
+def create_thumbnail(original: str) -> str:
+    path = thumbnail_path(original)
+    if os.path.exists(path):
+        return path
+
+    image_format, _ = thumbnail_format()
+    size = settings.thumbnail_size
+    with Image.open(original) as image:
+        if image.mode in ("1", "P"):
+            # Palette images would otherwise be resized with nearest-neighbour sampling
+            image = image.convert("RGBA" if "transparency" in image.info else "RGB")
+        # Shrinks JPEGs while decoding, before the resampling pass
+        image.thumbnail((size, size))
+        if image.mode in ("RGBA", "LA"):
+            image = image.convert("RGBA")
+            if image_format == "JPEG":
+                background = Image.new("RGB", image.size, "white")
+                background.paste(image, mask=image.getchannel("A"))
+                image = background
+        elif image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+
+        tmp_dir = os.path.join(settings.upload_dir, ".tmp")
+        os.makedirs(tmp_dir, exist_ok=True)
+        tmp_path = os.path.join(tmp_dir, uuid.uuid4().hex)
+        try:
+            image.save(tmp_path, image_format, quality=settings.thumbnail_quality)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+    return path
@@ -0,0 +1,222 @@
+import io
+import os
+import time
+import uuid
+import hashlib
+import asyncio
+import threading
+from collections import Counter
+from typing import Any, BinaryIO, Dict, Iterable, Optional
+from fastapi import HTTPException, UploadFile
+from PIL import Image
+
+from app.core.config import settings
+from app.services.thumbnails import create_thumbnail
+
+CHUNK_SIZE = 64 * 1024
+
+# Leading bytes of the image formats we accept, and the extension they are stored under
+IMAGE_SIGNATURES = (
+    (b"\x89PNG\r\n\x1a\n", ".png"),
+    (b"\xff\xd8\xff", ".jpg"),
+    (b"GIF87a", ".gif"),
+    (b"GIF89a", ".gif"),
+    (b"BM", ".bmp"),
+    (b"II*\x00", ".tif"),
+    (b"MM\x00*", ".tif"),
+)
+
+# Stored images that queued or running work still has to read; compaction skips them
+_pinned: "Counter[str]" = Counter()
+_pinned_lock = threading.Lock()
+
+# Names of the images taken from archives and directories
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif', '.bmp', '.webp', '.tif', '.tiff')
+
+
+class StoredUpload:
+    def __init__(self, path: str, sha256: str, size: int, created: bool):
+        self.path = path
+        self.sha256 = sha256
+        self.size = size
+        # False when an identical image was already stored. Stored images may
+        # be shared by several records, so they are only ever removed by
+        # compact_uploads
+        self.created = created
+
+
+def sniff_image_type(header: bytes) -> Optional[str]:
+    if header[:4] == b"RIFF" and header[8:12] == b"WEBP":
+        return ".webp"
+    for signature, extension in IMAGE_SIGNATURES:
+        if header.startswith(signature):
+            return extension
+    return None
+
+
+def validate_header(header: bytes, filename: str) -> str:
+    extension = sniff_image_type(header)
+    if extension is None:
+        raise HTTPException(status_code=400, detail=f"{filename} is not a supported image")
+    try:
+        # Most formats state their size in the first chunk; when the header is
+        # longer than that the full decode later is the check
+        width, height = Image.open(io.BytesIO(header)).size
+    except Exception:
+        return extension
+    if width * height > settings.max_upload_pixels:
+        raise HTTPException(status_code=400, detail=f"{filename} is too large ({width}x{height} pixels)")
+    return extension
+
+
+def content_path(sha256: str, extension: str) -> str:
+    return os.path.join(settings.upload_dir, sha256[:2], f"{sha256}{extension}")
+
+
+def upload_url(path: str) -> str:
+    relative = os.path.relpath(path, settings.upload_dir)
+    if relative.startswith(".."):
+        relative = os.path.basename(path)
+    return "/api/uploads/" + relative.replace(os.sep, "/")
+
+
+def store_file(source: BinaryIO, filename: str) -> StoredUpload:
+    """Copies ``source`` into the content-addressed store in chunks.
+
+    The header is validated before the rest is copied, the size limit is
+    enforced while copying and the content is hashed on the way. Identical
+    images are stored once.
+    """
+    header = source.read(CHUNK_SIZE)
+    extension = validate_header(header, filename)
+
+    tmp_dir = os.path.join(settings.upload_dir, ".tmp")
+    os.makedirs(tmp_dir, exist_ok=True)
+    tmp_path = os.path.join(tmp_dir, uuid.uuid4().hex)
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with open(tmp_path, "wb") as out:
+            chunk = header
+            while chunk:
+                size += len(chunk)
+                if size > settings.max_upload_bytes:
+                    raise HTTPException(
+                        status_code=413,
+                        detail=f"{filename} exceeds the {settings.max_upload_bytes} byte upload limit"
+                    )
+                digest.update(chunk)
+                out.write(chunk)
+                chunk = source.read(CHUNK_SIZE)
+
+        sha256 = digest.hexdigest()
+        path = content_path(sha256, extension)
+        if os.path.exists(path):
+            os.remove(tmp_path)
+            # Duplicates count as recent use for retention
+            os.utime(path)
+            return StoredUpload(path, sha256, size, created=False)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    if settings.thumbnail_on_upload:
+        try:
+            create_thumbnail(path)
+        except Exception:
+            # Rendered on its first request instead
+            pass
+    return StoredUpload(path, sha256, size, created=True)
+
+
+def save_upload_bytes(filename: str, content: bytes) -> StoredUpload:
+    return store_file(io.BytesIO(content), filename)
+
+
+async def save_upload(image: UploadFile) -> StoredUpload:
+    if not image.content_type.startswith("image/"):
+        raise HTTPException(status_code=400, detail="File must be an image")
+
+    return await asyncio.to_thread(store_file, image.file, image.filename)
+
+
+def pin_uploads(paths: Iterable[str]):
+    """Keeps ``compact_uploads`` from deleting ``paths`` until they are unpinned."""
+    with _pinned_lock:
+        _pinned.update(os.path.abspath(path) for path in paths)
+
+
+def unpin_uploads(paths: Iterable[str]):
+    with _pinned_lock:
+        _pinned.subtract(os.path.abspath(path) for path in paths)
+        for path in [path for path, count in _pinned.items() if count <= 0]:
+            del _pinned[path]
+
+
+def compact_uploads(
+    max_bytes: int,
+    max_age_seconds: float,
+    tmp_age_seconds: float = 3600.0,
+    grace_seconds: float = 0.0,
+) -> Dict[str, Any]:
+    """Deletes expired uploads, then the least recently used ones until the
+    directory fits in ``max_bytes``. Zero disables either limit.
+
+    Uploads used within ``grace_seconds`` and those pinned by queued work
+    are kept, since requests and batch jobs read them after they are stored.
+    """
+    now = time.time()
+    with _pinned_lock:
+        pinned = set(_pinned)
+    files = []
+    removed = freed = 0
+    for root, _, names in os.walk(settings.upload_dir):
+        in_tmp = os.path.basename(root) == ".tmp"
+        for name in names:
+            path = os.path.join(root, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            kept = not in_tmp and (now - stat.st_mtime < grace_seconds or os.path.abspath(path) in pinned)
+            # Leftovers of interrupted uploads
+            expired = (in_tmp and now - stat.st_mtime > tmp_age_seconds) or (
+                not in_tmp and not kept and max_age_seconds and now - stat.st_mtime > max_age_seconds
+            )
+            if expired:
+                os.remove(path)
+                removed += 1
+                freed += stat.st_size
+            elif not in_tmp:
+                files.append((stat.st_mtime, stat.st_size, path, kept))
+
+    total = sum(size for _, size, _, _ in files)
+    if max_bytes:
+        for _, size, path, kept in sorted(files):
+            if total <= max_bytes:
+                break
+            if kept:
+                continue
+            os.remove(path)
+            total -= size
+            removed += 1
+            freed += size
+
+    return {"removed": removed, "freed_bytes": freed, "total_bytes": total}
+
+
+async def run_upload_retention():
+    while True:
+        try:
+            await asyncio.to_thread(
+                compact_uploads,
+                settings.upload_max_total_bytes,
+                settings.upload_retention_days * 24 * 3600,
+                grace_seconds=settings.upload_grace_seconds,
+            )
+        except Exception:
+            pass
+        await asyncio.sleep(settings.upload_retention_interval)
@@ -0,0 +1,88 @@
+import os
+import sys
+import time
+import asyncio
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+project_root = Path(__file__).parent.parent.parent.parent.parent
+sys.path.insert(0, str(project_root))
+
+from models.inference.model_manager import model_manager
+from models.inference.preprocess import load_image
+from app.core.config import settings
+from app.services.infer import get_generation_settings, get_preprocess_config, load_models, runner, worker_pool
+
+samples_dir = os.path.join(os.path.dirname(__file__), "../../static/samples")
+
+
+class Readiness:
+    def __init__(self):
+        self.phase = "lazy"
+        self.error: Optional[str] = None
+        self.phases: Dict[str, int] = {}
+        self.started_at: Optional[float] = None
+
+    @property
+    def ready(self) -> bool:
+        return self.phase in ("lazy", "ready")
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "ready": self.ready,
+            "phase": self.phase,
+            "phases_ms": dict(self.phases),
+            "error": self.error,
+        }
+
+    async def run_phase(self, name: str, fn, *args):
+        self.phase = name
+        start = time.time()
+        result = await asyncio.to_thread(fn, *args)
+        self.phases[name] = int((time.time() - start) * 1000)
+        return result
+
+
+readiness = Readiness()
+
+
+def _load_adapter(adapter_path: str):
+    if not model_manager.load_adapter(adapter_path):
+        raise RuntimeError(f"Failed to load adapter {adapter_path}")
+
+
+def _load_models():
+    if not load_models():
+        raise RuntimeError("Timed out loading models")
+
+
+def _warm_up(sample: str):
+    image, _ = load_image(os.path.join(samples_dir, sample), get_preprocess_config())
+    generation = get_generation_settings(max_new_tokens=settings.warmup_max_new_tokens)
+    if worker_pool is None:
+        runner.run_batch([image], generation, model_manager.adapter_path)
+        return
+    # One request per worker; idle workers each pick one up
+    futures = [
+        worker_pool.submit_batch([image], generation, model_manager.adapter_path)
+        for _ in range(worker_pool.num_workers)
+    ]
+    for future in futures:
+        future.result()
+
+
+async def warm_start():
+    readiness.started_at = time.time()
+    readiness.phases = {}
+    readiness.error = None
+    try:
+        await readiness.run_phase("loading_model", _load_models)
+        if settings.preload_adapter:
+            await readiness.run_phase("loading_adapter", _load_adapter, settings.preload_adapter)
+        if settings.warmup_sample:
+            await readiness.run_phase("warming_up", _warm_up, settings.warmup_sample)
+        readiness.phases["total"] = int((time.time() - readiness.started_at) * 1000)
+        readiness.phase = "ready"
+    except Exception as e:
+        readiness.error = f"{readiness.phase} failed: {str(e)}"
+        readiness.phase = "failed"
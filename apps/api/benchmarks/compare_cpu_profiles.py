@@ -0,0 +1,126 @@
+"""Compares CPU profiles against the float32 baseline on the bundled samples.
+
+Each profile loads its own copy of the model and converts every image in
+static/samples with greedy decoding, so outputs are comparable across runs.
+The report shows load time, resident memory, latency and tokens/s next to
+how often each profile's LaTeX matches the float32 output:
+
+    python benchmarks/compare_cpu_profiles.py
+    python benchmarks/compare_cpu_profiles.py --profiles fp32,int8 --threads 8 --output profiles.json
+"""
+import gc
+import os
+import sys
+import json
+import time
+import difflib
+import argparse
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+api_dir = Path(__file__).parent.parent
+samples_dir = api_dir / "static" / "samples"
+sys.path.insert(0, str(api_dir))
+sys.path.insert(0, str(api_dir.parent.parent))
+# Only the preprocessing settings are used from the app
+os.environ.setdefault("RESULT_CACHE_BACKEND", "none")
+
+from models.inference.cpu_profile import PROFILES, CPUProfile
+from models.inference.generation import generate_batch
+from models.inference.preprocess import load_image
+from models.inference.unsloth_qwen import load_model_and_tokenizer
+from app.services.infer import get_preprocess_config
+from app.services.metrics import resident_memory_bytes
+
+
+def list_samples() -> List[Path]:
+    return sorted(p for p in samples_dir.iterdir() if p.suffix.lower() in (".png", ".jpg", ".jpeg"))
+
+
+def run_profile(profile: CPUProfile, samples: List[Path], max_new_tokens: int, repeat: int) -> Dict[str, Any]:
+    start = time.perf_counter()
+    model, tokenizer = load_model_and_tokenizer(profile)
+    load_s = time.perf_counter() - start
+
+    preprocess = get_preprocess_config()
+    images = [load_image(str(path), preprocess)[0] for path in samples]
+    # The first generation pays for lazy initialization (and compilation)
+    generate_batch(model, tokenizer, images[:1], max_new_tokens=max_new_tokens, temperature=0.0)
+
+    outputs, latencies, tokens = [], [], 0
+    for image in images:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            [(latex, used, _)] = generate_batch(model, tokenizer, [image], max_new_tokens=max_new_tokens, temperature=0.0)
+            latencies.append((time.perf_counter() - start) * 1000)
+            tokens += used
+        outputs.append(latex)
+
+    result = {
+        "profile": profile.to_dict(),
+        "load_s": load_s,
+        "resident_memory_bytes": resident_memory_bytes(os.getpid()),
+        "mean_latency_ms": sum(latencies) / len(latencies),
+        "tokens_per_s": tokens / (sum(latencies) / 1000) if latencies else 0.0,
+        "outputs": {path.name: latex for path, latex in zip(samples, outputs)},
+    }
+    del model, tokenizer
+    gc.collect()
+    return result
+
+
+def compare(results: List[Dict[str, Any]]) -> None:
+    """Adds agreement with, and speedup over, the first (baseline) profile."""
+    baseline = results[0]
+    for result in results:
+        pairs = [(baseline["outputs"][name], latex) for name, latex in result["outputs"].items()]
+        result["exact_match"] = sum(a == b for a, b in pairs) / len(pairs)
+        result["similarity"] = sum(difflib.SequenceMatcher(None, a, b).ratio() for a, b in pairs) / len(pairs)
+        result["speedup"] = baseline["mean_latency_ms"] / result["mean_latency_ms"]
+
+
+def print_report(results: List[Dict[str, Any]]):
+    print(f"{'profile':<14}{'load s':>8}{'RSS MB':>9}{'ms/image':>10}{'tokens/s':>10}{'speedup':>9}{'exact':>8}{'similar':>9}")
+    for r in results:
+        rss = (r["resident_memory_bytes"] or 0) / 2**20
+        name = r["profile"]["name"] + ("+compile" if r["profile"]["compile"] else "")
+        print(
+            f"{name:<14}{r['load_s']:>8.1f}{rss:>9.0f}{r['mean_latency_ms']:>10.1f}{r['tokens_per_s']:>10.1f}"
+            f"{r['speedup']:>8.2f}x{r['exact_match']:>8.0%}{r['similarity']:>9.3f}"
+        )
+    print("RSS is the process's resident memory after loading; earlier profiles' memory may not be returned to the OS.")
+
+
+def parse_args(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--profiles", default=",".join(PROFILES), help="Comma-separated profiles; the first is the baseline")
+    parser.add_argument("--compile", action="store_true", help="Also torch.compile each profile")
+    parser.add_argument("--threads", type=int, default=0, help="Intra-op threads (default: torch's)")
+    parser.add_argument("--interop-threads", type=int, default=0, help="Inter-op threads (default: torch's)")
+    parser.add_argument("--max-new-tokens", type=int, default=128, help="Token budget per image")
+    parser.add_argument("--repeat", type=int, default=1, help="Generations per image")
+    parser.add_argument("--output", help="Also write the report as JSON to this file")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None):
+    args = parse_args(argv)
+    samples = list_samples()
+    results = []
+    for name in args.profiles.split(","):
+        profile = CPUProfile(
+            name.strip(),
+            compile=args.compile,
+            intra_op_threads=args.threads,
+            inter_op_threads=args.interop_threads,
+        )
+        results.append(run_profile(profile, samples, args.max_new_tokens, args.repeat))
+    compare(results)
+    print_report(results)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
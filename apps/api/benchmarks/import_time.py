@@ -0,0 +1,116 @@
+"""Measures how long importing the API (app.main) takes.
+
+Every run imports the app in a fresh interpreter, so nothing is cached in
+memory between runs. The report shows the median, min and max import time,
+the slowest modules from ``python -X importtime`` and whether any of the
+ML libraries were imported; they should only be imported once a model is
+loaded. The exit status is 1 if one was, or if the median exceeds
+``--max-seconds``, so it can guard against startup regressions in CI:
+
+    python benchmarks/import_time.py
+    python benchmarks/import_time.py --control-plane --runs 10 --max-seconds 1.0 --output imports.json
+"""
+import os
+import sys
+import json
+import argparse
+import tempfile
+import statistics
+import subprocess
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+api_dir = Path(__file__).parent.parent
+
+HEAVY_MODULES = ("torch", "transformers", "peft", "unsloth")
+
+CHILD = """
+import sys, json, time
+start = time.perf_counter()
+import app.main
+seconds = time.perf_counter() - start
+print(json.dumps({"seconds": seconds, "heavy": [m for m in %r if m in sys.modules]}))
+""" % (HEAVY_MODULES,)
+
+
+def child_env(data_dir: str, control_plane: bool) -> Dict[str, str]:
+    env = dict(os.environ)
+    env.setdefault("DATABASE_URL", f"sqlite:///{data_dir}/app.db")
+    env.setdefault("UPLOAD_DIR", os.path.join(data_dir, "uploads"))
+    env.setdefault("RESULT_CACHE_DIR", os.path.join(data_dir, "cache"))
+    env["PRELOAD_MODEL"] = "false"
+    if control_plane:
+        env["CONTROL_PLANE_ONLY"] = "true"
+    return env
+
+
+def import_once(env: Dict[str, str], profile: bool = False) -> Tuple[Dict[str, Any], str]:
+    args = [sys.executable] + (["-X", "importtime"] if profile else []) + ["-c", CHILD]
+    proc = subprocess.run(args, cwd=api_dir, env=env, capture_output=True, text=True, timeout=300)
+    if proc.returncode != 0:
+        raise RuntimeError(f"Importing app.main failed:\n{proc.stderr}")
+    return json.loads(proc.stdout.strip().splitlines()[-1]), proc.stderr
+
+
+def slowest_modules(importtime: str, top: int) -> List[Dict[str, Any]]:
+    """Modules by cumulative import time, from ``-X importtime`` output."""
+    modules = []
+    for line in importtime.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if cumulative.strip().isdigit():
+            modules.append({"module": name.strip(), "cumulative_ms": int(cumulative) / 1000})
+    modules.sort(key=lambda m: m["cumulative_ms"], reverse=True)
+    return modules[:top]
+
+
+def run(runs: int, control_plane: bool, top: int) -> Dict[str, Any]:
+    with tempfile.TemporaryDirectory(prefix="img2latex-imports-") as data_dir:
+        env = child_env(data_dir, control_plane)
+        # The first import compiles bytecode and creates the database
+        import_once(env)
+        results = [import_once(env)[0] for _ in range(runs)]
+        _, importtime = import_once(env, profile=True)
+
+    seconds = [r["seconds"] for r in results]
+    return {
+        "control_plane_only": control_plane,
+        "runs": runs,
+        "median_s": statistics.median(seconds),
+        "min_s": min(seconds),
+        "max_s": max(seconds),
+        "heavy_modules": sorted({m for r in results for m in r["heavy"]}),
+        "slowest_modules": slowest_modules(importtime, top),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--control-plane", action="store_true", help="Import with CONTROL_PLANE_ONLY=true")
+    parser.add_argument("--max-seconds", type=float, default=None, help="Fail if the median import time is higher")
+    parser.add_argument("--top", type=int, default=15, help="Slowest modules to report")
+    parser.add_argument("--output", help="Write the report as JSON")
+    args = parser.parse_args()
+
+    report = run(args.runs, args.control_plane, args.top)
+    print(f"app.main import: median {report['median_s']:.3f}s (min {report['min_s']:.3f}s, max {report['max_s']:.3f}s) over {args.runs} runs")
+    for module in report["slowest_modules"]:
+        print(f"  {module['cumulative_ms']:9.1f} ms  {module['module']}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    failed = False
+    if report["heavy_modules"]:
+        print(f"FAIL: imported {', '.join(report['heavy_modules'])} at startup")
+        failed = True
+    if args.max_seconds is not None and report["median_s"] > args.max_seconds:
+        print(f"FAIL: median import time {report['median_s']:.3f}s exceeds {args.max_seconds}s")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,337 @@
+"""Replays a request trace against the inference API.
+
+Reports latency percentiles, throughput and the time spent in each stage.
+The API runs in-process unless --url is given:
+
+    python benchmarks/run_benchmark.py --stub --concurrency 4 --requests 64
+    python benchmarks/run_benchmark.py --url http://localhost:8000 --rate 2 --requests 100
+
+Each trace line is a JSON object with an ``image`` path (relative to apps/api)
+and optionally ``adapter``, ``endpoint`` (``infer`` or ``stream``) and
+``offset_ms`` (arrival time used by --replay-timing).
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+import mimetypes
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+api_dir = Path(__file__).parent.parent
+default_trace = Path(__file__).parent / "traces" / "samples.jsonl"
+
+STAGES = (
+    "cache_ms",
+    "decode_ms",
+    "preprocess_ms",
+    "queue_ms",
+    "template_ms",
+    "tokenize_ms",
+    "prefill_ms",
+    "decode_loop_ms",
+    "db_write_ms",
+)
+
+
+class Result:
+    def __init__(self, entry: Dict[str, Any]):
+        self.entry = entry
+        self.status: Optional[int] = None
+        self.latency_ms = 0.0
+        self.first_token_ms: Optional[float] = None
+        self.tokens = 0
+        self.cached = False
+        self.timings: Dict[str, float] = {}
+        self.stop_reason: Optional[str] = None
+        self.error: Optional[str] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.status == 200 and self.error is None
+
+
+def load_trace(path: Optional[str], samples: bool) -> List[Dict[str, Any]]:
+    entries = []
+    if path:
+        with open(path) as f:
+            entries = [json.loads(line) for line in f if line.strip()]
+    if samples:
+        sample_dir = api_dir / "static" / "samples"
+        entries += [{"image": str(p.relative_to(api_dir))} for p in sorted(sample_dir.iterdir())]
+    if not entries:
+        raise SystemExit("The trace is empty")
+    return entries
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    position = (len(values) - 1) * q / 100.0
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+def distribution(values: List[float]) -> Dict[str, float]:
+    return {
+        "mean": round(sum(values) / len(values), 1) if values else 0.0,
+        "p50": round(percentile(values, 50), 1),
+        "p95": round(percentile(values, 95), 1),
+        "p99": round(percentile(values, 99), 1),
+    }
+
+
+def read_sse(body: str) -> List[Dict[str, Any]]:
+    events = []
+    for block in body.split("\n\n"):
+        event, data = None, None
+        for line in block.splitlines():
+            if line.startswith("event: "):
+                event = line[len("event: "):]
+            elif line.startswith("data: "):
+                data = json.loads(line[len("data: "):])
+        if event is not None:
+            events.append({"event": event, "data": data})
+    return events
+
+
+async def send(client: httpx.AsyncClient, entry: Dict[str, Any], images: Dict[str, bytes]) -> Result:
+    result = Result(entry)
+    path = entry["image"]
+    content_type = mimetypes.guess_type(path)[0] or "image/png"
+    files = {"image": (os.path.basename(path), images[path], content_type)}
+    data = {"adapter": entry["adapter"]} if entry.get("adapter") else None
+    start = time.perf_counter()
+    try:
+        if entry.get("endpoint") == "stream":
+            async with client.stream("POST", "/api/infer/stream", files=files, data=data) as response:
+                result.status = response.status_code
+                chunks = []
+                async for chunk in response.aiter_text():
+                    if result.first_token_ms is None and "event: token" in chunk:
+                        result.first_token_ms = (time.perf_counter() - start) * 1000
+                    chunks.append(chunk)
+            for event in read_sse("".join(chunks)):
+                if event["event"] == "done":
+                    body = event["data"]
+                elif event["event"] == "error":
+                    result.error = event["data"]["detail"]
+            if result.status == 200 and result.error is None:
+                result.tokens, result.cached, result.timings = body["tokens"], body["cached"], body.get("timings", {})
+                result.stop_reason = body.get("stop_reason")
+        else:
+            response = await client.post("/api/infer", files=files, data=data)
+            result.status = response.status_code
+            body = response.json()
+            if response.status_code == 200:
+                result.tokens, result.cached, result.timings = body["tokens"], body["cached"], body.get("timings", {})
+                result.stop_reason = body.get("stop_reason")
+            else:
+                result.error = str(body.get("detail"))
+    except Exception as e:
+        result.error = f"{type(e).__name__}: {str(e)}"
+    result.latency_ms = (time.perf_counter() - start) * 1000
+    return result
+
+
+def request_entries(entries: List[Dict[str, Any]], total: int) -> List[Dict[str, Any]]:
+    return [entries[i % len(entries)] for i in range(total)]
+
+
+async def run_closed_loop(client, entries, images, concurrency: int) -> List[Result]:
+    pending = list(entries)
+    results: List[Result] = []
+
+    async def user():
+        while pending:
+            results.append(await send(client, pending.pop(0), images))
+
+    await asyncio.gather(*(user() for _ in range(concurrency)))
+    return results
+
+
+async def run_open_loop(client, entries, images, trace_length: int, rate: Optional[float], replay_timing: bool, seed: int) -> List[Result]:
+    # Arrivals follow a schedule regardless of how fast responses come back
+    rng = random.Random(seed)
+    start = time.perf_counter()
+    tasks = []
+    arrival = 0.0
+    period = max(e.get("offset_ms", 0) for e in entries) / 1000.0
+    for i, entry in enumerate(entries):
+        if replay_timing:
+            # Further passes over the trace repeat its timing back to back
+            arrival = entry.get("offset_ms", 0) / 1000.0 + (i // trace_length) * period
+        else:
+            arrival += rng.expovariate(rate)
+        delay = start + arrival - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(send(client, entry, images)))
+    return list(await asyncio.gather(*tasks))
+
+
+def summarize(results: List[Result], wall_s: float) -> Dict[str, Any]:
+    ok = [r for r in results if r.ok]
+    generated = [r for r in ok if not r.cached]
+    statuses: Dict[str, int] = {}
+    for r in results:
+        statuses[str(r.status)] = statuses.get(str(r.status), 0) + 1
+    stages = {}
+    for stage in STAGES:
+        values = [r.timings[stage] for r in generated if stage in r.timings]
+        if values:
+            stages[stage] = distribution(values)
+    first_tokens = [r.first_token_ms for r in ok if r.first_token_ms is not None]
+    stop_reasons: Dict[str, int] = {}
+    for r in generated:
+        stop_reasons[str(r.stop_reason)] = stop_reasons.get(str(r.stop_reason), 0) + 1
+    return {
+        "requests": len(results),
+        "succeeded": len(ok),
+        "failed": len(results) - len(ok),
+        "cached": len(ok) - len(generated),
+        "statuses": statuses,
+        "errors": sorted({r.error for r in results if r.error})[:10],
+        "wall_s": round(wall_s, 3),
+        "images_per_s": round(len(ok) / wall_s, 3) if wall_s else 0.0,
+        "tokens_per_s": round(sum(r.tokens for r in ok) / wall_s, 1) if wall_s else 0.0,
+        "tokens_per_request": round(sum(r.tokens for r in generated) / len(generated), 1) if generated else 0.0,
+        "stop_reasons": stop_reasons,
+        "latency_ms": distribution([r.latency_ms for r in ok]),
+        "first_token_ms": distribution(first_tokens) if first_tokens else None,
+        "stages_ms": stages,
+    }
+
+
+def print_report(summary: Dict[str, Any]):
+    print(f"requests     {summary['requests']} ({summary['succeeded']} ok, {summary['failed']} failed, {summary['cached']} cached)")
+    print(f"wall time    {summary['wall_s']:.2f}s")
+    print(f"throughput   {summary['images_per_s']:.2f} images/s, {summary['tokens_per_s']:.1f} tokens/s")
+    if summary["stop_reasons"]:
+        reasons = ", ".join(f"{reason} {count}" for reason, count in sorted(summary["stop_reasons"].items()))
+        print(f"tokens       {summary['tokens_per_request']:.1f} per generated request; stopped by {reasons}")
+    latency = summary["latency_ms"]
+    print(f"latency ms   p50 {latency['p50']:.1f}  p95 {latency['p95']:.1f}  p99 {latency['p99']:.1f}  mean {latency['mean']:.1f}")
+    if summary["first_token_ms"]:
+        ttft = summary["first_token_ms"]
+        print(f"first token  p50 {ttft['p50']:.1f}  p95 {ttft['p95']:.1f}  p99 {ttft['p99']:.1f}")
+    if summary["stages_ms"]:
+        print(f"{'stage':<16}{'mean':>10}{'p50':>10}{'p95':>10}{'p99':>10}")
+        for stage, d in summary["stages_ms"].items():
+            print(f"{stage[:-3]:<16}{d['mean']:>10.1f}{d['p50']:>10.1f}{d['p95']:>10.1f}{d['p99']:>10.1f}")
+    for error in summary["errors"]:
+        print(f"error: {error}")
+
+
+def configure_in_process(args) -> None:
+    # Settings are read at import time, so this has to run before the app is imported
+    work_dir = tempfile.mkdtemp(prefix="img2latex-bench-")
+    os.environ.setdefault("DATABASE_URL", f"sqlite:///{work_dir}/app.db")
+    os.environ.setdefault("UPLOAD_DIR", os.path.join(work_dir, "uploads"))
+    os.environ.setdefault("RESULT_CACHE_DIR", os.path.join(work_dir, "cache"))
+    if not args.cache:
+        os.environ["RESULT_CACHE_BACKEND"] = "none"
+    if args.stub:
+        os.environ["INFERENCE_RUNNER"] = "stub"
+        os.environ["STUB_PREFILL_MS"] = str(args.stub_prefill_ms)
+        os.environ["STUB_TOKEN_MS"] = str(args.stub_token_ms)
+        os.environ["STUB_TOKENS"] = str(args.stub_tokens)
+    sys.path.insert(0, str(api_dir))
+
+
+async def run(args) -> Dict[str, Any]:
+    trace = load_trace(None if args.no_trace else args.trace, args.samples)
+    images = {}
+    for entry in trace:
+        if entry["image"] not in images:
+            with open(api_dir / entry["image"], "rb") as f:
+                images[entry["image"]] = f.read()
+
+    total = args.requests or len(trace)
+    warmup = request_entries(trace, args.warmup)
+    entries = request_entries(trace, total)
+
+    async def measure(client):
+        for entry in warmup:
+            await send(client, entry, images)
+        start = time.perf_counter()
+        if args.rate or args.replay_timing:
+            results = await run_open_loop(client, entries, images, len(trace), args.rate, args.replay_timing, args.seed)
+        else:
+            results = await run_closed_loop(client, entries, images, args.concurrency)
+        return results, time.perf_counter() - start
+
+    timeout = httpx.Timeout(args.timeout)
+    if args.url:
+        async with httpx.AsyncClient(base_url=args.url, timeout=timeout) as client:
+            results, wall_s = await measure(client)
+    else:
+        configure_in_process(args)
+        from app.main import app
+
+        async with app.router.lifespan_context(app):
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=timeout) as client:
+                results, wall_s = await measure(client)
+
+    summary = summarize(results, wall_s)
+    summary["config"] = {
+        "target": args.url or "in-process",
+        "stub": args.stub,
+        "mode": "open-loop" if args.rate or args.replay_timing else "closed-loop",
+        "concurrency": args.concurrency,
+        "rate": args.rate,
+        "replay_timing": args.replay_timing,
+        "trace": None if args.no_trace else str(args.trace),
+        "samples": args.samples,
+    }
+    return summary
+
+
+def parse_args(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", help="Benchmark a running server instead of the app in-process")
+    parser.add_argument("--trace", default=str(default_trace), help="JSONL request trace")
+    parser.add_argument("--no-trace", action="store_true", help="Do not replay a trace file")
+    parser.add_argument("--samples", action="store_true", help="Add every image in static/samples to the trace")
+    parser.add_argument("--requests", type=int, default=0, help="Requests to send, cycling through the trace (default: one pass)")
+    parser.add_argument("--warmup", type=int, default=0, help="Requests sent before measuring")
+    parser.add_argument("--concurrency", type=int, default=1, help="Clients sending requests back to back")
+    parser.add_argument("--rate", type=float, default=0.0, help="Open loop: Poisson arrivals per second")
+    parser.add_argument("--replay-timing", action="store_true", help="Open loop: send at the trace's offset_ms")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the arrival process")
+    parser.add_argument("--timeout", type=float, default=300.0, help="Client timeout in seconds")
+    parser.add_argument("--cache", action="store_true", help="Keep the result cache enabled in-process")
+    parser.add_argument("--stub", action="store_true", help="Use the stub model in-process instead of loading weights")
+    parser.add_argument("--stub-prefill-ms", type=float, default=20.0, help="Simulated prefill time per batch")
+    parser.add_argument("--stub-token-ms", type=float, default=2.0, help="Simulated time per generated token")
+    parser.add_argument("--stub-tokens", type=int, default=32, help="Tokens generated by the stub")
+    parser.add_argument("--output", help="Also write the report as JSON to this file")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None):
+    args = parse_args(argv)
+    summary = asyncio.run(run(args))
+    if args.json:
+        print(json.dumps(summary, indent=2))
+    else:
+        print_report(summary)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(summary, f, indent=2)
+    if summary["failed"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,13 @@
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+project_root = Path(__file__).parent.parent.parent.parent
+sys.path.insert(0, str(project_root))
+
+# Keep tests that import the app away from the checked-in database
+_test_dir = tempfile.mkdtemp(prefix="img2latex-tests-")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{_test_dir}/app.db")
+os.environ.setdefault("UPLOAD_DIR", os.path.join(_test_dir, "uploads"))
+os.environ.setdefault("RESULT_CACHE_DIR", os.path.join(_test_dir, "cache"))
@@ -0,0 +1,64 @@
+import json
+import shutil
+import time
+
+from models.inference.adapter_index import AdapterIndex, same_base_model
+
+
+def make_job(root, job_id, weights=b"weights", base_model="unsloth/Qwen2-VL-7B-Instruct-bnb-4bit"):
+    job = root / job_id
+    job.mkdir()
+    (job / "training_config.json").write_text(json.dumps({"epochs": 1}))
+    (job / "adapter_config.json").write_text(json.dumps({"base_model_name_or_path": base_model}))
+    (job / "adapter_model.safetensors").write_bytes(weights)
+    return job
+
+
+def test_index_persists_and_rereads_only_changed_jobs(tmp_path):
+    make_job(tmp_path, "a")
+    job_b = make_job(tmp_path, "b")
+    (tmp_path / "no_weights").mkdir()
+
+    index = AdapterIndex(str(tmp_path), ttl=0)
+    assert {a["job_id"] for a in index.list()} == {"a", "b"}
+    assert index.stats()["reindexed"] == 2
+    assert index.find("a")["size"] == len(b"weights")
+
+    # A fresh process starts from the manifest
+    index = AdapterIndex(str(tmp_path), ttl=60)
+    assert not index.refresh()
+    checksum = index.find("b")["checksum"]
+    assert index.stats()["reindexed"] == 0
+
+    (job_b / "adapter_model.safetensors").write_bytes(b"retrained weights")
+    shutil.rmtree(tmp_path / "a")
+    assert index.refresh(force=True)
+    assert [a["job_id"] for a in index.list()] == ["b"]
+    assert index.stats()["reindexed"] == 1
+    assert index.find("b")["checksum"] != checksum
+    assert index.prefetch([str(job_b)]).join() is None
+    assert index.prefetch([str(job_b)]) is None
+
+
+def test_lookups_index_new_jobs_and_rescan_in_the_background(tmp_path):
+    make_job(tmp_path, "a")
+    index = AdapterIndex(str(tmp_path), ttl=0)
+    assert [a["job_id"] for a in index.list()] == ["a"]
+
+    # A job that finished training since the last scan resolves right away
+    job_b = make_job(tmp_path, "b")
+    assert index.find(str(job_b))["job_id"] == "b"
+    assert index.find("b")["path"] == str(job_b)
+    assert index.find("../b") is None
+
+    make_job(tmp_path, "c")
+    index.list()
+    deadline = time.monotonic() + 5
+    while len(index.list()) < 3:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_base_model_names_ignore_organisation_and_quantization():
+    assert same_base_model("unsloth/Qwen2-VL-7B-Instruct-bnb-4bit", "Qwen/Qwen2-VL-7B-Instruct")
+    assert not same_base_model("Qwen/Qwen2-VL-2B-Instruct", "Qwen/Qwen2-VL-7B-Instruct")
@@ -0,0 +1,75 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from app.services.admission import AdmissionController
+
+
+def test_interactive_requests_are_admitted_before_bulk():
+    admission = AdmissionController(max_concurrency=2, max_queue=4, bulk_share=0.5)
+    started = []
+    releases = {}
+
+    async def request(lane, name):
+        releases[name] = asyncio.Event()
+        async with admission.slot(lane):
+            started.append(name)
+            await releases[name].wait()
+
+    async def settle():
+        for _ in range(10):
+            await asyncio.sleep(0)
+
+    async def main():
+        tasks = [asyncio.create_task(request("bulk", f"bulk{i}")) for i in range(3)]
+        await settle()
+        # Bulk holds at most half the slots, so an interactive request starts at once
+        assert started == ["bulk0"]
+        tasks.append(asyncio.create_task(request("interactive", "interactive0")))
+        tasks.append(asyncio.create_task(request("interactive", "interactive1")))
+        await settle()
+        assert started == ["bulk0", "interactive0"]
+        # The waiting interactive request overtakes the bulk requests queued before it
+        releases["bulk0"].set()
+        await settle()
+        assert started == ["bulk0", "interactive0", "interactive1"]
+        for name in ("interactive0", "interactive1", "bulk1", "bulk2"):
+            releases[name].set()
+            await settle()
+        await asyncio.gather(*tasks)
+
+    asyncio.run(main())
+    stats = admission.stats()["lanes"]
+    assert stats["bulk"]["admitted"] == 3 and stats["interactive"]["admitted"] == 2
+    assert stats["bulk"]["in_use"] == stats["interactive"]["in_use"] == 0
+
+
+def test_saturated_queue_is_rejected_with_retry_after():
+    admission = AdmissionController(max_concurrency=1, max_queue=1, queue_timeout=0.05)
+
+    async def main():
+        release = asyncio.Event()
+
+        async def hold():
+            async with admission.slot():
+                await release.wait()
+
+        holder = asyncio.create_task(hold())
+        await asyncio.sleep(0)
+        # Waits in the queue, then times out
+        waiter = asyncio.create_task(hold())
+        await asyncio.sleep(0)
+        with pytest.raises(HTTPException) as full:
+            admission.check()
+        with pytest.raises(HTTPException) as timed_out:
+            await waiter
+        release.set()
+        await holder
+        return full.value, timed_out.value
+
+    full, timed_out = asyncio.run(main())
+    assert full.status_code == 429 and int(full.headers["Retry-After"]) >= 1
+    assert timed_out.status_code == 503 and "Retry-After" in timed_out.headers
+    assert admission.stats()["lanes"]["interactive"]["rejected"] == {"queue_full": 1, "queue_timeout": 1}
+    assert admission.in_use["interactive"] == 0
@@ -0,0 +1,128 @@
+import asyncio
+import threading
+
+from app.services.batching import BatchScheduler
+
+
+def test_concurrent_requests_share_a_batch():
+    calls = []
+
+    def run_batch(items):
+        calls.append(list(items))
+        return [item * 2 for item in items]
+
+    scheduler = BatchScheduler(run_batch, max_batch_size=4, max_wait_ms=50)
+
+    async def main():
+        return await asyncio.gather(*(scheduler.submit(i) for i in range(6)))
+
+    assert asyncio.run(main()) == [0, 2, 4, 6, 8, 10]
+    assert [len(c) for c in calls] == [4, 2]
+    stats = scheduler.stats()
+    assert stats["batches_total"] == 2
+    assert stats["items_total"] == 6
+    assert stats["batch_size_histogram"] == {"2": 1, "4": 1}
+
+
+def test_batch_errors_propagate_to_every_waiter():
+    def run_batch(items):
+        raise RuntimeError("boom")
+
+    scheduler = BatchScheduler(run_batch, max_batch_size=2, max_wait_ms=10)
+
+    async def main():
+        return await asyncio.gather(scheduler.submit(1), scheduler.submit(2), return_exceptions=True)
+
+    results = asyncio.run(main())
+    assert all(isinstance(r, RuntimeError) for r in results)
+
+
+def test_abandoned_requests_are_skipped():
+    started = threading.Event()
+    release = threading.Event()
+    seen = []
+
+    def run_batch(items):
+        seen.extend(items)
+        started.set()
+        release.wait(1)
+        return items
+
+    scheduler = BatchScheduler(run_batch, max_batch_size=1, max_wait_ms=0)
+
+    async def main():
+        first = asyncio.ensure_future(scheduler.submit("first"))
+        await asyncio.to_thread(started.wait, 1)
+        abandoned = asyncio.ensure_future(scheduler.submit("abandoned"))
+        await asyncio.sleep(0)
+        abandoned.cancel()
+        release.set()
+        kept = await scheduler.submit("kept")
+        return await first, kept
+
+    assert asyncio.run(main()) == ("first", "kept")
+    assert "abandoned" not in seen
+
+
+def test_only_items_with_the_same_key_are_batched():
+    calls = []
+
+    def run_batch(items):
+        calls.append(list(items))
+        return items
+
+    scheduler = BatchScheduler(run_batch, max_batch_size=8, max_wait_ms=50)
+
+    async def main():
+        return await asyncio.gather(
+            scheduler.submit("a1", key="a"),
+            scheduler.submit("b1", key="b"),
+            scheduler.submit("a2", key="a"),
+            scheduler.submit("b2", key="b"),
+        )
+
+    assert asyncio.run(main()) == ["a1", "b1", "a2", "b2"]
+    assert calls == [["a1", "a2"], ["b1", "b2"]]
+
+
+def test_batches_run_concurrently_up_to_the_limit():
+    active = []
+    peak = []
+    lock = threading.Lock()
+
+    def run_batch(items):
+        with lock:
+            active.append(1)
+            peak.append(len(active))
+        threading.Event().wait(0.05)
+        with lock:
+            active.pop()
+        return items
+
+    scheduler = BatchScheduler(run_batch, max_batch_size=1, max_wait_ms=0, max_concurrency=2)
+
+    async def main():
+        return await asyncio.gather(*(scheduler.submit(i) for i in range(4)))
+
+    assert asyncio.run(main()) == [0, 1, 2, 3]
+    assert max(peak) == 2
+
+
+def test_reserved_slots_count_against_the_limit():
+    scheduler = BatchScheduler(lambda items: items, max_batch_size=1, max_wait_ms=0, max_concurrency=1)
+
+    async def main():
+        await scheduler.submit("first")
+        # An idle scheduler holds no slot
+        release = await asyncio.wait_for(scheduler.reserve(), 1)
+        batch = asyncio.ensure_future(scheduler.submit("batch"))
+        await asyncio.sleep(0.05)
+        # The stream holds the only slot
+        assert not batch.done() and scheduler.stats()["in_flight"] == 1
+        threading.Thread(target=release).start()
+        result = await batch
+        release()
+        return result
+
+    assert asyncio.run(main()) == "batch"
+    assert scheduler.stats()["in_flight"] == 0
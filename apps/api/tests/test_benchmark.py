@@ -0,0 +1,29 @@
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+api_dir = Path(__file__).parent.parent
+
+
+def test_stub_benchmark_reports_latency_and_stages(tmp_path):
+    output = tmp_path / "report.json"
+    subprocess.run(
+        [
+            sys.executable, "benchmarks/run_benchmark.py",
+            "--stub", "--stub-prefill-ms", "5", "--stub-token-ms", "0",
+            "--concurrency", "3", "--requests", "12",
+            "--output", str(output),
+        ],
+        cwd=api_dir,
+        check=True,
+        capture_output=True,
+        timeout=120,
+    )
+    report = json.loads(output.read_text())
+
+    assert report["succeeded"] == 12
+    assert report["images_per_s"] > 0
+    assert report["latency_ms"]["p50"] <= report["latency_ms"]["p99"]
+    assert {"decode_ms", "preprocess_ms", "prefill_ms", "decode_loop_ms", "db_write_ms"} <= set(report["stages_ms"])
+    assert report["first_token_ms"] is not None
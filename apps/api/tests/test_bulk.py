@@ -0,0 +1,84 @@
+import os
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+from app.bulk import Checkpoint, write_parquet
+
+api_dir = Path(__file__).parent.parent
+
+
+def run_bulk(tmp_path, *args, source="static/samples"):
+    env = {
+        **os.environ,
+        "INFERENCE_RUNNER": "stub",
+        "RESULT_CACHE_DIR": str(tmp_path / "cache"),
+    }
+    proc = subprocess.run(
+        [sys.executable, "-m", "app.bulk", source, *args],
+        cwd=api_dir,
+        env=env,
+        check=True,
+        capture_output=True,
+        text=True,
+        timeout=300,
+    )
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def test_bulk_conversion_resumes_after_a_torn_line(tmp_path):
+    output = tmp_path / "out.jsonl"
+    summary = run_bulk(tmp_path, "--output", str(output), "--batch-size", "3", "--loaders", "2")
+    assert summary["images"] == 4 and summary["cached"] == 0
+    records = [json.loads(line) for line in output.read_text().splitlines()]
+    assert all(record["latex"] and record["error"] is None for record in records)
+
+    # A crash after the second image, in the middle of writing the third
+    lines = output.read_text().splitlines(keepends=True)
+    output.write_text("".join(lines[:2]) + lines[2][:10])
+    summary = run_bulk(tmp_path, "--output", str(output))
+    assert summary["skipped"] == 2 and summary["images"] == 2
+    # Converted before, so served from the result cache
+    assert summary["cached"] == 2
+    assert sorted(json.loads(line)["path"] for line in output.read_text().splitlines()) == sorted(r["path"] for r in records)
+
+
+def test_shards_split_the_images(tmp_path):
+    output = tmp_path / "out.jsonl"
+    paths = []
+    for index in range(2):
+        summary = run_bulk(tmp_path, "--output", str(output), "--num-shards", "2", "--shard-index", str(index))
+        paths += [json.loads(line)["path"] for line in Path(summary["output"]).read_text().splitlines()]
+    assert len(paths) == len(set(paths)) == 4
+
+
+def test_images_that_failed_to_load_are_retried(tmp_path):
+    path = tmp_path / "out.jsonl"
+    path.write_text(
+        json.dumps({"path": "a.png", "latex": "x", "error": None}) + "\n"
+        + json.dumps({"path": "b.png", "latex": None, "error": "OSError: truncated"}) + "\n"
+    )
+    checkpoint = Checkpoint(str(path))
+    checkpoint.close()
+    assert checkpoint.done == {"a.png"}
+    assert [json.loads(line)["path"] for line in path.read_text().splitlines()] == ["a.png"]
+
+
+def test_failed_images_have_the_same_columns(tmp_path):
+    broken = tmp_path / "broken.png"
+    broken.write_bytes(b"not an image")
+    sources = tmp_path / "files.txt"
+    sources.write_text(f"{broken}\n{api_dir / 'static/samples/quadratic_formula.png'}\n")
+    output = tmp_path / "out.jsonl"
+    summary = run_bulk(tmp_path, "--output", str(output), source=str(sources))
+    assert summary["errors"] == 1
+    records = [json.loads(line) for line in output.read_text().splitlines()]
+    assert records[0]["error"] is not None and records[0].keys() == records[1].keys()
+
+    pq = pytest.importorskip("pyarrow.parquet")
+    write_parquet(str(output), str(tmp_path / "out.parquet"))
+    table = pq.read_table(tmp_path / "out.parquet")
+    assert table.column("time_ms").to_pylist()[1] is not None
@@ -0,0 +1,23 @@
+import pytest
+import torch
+
+from models.inference.cpu_profile import CPUProfile
+
+
+def test_int8_profile_quantizes_linear_layers():
+    model = torch.nn.Sequential(torch.nn.Linear(8, 8), torch.nn.ReLU(), torch.nn.Linear(8, 2))
+    expected = model(torch.ones(1, 8))
+
+    profile = CPUProfile("int8")
+    quantized = profile.prepare(model)
+
+    assert isinstance(quantized[0], torch.ao.nn.quantized.dynamic.Linear)
+    assert torch.allclose(quantized(torch.ones(1, 8)), expected, atol=0.05)
+    assert not profile.supports_adapters
+    assert profile.identity == "@int8"
+    assert CPUProfile().identity == ""
+
+
+def test_unknown_profile_is_rejected():
+    with pytest.raises(ValueError):
+        CPUProfile("fp8")
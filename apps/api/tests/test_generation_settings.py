@@ -0,0 +1,26 @@
+import pytest
+
+from app.services.infer import batch_key, get_generation_settings, is_deterministic
+
+
+def test_greedy_requests_are_deterministic_and_share_batches():
+    short = get_generation_settings(max_new_tokens=32, decoding="greedy", temperature=1.3)
+    long = get_generation_settings(max_new_tokens=512, decoding="greedy")
+    assert is_deterministic(short) and short["temperature"] == short["min_p"] == 0.0
+    assert batch_key(short) == batch_key(long)
+
+    sampled = get_generation_settings(max_new_tokens=32, decoding="sample", temperature=0.5)
+    assert not is_deterministic(sampled)
+    assert batch_key(sampled) != batch_key(get_generation_settings(max_new_tokens=64, decoding="sample", temperature=0.5))
+
+
+@pytest.mark.parametrize("overrides", [
+    {"max_new_tokens": 0},
+    {"max_new_tokens": 100_000},
+    {"decoding": "beam"},
+    {"decoding": "sample", "temperature": 0},
+    {"decoding": "sample", "min_p": 1.5},
+])
+def test_settings_beyond_the_server_limits_are_rejected(overrides):
+    with pytest.raises(ValueError):
+        get_generation_settings(**overrides)
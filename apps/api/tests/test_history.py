@@ -0,0 +1,65 @@
+import asyncio
+
+from fastapi.testclient import TestClient
+from sqlalchemy import text
+
+from app.db.base import SessionLocal, engine
+from app.db.migrate import init_db
+from app.db.repository import InferenceRepository
+from app.main import app
+from app.services.records import record_writer, save_record
+
+init_db()
+client = TestClient(app)
+
+
+def add_records(count):
+    db = SessionLocal()
+    try:
+        return InferenceRepository.create_many(db, [
+            {"image_path": f"uploads/{i}.png", "latex_output": f"x_{i}", "tokens_used": i, "time_ms": 1}
+            for i in range(count)
+        ])
+    finally:
+        db.close()
+
+
+def test_history_pages_with_cursor():
+    ids = add_records(25)
+
+    seen = []
+    cursor = None
+    while True:
+        params = {"limit": 10}
+        if cursor:
+            params["before"] = cursor
+        response = client.get("/api/history", params=params)
+        assert response.status_code == 200
+        seen += [item["id"] for item in response.json()]
+        cursor = response.headers.get("X-Next-Cursor")
+        if cursor is None:
+            break
+
+    assert seen == sorted(seen, reverse=True)
+    assert set(ids) <= set(seen)
+    assert len(seen) == len(set(seen))
+
+
+def test_history_query_uses_index():
+    with engine.connect() as conn:
+        assert conn.execute(text("PRAGMA journal_mode")).scalar() == "wal"
+        plan = conn.execute(text(
+            "EXPLAIN QUERY PLAN SELECT * FROM inference_records WHERE id < 100 ORDER BY id DESC LIMIT 10"
+        )).fetchall()
+    assert not any("TEMP B-TREE" in row[-1] for row in plan)
+
+
+def test_concurrent_writes_are_coalesced():
+    async def write():
+        return await asyncio.gather(*(save_record(f"uploads/c{i}.png", "x", 1, 1) for i in range(10)))
+
+    batches_before = record_writer.stats()["batches_total"]
+    ids = asyncio.run(write())
+
+    assert len(set(ids)) == 10
+    assert record_writer.stats()["batches_total"] - batches_before < 10
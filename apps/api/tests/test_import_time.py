@@ -0,0 +1,48 @@
+import os
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+api_dir = Path(__file__).parent.parent
+
+
+def test_benchmark_reports_no_heavy_imports_in_control_plane_mode(tmp_path):
+    output = tmp_path / "imports.json"
+    subprocess.run(
+        [sys.executable, "benchmarks/import_time.py", "--control-plane", "--runs", "1", "--output", str(output)],
+        cwd=api_dir,
+        check=True,
+        capture_output=True,
+        timeout=300,
+    )
+    report = json.loads(output.read_text())
+
+    assert report["heavy_modules"] == []
+    assert report["slowest_modules"][0]["cumulative_ms"] > 0
+
+
+def test_control_plane_serves_history_and_refuses_inference(tmp_path):
+    script = """
+import sys
+from fastapi.testclient import TestClient
+from app.main import app
+
+with TestClient(app) as client:
+    assert client.get("/api/history").status_code == 200
+    assert client.get("/api/sample-images").status_code == 200
+    assert client.get("/metrics").status_code == 200
+    response = client.post("/api/infer", files={"image": ("x.png", b"", "image/png")})
+    assert response.status_code == 503, response.text
+    assert client.post("/api/models/reload").status_code == 503
+assert "torch" not in sys.modules
+"""
+    env = {
+        **os.environ,
+        "CONTROL_PLANE_ONLY": "true",
+        "DATABASE_URL": f"sqlite:///{tmp_path}/app.db",
+        "UPLOAD_DIR": str(tmp_path / "uploads"),
+        "RESULT_CACHE_DIR": str(tmp_path / "cache"),
+    }
+    proc = subprocess.run([sys.executable, "-c", script], cwd=api_dir, env=env, capture_output=True, text=True, timeout=300)
+    assert proc.returncode == 0, proc.stderr
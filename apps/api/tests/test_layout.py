@@ -0,0 +1,24 @@
+from PIL import Image, ImageDraw
+
+from models.inference.layout import LayoutConfig, ink_runs, segment_page
+
+
+def test_ink_runs_merge_small_gaps():
+    assert ink_runs([0, 1, 1, 0, 1, 0, 0, 0, 1], min_gap=2) == [(1, 5), (8, 9)]
+
+
+def test_page_regions_in_reading_order():
+    page = Image.new("RGB", (800, 400), "white")
+    draw = ImageDraw.Draw(page)
+    # A fraction: numerator, bar and denominator a few pixels apart
+    draw.rectangle((420, 40, 480, 60), fill="black")
+    draw.rectangle((400, 66, 500, 68), fill="black")
+    draw.rectangle((420, 74, 480, 94), fill="black")
+    # Left of it on the same line, and a line below
+    draw.rectangle((40, 50, 200, 80), fill="black")
+    draw.rectangle((60, 200, 700, 240), fill="black")
+    # A speck of dust
+    draw.point((780, 380), fill="black")
+
+    boxes = segment_page(page, LayoutConfig(margin=0))
+    assert boxes == [(40, 50, 201, 81), (400, 40, 501, 95), (60, 200, 701, 241)]
@@ -0,0 +1,38 @@
+import os
+
+from prometheus_client import REGISTRY
+
+from app.services import metrics
+
+
+def sample(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0.0
+
+
+def test_requests_and_stages_are_recorded():
+    before_ok = sample("img2latex_inference_requests_total", endpoint="infer", outcome="ok")
+    before_timeouts = sample("img2latex_inference_requests_total", endpoint="infer", outcome="timeout")
+    before_prefill = sample("img2latex_inference_stage_seconds_count", stage="prefill")
+    before_tokens = sample("img2latex_tokens_generated_total")
+
+    metrics.observe_request("infer", 0.2, {"prefill_ms": 12.0, "decode_loop_ms": 80.0}, tokens=7)
+    metrics.observe_request("infer", 0.01, {"cache_ms": 1.0}, tokens=7, cached=True)
+    metrics.observe_failure("infer", 504)
+
+    assert sample("img2latex_inference_requests_total", endpoint="infer", outcome="ok") == before_ok + 1
+    assert sample("img2latex_inference_requests_total", endpoint="infer", outcome="timeout") == before_timeouts + 1
+    assert sample("img2latex_inference_stage_seconds_count", stage="prefill") == before_prefill + 1
+    assert sample("img2latex_tokens_generated_total") == before_tokens + 7
+
+
+def test_gauges_read_worker_memory():
+    workers = [
+        {"index": 0, "pid": os.getpid(), "state": "idle"},
+        {"index": 1, "pid": None, "state": "dead"},
+    ]
+    metrics.update_gauges({"queue_depth": 3, "in_flight": 1}, 2, workers)
+
+    assert sample("img2latex_scheduler_queue_depth") == 3
+    assert sample("img2latex_workers_ready") == 1
+    assert sample("img2latex_worker_resident_memory_bytes", worker="0") > 0
+    assert sample("img2latex_worker_resident_memory_bytes", worker="1") == 0
@@ -0,0 +1,101 @@
+import threading
+
+import pytest
+
+from models.inference import model_manager as model_manager_module
+from models.inference.model_manager import ModelManager, ModelReplica
+
+
+class FakeModel:
+    pass
+
+
+@pytest.fixture
+def manager(monkeypatch):
+    loads = []
+
+    def load(cpu_profile=None):
+        threading.Event().wait(0.05)
+        loads.append(1)
+        return FakeModel(), object()
+
+    monkeypatch.setattr(model_manager_module, "load_model_and_tokenizer", load)
+    manager = ModelManager()
+    manager.loads_seen = loads
+    return manager
+
+
+def test_concurrent_first_calls_load_once(manager):
+    threads = [threading.Thread(target=manager.load_base_model) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(manager.loads_seen) == 1
+
+
+def test_handles_pin_the_model_across_a_reload(manager):
+    handle = manager.acquire("base")
+    old_model = handle.model
+    manager.reload()
+    assert manager.base_model is not old_model
+    assert handle.replica.retired
+    assert handle.replica.model is old_model
+    handle.release()
+    assert handle.replica.model is None
+    with manager.activate("base") as fresh:
+        assert fresh.model is manager.base_model
+
+
+def test_release_is_idempotent(manager):
+    handle = manager.acquire("base")
+    handle.release()
+    handle.release()
+    assert manager.replicas[0].users == 0
+
+
+def test_unknown_adapters_are_rejected(manager, tmp_path):
+    manager.artifacts_dir = str(tmp_path)
+    with pytest.raises(ValueError):
+        manager.acquire("missing")
+
+
+def test_retrained_adapters_get_a_new_weights_identity(manager, tmp_path):
+    job = tmp_path / "job"
+    job.mkdir()
+    (job / "training_config.json").write_text("{}")
+    (job / "adapter_model.safetensors").write_bytes(b"weights")
+    manager.artifacts_dir = str(tmp_path)
+    manager.adapter_index_ttl = 0
+    identity = manager.weights_identity(str(job))
+
+    (job / "adapter_model.safetensors").write_bytes(b"retrained weights")
+    manager.adapter_index.refresh()
+    assert manager.weights_identity(str(job)) != identity
+
+
+def test_steady_traffic_for_one_adapter_does_not_starve_another(manager, monkeypatch):
+    monkeypatch.setattr(manager, "resolve_adapter", lambda adapter: None if adapter == "base" else adapter)
+    monkeypatch.setattr(manager, "check_compatible", lambda adapter_path: None)
+    monkeypatch.setattr(ModelReplica, "set_adapter", lambda self, path, pinned=None: setattr(self, "active_adapter", path))
+    served = []
+
+    def request(adapter):
+        with manager.acquire(adapter):
+            served.append(adapter)
+
+    def start(adapter):
+        thread = threading.Thread(target=request, args=(adapter,), daemon=True)
+        thread.start()
+        threading.Event().wait(0.05)
+        return thread
+
+    first = manager.acquire("a")
+    b = start("b")
+    # Would join the replica serving "a" if not for the earlier "b"
+    a = start("a")
+    assert served == []
+    first.release()
+    b.join(1)
+    a.join(1)
+    assert served == ["b", "a"]
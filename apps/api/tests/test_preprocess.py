@@ -0,0 +1,48 @@
+from PIL import Image, ImageChops, ImageDraw
+
+from models.inference.preprocess import (
+    PreprocessConfig,
+    count_vision_tokens,
+    fit_to_token_budget,
+    preprocess_image,
+)
+
+
+def make_scan(size=(3000, 2000), box=(1200, 900, 1800, 1000)):
+    image = Image.new("RGB", size, "white")
+    ImageDraw.Draw(image).rectangle(box, fill="black")
+    return image
+
+
+def test_crops_whitespace_around_the_equation():
+    image, info = preprocess_image(make_scan(), PreprocessConfig(crop_margin=10))
+    assert info["original_size"] == [3000, 2000]
+    assert info["crop_box"] == [1190, 890, 1811, 1011]
+    assert image.width <= 621 and image.height <= 121
+
+
+def test_output_is_on_the_token_grid_and_within_budget():
+    config = PreprocessConfig(crop=False, max_vision_tokens=256)
+    image, info = preprocess_image(make_scan(), config)
+    assert image.width % 28 == 0 and image.height % 28 == 0
+    assert info["vision_tokens"] == count_vision_tokens(*image.size) <= 256
+    assert abs(image.width / image.height - 1.5) < 0.2
+
+
+def test_small_images_are_not_upscaled_past_the_minimum():
+    assert fit_to_token_budget(200, 100, 10**9, 10**6) == (196, 84)
+    width, height = fit_to_token_budget(20, 20, 10**9, 10**6)
+    assert width * height >= 56 * 56
+
+
+def test_grayscale_option():
+    image, _ = preprocess_image(make_scan(), PreprocessConfig(grayscale=True))
+    assert image.mode == "RGB"
+    r, g, b = image.split()
+    assert ImageChops.difference(r, g).getbbox() is None
+    assert ImageChops.difference(g, b).getbbox() is None
+
+
+def test_blank_images_are_left_uncropped():
+    _, info = preprocess_image(Image.new("RGB", (300, 300), "white"))
+    assert info["crop_box"] is None
@@ -0,0 +1,60 @@
+import torch
+from transformers import LlamaConfig, LlamaForCausalLM
+
+from models.inference.prompt_cache import PrefixCache, clear_templates, prompt_text
+
+
+class CountingTokenizer:
+    image_token_id = 5
+
+    def __init__(self):
+        self.calls = 0
+
+    def apply_chat_template(self, messages, **kwargs):
+        self.calls += 1
+        return "".join(item["type"] for item in messages[0]["content"])
+
+
+def test_template_applied_once_per_tokenizer():
+    tokenizer = CountingTokenizer()
+    assert prompt_text(tokenizer, processor=True) == "imagetext"
+    assert prompt_text(tokenizer, processor=True) == "imagetext"
+    assert tokenizer.calls == 1
+    clear_templates()
+    prompt_text(tokenizer, processor=True)
+    assert tokenizer.calls == 2
+
+
+def test_prefix_cache_matches_full_prefill():
+    torch.manual_seed(0)
+    config = LlamaConfig(
+        vocab_size=32, hidden_size=16, intermediate_size=32, num_hidden_layers=2,
+        num_attention_heads=2, num_key_value_heads=2, pad_token_id=0,
+    )
+    model = LlamaForCausalLM(config).eval()
+    tokenizer = CountingTokenizer()
+    inputs = {"input_ids": torch.tensor([[1, 2, 3, 4, 5, 5, 6], [1, 2, 3, 4, 5, 7, 6]])}
+    inputs["attention_mask"] = torch.ones_like(inputs["input_ids"])
+    cache = PrefixCache()
+
+    with torch.no_grad():
+        expected = model.generate(**inputs, max_new_tokens=8, do_sample=False)
+        for _ in range(2):
+            kwargs = cache.generate_kwargs(model, tokenizer, inputs)
+            assert kwargs["past_key_values"].get_seq_length() == 4
+            assert torch.equal(model.generate(**inputs, max_new_tokens=8, do_sample=False, **kwargs), expected)
+    assert cache.hits == 2
+
+    # Left-padded rows do not start with the prefix
+    padded = {"input_ids": torch.tensor([[0, 1, 2, 3, 4, 5, 6]]), "attention_mask": torch.tensor([[0, 1, 1, 1, 1, 1, 1]])}
+    assert cache.generate_kwargs(model, tokenizer, padded) == {}
+
+
+def test_prefix_cache_falls_back_without_the_cache_api(monkeypatch):
+    from models.inference import prompt_cache
+
+    monkeypatch.setattr(prompt_cache, "cache_supported", lambda: False)
+    inputs = {"input_ids": torch.tensor([[1, 2, 3, 4, 5, 6]])}
+    cache = PrefixCache()
+    assert cache.generate_kwargs(None, CountingTokenizer(), inputs) == {}
+    assert cache.hits == 0
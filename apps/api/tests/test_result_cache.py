@@ -0,0 +1,64 @@
+import time
+
+from models.inference.result_cache import (
+    MemoryBackend,
+    ResultCache,
+    SQLiteBackend,
+    build_result_cache,
+    make_cache_key,
+)
+
+
+def test_cache_key_depends_on_model_and_generation_settings():
+    key = make_cache_key("abc", "base", {"temperature": 0.7})
+    assert key == make_cache_key("abc", "base", {"temperature": 0.7})
+    assert key != make_cache_key("abc", "adapter", {"temperature": 0.7})
+    assert key != make_cache_key("abc", "base", {"temperature": 0.0})
+
+
+def test_memory_backend_evicts_least_recently_used():
+    backend = MemoryBackend(max_entries=2)
+    backend.set("a", {"v": 1})
+    backend.set("b", {"v": 2})
+    backend.get("a")
+    backend.set("c", {"v": 3})
+    assert backend.get("a") == {"v": 1}
+    assert backend.get("b") is None
+    assert backend.get("c") == {"v": 3}
+
+
+def test_sqlite_backend_round_trips_latex_with_pipes(tmp_path):
+    backend = SQLiteBackend(str(tmp_path / "cache.sqlite3"))
+    value = {"latex": "|x| = \\left| -x \\right|", "tokens": 12, "time_ms": 40}
+    backend.set("k", value)
+    assert backend.get("k") == value
+
+
+def test_sqlite_backend_enforces_size_and_ttl(tmp_path):
+    backend = SQLiteBackend(str(tmp_path / "cache.sqlite3"), max_bytes=100, ttl_seconds=0.05)
+    backend.set("old", {"latex": "x" * 40})
+    backend.set("new", {"latex": "y" * 40})
+    assert backend.get("old") is None
+    assert backend.get("new") is not None
+    time.sleep(0.1)
+    assert backend.get("new") is None
+
+
+def test_result_cache_counts_hits_per_tier_and_promotes(tmp_path):
+    memory = MemoryBackend()
+    disk = SQLiteBackend(str(tmp_path / "cache.sqlite3"))
+    cache = ResultCache([memory, disk])
+    assert cache.get("k") is None
+    disk.set("k", {"latex": "a"})
+    assert cache.get("k") == {"latex": "a"}
+    assert memory.get("k") == {"latex": "a"}
+    cache.get("k")
+    stats = cache.stats()
+    assert stats["hits"] == {"memory": 1, "sqlite": 1}
+    assert stats["misses"] == 1
+
+
+def test_build_result_cache_backends(tmp_path):
+    assert build_result_cache("none") is None
+    assert [t.name for t in build_result_cache("memory").tiers] == ["memory"]
+    assert [t.name for t in build_result_cache("sqlite", str(tmp_path)).tiers] == ["memory", "sqlite"]
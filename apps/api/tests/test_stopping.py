@@ -0,0 +1,67 @@
+import torch
+from PIL import Image
+
+from models.inference.stopping import StoppingConfig, build_row_stopper, finish_text, find_repetition, latex_end
+
+
+def test_latex_end_needs_balanced_wrappers():
+    assert latex_end("\\[ x^{2} \\] and more") == len("\\[ x^{2} \\]")
+    assert latex_end("\\begin{align} a &= b \\\\ c \\end{align}\nfoo") == len("\\begin{align} a &= b \\\\ c \\end{align}")
+    # Still open, or a matrix that the expression may continue after
+    assert latex_end("\\[ \\frac{a}{b") is None
+    assert latex_end("\\begin{pmatrix} a \\end{pmatrix} = b") is None
+    assert latex_end("a } \n\n b") is None
+
+
+def test_repetition_keeps_one_copy():
+    assert find_repetition([1, 2, 3] + [7, 8] * 20, max_ngram=16, min_tokens=32) == 5
+    assert find_repetition(list(range(40)), max_ngram=16, min_tokens=32) is None
+
+
+def test_rows_stop_independently_and_record_why():
+    images = [Image.new("RGB", (56, 56)), Image.new("RGB", (56, 56))]
+    config = StoppingConfig(adaptive_budget=True, budget_base=3, budget_per_vision_token=0, budget_per_aspect=0)
+    # The budget replaces the default limit, lower for small images and higher for large ones
+    assert config.token_budget((56, 56), 100) == 3
+    large = StoppingConfig(adaptive_budget=True, budget_max=500)
+    assert 100 < large.token_budget((1400, 280), 100) <= 500
+    stopper, max_new_tokens = build_row_stopper(config, images, 2, eos_token_id=0, decode_token=str)
+    assert max_new_tokens == 3
+
+    steps = [[5, 0], [6, 9], [7, 9]]
+    sequence = torch.tensor([[1, 1], [1, 1]])
+    for step in steps:
+        sequence = torch.cat([sequence, torch.tensor(step).unsqueeze(1)], dim=1)
+        stopped = stopper(sequence, None)
+    assert stopped.tolist() == [True, True]
+    assert [stopper.reason(0), stopper.reason(1)] == ["budget", "eos"]
+    assert [stopper.tokens(0), stopper.tokens(1)] == [3, 1]
+    assert stopper.trim(0, [5, 6, 7, 8]) == [5, 6, 7]
+    assert finish_text("\\[ x \\] \\[", "complete") == "\\[ x \\]"
+
+
+def test_inline_and_unwrapped_output_is_never_complete():
+    for text in ("$x$ and $y$", "\\(a\\) + \\(b\\)", "x = \\frac{a}{b}\n\nx = \\frac{a}{b}"):
+        assert latex_end(text) is None
+        assert finish_text(text, "complete") == text
+
+    pieces = ["$", "x", "$", " and ", "$", "y", "$"]
+    config = StoppingConfig(latex_complete=True)
+    stopper, _ = build_row_stopper(config, [Image.new("RGB", (56, 56))], 10, eos_token_id=-1, decode_token=pieces.__getitem__)
+    sequence = torch.tensor([[1]])
+    for token in range(len(pieces)):
+        sequence = torch.cat([sequence, torch.tensor([[token]])], dim=1)
+        assert stopper(sequence, None).tolist() == [False]
+
+
+def test_rows_stop_at_their_own_token_limit():
+    images = [Image.new("RGB", (56, 56)), Image.new("RGB", (56, 56))]
+    stopper, max_new_tokens = build_row_stopper(None, images, [2, 4], eos_token_id=0, decode_token=str)
+    assert max_new_tokens == 4
+
+    sequence = torch.tensor([[1], [1]])
+    for step in range(2):
+        sequence = torch.cat([sequence, torch.tensor([[5], [5]])], dim=1)
+        stopped = stopper(sequence, None)
+    assert stopped.tolist() == [True, False]
+    assert stopper.reason(0) == "length" and stopper.tokens(0) == 2
@@ -0,0 +1,123 @@
+import io
+import os
+import time
+
+import pytest
+from fastapi import FastAPI, File, HTTPException, UploadFile
+from fastapi.testclient import TestClient
+from PIL import Image
+
+from app.core.config import settings
+from app.main import LimitRequestSize
+from app.routers.uploads import UploadFiles
+from app.services.thumbnails import thumbnail_path
+from app.services.uploads import (
+    compact_uploads,
+    content_path,
+    pin_uploads,
+    save_upload_bytes,
+    store_file,
+    unpin_uploads,
+    upload_url,
+)
+
+
+def png_bytes(size=(32, 16), color="white") -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", size, color).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def test_identical_images_are_stored_once():
+    content = png_bytes(color="red")
+    first = save_upload_bytes("a.png", content)
+    second = save_upload_bytes("b.png", content)
+
+    assert first.path == second.path == content_path(first.sha256, ".png")
+    assert (first.created, second.created) == (True, False)
+    with open(first.path, "rb") as f:
+        assert f.read() == content
+
+
+def test_rejects_non_images_and_oversized_uploads(monkeypatch):
+    with pytest.raises(HTTPException) as error:
+        save_upload_bytes("notes.png", b"not an image at all")
+    assert error.value.status_code == 400
+
+    monkeypatch.setattr(settings, "max_upload_bytes", 100)
+    with pytest.raises(HTTPException) as error:
+        store_file(io.BytesIO(png_bytes(color="blue") + b"\0" * 1000), "big.png")
+    assert error.value.status_code == 413
+    assert os.listdir(os.path.join(settings.upload_dir, ".tmp")) == []
+
+
+def test_request_bodies_are_limited_while_they_stream(monkeypatch):
+    app = FastAPI()
+    app.add_middleware(LimitRequestSize)
+    received = []
+
+    @app.post("/upload")
+    async def upload(image: UploadFile = File(...)):
+        received.append(image.filename)
+        return {}
+
+    monkeypatch.setattr(settings, "max_request_bytes", 64 * 1024)
+    client = TestClient(app)
+    body = b"\0" * (128 * 1024)
+    files = {"image": ("big.png", body, "image/png")}
+    assert client.post("/upload", files=files).status_code == 413
+
+    # Without a Content-Length the body is counted as it arrives
+    multipart = (
+        b'--x\r\nContent-Disposition: form-data; name="image"; filename="big.png"\r\n'
+        b"Content-Type: image/png\r\n\r\n" + body + b"\r\n--x--\r\n"
+    )
+    chunks = (multipart[i:i + 8192] for i in range(0, len(multipart), 8192))
+    response = client.post("/upload", content=chunks, headers={"content-type": "multipart/form-data; boundary=x"})
+    assert response.status_code == 413
+    assert received == []
+
+
+def test_compaction_evicts_least_recently_used(monkeypatch, tmp_path):
+    monkeypatch.setattr(settings, "upload_dir", str(tmp_path))
+    old = save_upload_bytes("old.png", png_bytes(color="green"))
+    new = save_upload_bytes("new.png", png_bytes(color="yellow"))
+    past = time.time() - 60
+    os.utime(old.path, (past, past))
+
+    # Recently used uploads are kept
+    assert compact_uploads(max_bytes=new.size, max_age_seconds=0, grace_seconds=120)["removed"] == 0
+
+    stats = compact_uploads(max_bytes=new.size, max_age_seconds=0)
+
+    assert stats["removed"] == 1
+    assert not os.path.exists(old.path)
+    assert os.path.exists(new.path)
+
+    # So are those that queued batch jobs still have to read
+    pin_uploads([new.path])
+    assert compact_uploads(max_bytes=1, max_age_seconds=0)["removed"] == 0
+    unpin_uploads([new.path])
+    assert compact_uploads(max_bytes=1, max_age_seconds=0)["removed"] == 1
+
+
+def test_thumbnails_are_rendered_lazily_and_cached(monkeypatch):
+    app = FastAPI()
+    app.mount("/api/uploads", UploadFiles(directory=settings.upload_dir), name="uploads")
+    client = TestClient(app)
+    stored = save_upload_bytes("wide.png", png_bytes(size=(1024, 256), color="purple"))
+
+    response = client.get(upload_url(thumbnail_path(stored.path)))
+    assert response.status_code == 200
+    assert response.headers["etag"] == f'"{os.path.basename(thumbnail_path(stored.path))}"'
+    assert "immutable" in response.headers["cache-control"]
+    assert Image.open(io.BytesIO(response.content)).size == (settings.thumbnail_size, settings.thumbnail_size // 4)
+
+    cached = client.get(upload_url(stored.path), headers={"If-None-Match": f'"{stored.sha256}"'})
+    assert cached.status_code == 304
+    assert client.get(upload_url(stored.path).replace(".png", ".thumb17q80.webp")).status_code == 404
+
+    # Another render quality is another file, with its own ETag
+    monkeypatch.setattr(settings, "thumbnail_quality", settings.thumbnail_quality - 10)
+    other = client.get(upload_url(thumbnail_path(stored.path)))
+    assert other.status_code == 200 and other.headers["etag"] != response.headers["etag"]
@@ -0,0 +1,24 @@
+import torch
+
+from models.inference.vision_cache import VisionCache
+
+
+def test_evicted_embeddings_spill_to_disk(tmp_path):
+    grid = torch.tensor([1, 4, 4])
+    embeds = {name: torch.full((4, 8), float(i)) for i, name in enumerate("abc")}
+    # Room for two entries in memory
+    cache = VisionCache(max_bytes=2 * 4 * 8 * 4, disk_dir=str(tmp_path))
+    keys = {name: VisionCache.make_key("model", torch.full((16, 3), float(i)), grid) for i, name in enumerate("abc")}
+    assert len(set(keys.values())) == 3
+    assert VisionCache.make_key("adapter", torch.full((16, 3), 0.0), grid) != keys["a"]
+
+    for name in "abc":
+        cache.set(keys[name], embeds[name], grid)
+    assert cache.stats()["entries"] == 2
+    assert cache.stats()["disk_entries"] == 1
+
+    cached, cached_grid = cache.get(keys["a"])
+    assert torch.equal(cached, embeds["a"]) and torch.equal(cached_grid, grid)
+    assert torch.equal(cache.get(keys["c"])[0], embeds["c"])
+    assert cache.stats()["hits"] == {"memory": 1, "disk": 1}
+    assert cache.get(VisionCache.make_key("model", torch.full((16, 3), 9.0), grid)) is None
@@ -0,0 +1,72 @@
+import os
+import signal
+import time
+
+import pytest
+from PIL import Image
+
+from models.inference.cancellation import CancelToken
+from models.inference.worker_pool import WorkerPool, partition_cpus
+
+
+@pytest.fixture
+def pool():
+    pool = WorkerPool(2, runner="stub", runner_options={"tokens": 4}, heartbeat_interval=0.1, health_timeout=5.0)
+    assert pool.wait_ready(60, all_workers=True)
+    yield pool
+    pool.stop()
+
+
+def test_partition_cpus_contiguous_blocks():
+    assert partition_cpus(2, [0, 1, 2, 3, 4]) == [[0, 1, 2], [3, 4]]
+    assert partition_cpus(3, [0, 1]) == [[0, 1], [0, 1], [0, 1]]
+
+
+def test_batch_and_stream_round_trip(pool):
+    image = Image.new("RGB", (56, 28))
+    results = pool.run_batch([image, image], {"max_new_tokens": 2})
+    assert [(latex, tokens, reason) for latex, tokens, _, reason in results] == [("\\text{56x28}", 2, "length")] * 2
+
+    stream = pool.stream(image, {}, timeout=10)
+    assert list(stream) == ["\\text{56x28}"]
+    assert stream.wait(10) == 4
+    assert set(stream.timings()) == {"template_ms", "tokenize_ms", "prefill_ms", "decode_loop_ms"}
+
+
+def test_cancelled_rows_stop_early():
+    pool = WorkerPool(1, runner="stub", runner_options={"tokens": 200, "token_ms": 10}, heartbeat_interval=0.1)
+    try:
+        assert pool.wait_ready(60)
+        image = Image.new("RGB", (28, 28))
+        keep, cancel = CancelToken(), CancelToken()
+        running = pool.submit_batch([image, image], {}, cancel_tokens=[keep, cancel])
+        time.sleep(0.3)
+        cancel.cancel()
+        # Never dispatched: the worker is busy until the first task ends
+        waiting_token = CancelToken()
+        waiting = pool.submit_batch([image], {}, cancel_tokens=[waiting_token])
+        waiting_token.cancel()
+        with pytest.raises(RuntimeError, match="Cancelled"):
+            waiting.result(1)
+
+        (_, kept, _, _), (_, stopped, _, reason) = running.result(10)
+        assert kept == 200
+        assert 0 < stopped < 100
+        assert reason == "cancelled"
+    finally:
+        pool.stop()
+
+
+def test_dead_worker_is_restarted(pool):
+    old_pid = pool.workers[0].pid
+    os.kill(old_pid, signal.SIGKILL)
+
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        worker = pool.stats()["workers"][0]
+        if worker["restarts"] == 1 and worker["state"] == "idle":
+            break
+        time.sleep(0.1)
+    assert worker["restarts"] == 1
+    assert worker["pid"] != old_pid
+    assert pool.run_batch([Image.new("RGB", (28, 28))], {})[0][0] == "\\text{28x28}"
@@ -132,7 +132,7 @@ export default function HistoryPanel({ onReRun, onCopyLatex }: HistoryPanelProps
                 <div className="w-full h-20 bg-slate-100 rounded-md flex items-center justify-center overflow-hidden">
                   {item.image_path ? (
                     <img 
-                      src={item.image_path.startsWith('/') ? item.image_path : `/api${item.image_path}`}
+                      src={item.thumbnail_url.startsWith('/') ? item.thumbnail_url : `/api${item.thumbnail_url}`}
                       alt="Equation"
                       className="w-full h-full object-contain"
                       onError={(e) => {
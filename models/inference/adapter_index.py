@@ -0,0 +1,307 @@
+import os
+import json
+import mmap
+import time
+import hashlib
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+INDEX_VERSION = 1
+CONFIG_FILES = ("training_config.json", "adapter_config.json")
+
+
+def file_checksum(paths: Iterable[str], chunk_size: int = 1 << 20) -> str:
+    digest = hashlib.sha256()
+    for path in paths:
+        digest.update(os.path.basename(path).encode("utf-8"))
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+def same_base_model(a: str, b: str) -> bool:
+    """Whether two model names or paths refer to the same base weights.
+
+    Organisations and Unsloth's 4-bit suffix are ignored, so an adapter
+    trained on ``unsloth/Qwen2-VL-7B-Instruct-bnb-4bit`` fits
+    ``Qwen/Qwen2-VL-7B-Instruct``.
+    """
+    def normalize(name: str) -> str:
+        name = os.path.basename(os.path.normpath(name)).lower()
+        for suffix in ("-unsloth-bnb-4bit", "-bnb-4bit"):
+            if name.endswith(suffix):
+                name = name[:-len(suffix)]
+        return name
+
+    return normalize(a) == normalize(b)
+
+
+def prefetch_file(path: str) -> None:
+    """Asks the OS to read a file into the page cache.
+
+    Safetensors are memory-mapped when loaded, so a prefetched adapter
+    loads without waiting for the disk.
+    """
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            if hasattr(mapped, "madvise") and hasattr(mmap, "MADV_WILLNEED"):
+                mapped.madvise(mmap.MADV_WILLNEED)
+            else:
+                for offset in range(0, size, mmap.PAGESIZE):
+                    mapped[offset]
+
+
+class AdapterIndex:
+    """Manifest of the LoRA adapters under ``artifacts_dir``.
+
+    Each job directory with a ``training_config.json`` and safetensors
+    weights has an entry with its config, the base model it was trained
+    on, and the size, checksum and mtime of its weights. The manifest is
+    kept in memory and in ``index_path``, so it survives restarts.
+    Listings and lookups are served from memory. Once the manifest is
+    older than ``ttl`` seconds it is revalidated in a background thread;
+    revalidating only stats the directories, and only jobs whose files
+    changed are read and hashed again. Scans never hold the lock that
+    readers take.
+    """
+
+    def __init__(self, artifacts_dir: str, index_path: Optional[str] = None, ttl: float = 2.0):
+        self.artifacts_dir = artifacts_dir
+        self.index_path = index_path or os.path.join(artifacts_dir, ".adapter_index.json")
+        self.ttl = ttl
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        self.scans = 0
+        self.reindexed = 0
+        self._checked_at: Optional[float] = None
+        self._prefetched: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self._scan_lock = threading.Lock()
+        self._scanning = False
+        self._ready = threading.Event()
+        self._load()
+        if self.entries:
+            self._ready.set()
+
+    def _load(self):
+        try:
+            with open(self.index_path, 'r') as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            return
+        if index.get("version") == INDEX_VERSION and index.get("artifacts_dir") == os.path.abspath(self.artifacts_dir):
+            self.entries = index.get("adapters", {})
+
+    def _save(self, entries: Dict[str, Dict[str, Any]]):
+        index = {
+            "version": INDEX_VERSION,
+            "artifacts_dir": os.path.abspath(self.artifacts_dir),
+            "adapters": entries,
+        }
+        tmp_path = f"{self.index_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(index, f)
+            os.replace(tmp_path, self.index_path)
+        except OSError:
+            # A read-only artifacts directory only costs a rescan on restart
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+
+    @staticmethod
+    def _fingerprint(job_path: str) -> Optional[Tuple[List[str], List[list]]]:
+        """Weight files and (name, size, mtime_ns) of every file the entry is read from."""
+        try:
+            names = sorted(os.listdir(job_path))
+        except OSError:
+            return None
+        weights = [name for name in names if name.endswith(".safetensors")]
+        if "training_config.json" not in names or not weights:
+            return None
+        stats = []
+        for name in weights + [name for name in CONFIG_FILES if name in names]:
+            stat = os.stat(os.path.join(job_path, name))
+            stats.append([name, stat.st_size, stat.st_mtime_ns])
+        return weights, stats
+
+    def _read_entry(self, job_id: str, job_path: str, weights: List[str], stats: List[list]) -> Dict[str, Any]:
+        with open(os.path.join(job_path, "training_config.json"), 'r') as f:
+            config = json.load(f)
+        base_model = None
+        try:
+            with open(os.path.join(job_path, "adapter_config.json"), 'r') as f:
+                base_model = json.load(f).get("base_model_name_or_path")
+        except (OSError, ValueError):
+            pass
+        weight_paths = [os.path.join(job_path, name) for name in weights]
+        return {
+            "job_id": job_id,
+            "path": job_path,
+            "config": config,
+            "base_model": base_model or config.get("base_model"),
+            "size": sum(os.path.getsize(path) for path in weight_paths),
+            "checksum": file_checksum(weight_paths),
+            "mtime": max(stat[2] for stat in stats) / 1e9,
+            "created_at": os.path.getctime(job_path),
+            "files": stats,
+        }
+
+    def _job_id(self, adapter: str) -> Optional[str]:
+        """The job id an adapter id or path names, if it is under ``artifacts_dir``."""
+        root = os.path.normpath(self.artifacts_dir)
+        for path in (os.path.normpath(adapter), os.path.normpath(os.path.join(root, adapter))):
+            if os.path.dirname(path) == root:
+                return os.path.basename(path)
+        return None
+
+    def _index_job(self, job_id: str, known: Optional[Dict[str, Any]] = None) -> Tuple[Optional[Dict[str, Any]], bool]:
+        """The current entry of a job directory, and whether it had to be read again."""
+        job_path = os.path.join(self.artifacts_dir, job_id)
+        try:
+            fingerprint = self._fingerprint(job_path)
+            if fingerprint is None:
+                return None, False
+            weights, stats = fingerprint
+            if known is not None and known["path"] == job_path and known["files"] == stats:
+                return known, False
+            return self._read_entry(job_id, job_path, weights, stats), True
+        except (OSError, ValueError):
+            # Still being written; picked up on a later scan
+            return None, False
+
+    def _scan(self) -> bool:
+        with self._scan_lock:
+            try:
+                with self._lock:
+                    known = self.entries
+                    self.scans += 1
+
+                found = {}
+                reindexed = 0
+                if os.path.isdir(self.artifacts_dir):
+                    for job_id in os.listdir(self.artifacts_dir):
+                        entry, read = self._index_job(job_id, known.get(job_id))
+                        if entry is not None:
+                            found[job_id] = entry
+                            reindexed += read
+
+                with self._lock:
+                    changed = found != self.entries
+                    self.entries = found
+                    self.reindexed += reindexed
+                if changed:
+                    self._save(found)
+                return changed
+            finally:
+                self._ready.set()
+
+    def _rescan(self):
+        try:
+            self._scan()
+        finally:
+            with self._lock:
+                self._scanning = False
+
+    def _revalidate(self):
+        """Rescans in the background once the manifest is older than ``ttl``.
+
+        Only the first scan, when there is no manifest to serve yet, runs in
+        the caller's thread; other callers wait for it.
+        """
+        with self._lock:
+            now = time.monotonic()
+            stale = self._checked_at is None or now - self._checked_at >= self.ttl
+            if self._scanning or not stale:
+                return
+            self._checked_at = now
+            self._scanning = True
+        if self._ready.is_set():
+            threading.Thread(target=self._rescan, name="adapter-index", daemon=True).start()
+        else:
+            self._rescan()
+
+    def refresh(self, force: bool = False) -> bool:
+        """Revalidates the manifest against the directories now; True if it changed."""
+        with self._lock:
+            now = time.monotonic()
+            if not force and self._checked_at is not None and now - self._checked_at < self.ttl:
+                return False
+            self._checked_at = now
+        return self._scan()
+
+    def list(self) -> List[Dict[str, Any]]:
+        """Adapters, newest first."""
+        self._revalidate()
+        self._ready.wait()
+        with self._lock:
+            adapters = [dict(entry) for entry in self.entries.values()]
+        adapters.sort(key=lambda x: x["created_at"], reverse=True)
+        return adapters
+
+    def find(self, adapter: str) -> Optional[Dict[str, Any]]:
+        """The entry of an adapter job id or path.
+
+        A job the manifest does not have yet, such as one that just
+        finished training, is indexed on the spot.
+        """
+        self._revalidate()
+        self._ready.wait()
+        job_id = self._job_id(adapter)
+        if job_id is None:
+            return None
+        with self._lock:
+            entry = self.entries.get(job_id)
+        if entry is None:
+            entry, read = self._index_job(job_id)
+            if entry is None:
+                return None
+            with self._lock:
+                self.entries = {**self.entries, job_id: entry}
+                self.reindexed += read
+                entries = self.entries
+            self._save(entries)
+        return dict(entry)
+
+    def prefetch(self, paths: Iterable[str]) -> Optional[threading.Thread]:
+        """Reads the weights of adapters into the page cache in the background.
+
+        Weights already prefetched at their current mtime are skipped.
+        """
+        with self._lock:
+            entries = {entry["path"]: entry for entry in self.entries.values()}
+            pending = []
+            for path in paths:
+                entry = entries.get(path)
+                if entry is None or self._prefetched.get(path) == entry["mtime"]:
+                    continue
+                self._prefetched[path] = entry["mtime"]
+                pending.extend(
+                    os.path.join(path, name) for name, _, _ in entry["files"] if name.endswith(".safetensors")
+                )
+        if not pending:
+            return None
+
+        def run():
+            for file_path in pending:
+                try:
+                    prefetch_file(file_path)
+                except (OSError, ValueError):
+                    pass
+
+        thread = threading.Thread(target=run, name="adapter-prefetch", daemon=True)
+        thread.start()
+        return thread
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "adapters": len(self.entries),
+                "scans": self.scans,
+                "reindexed": self.reindexed,
+                "prefetched": len(self._prefetched),
+            }
@@ -0,0 +1,97 @@
+from typing import TYPE_CHECKING, Any, Dict
+
+if TYPE_CHECKING:
+    import torch
+
+# name -> (torch weight dtype, quantize linear layers to int8). torch is only
+# imported once a model is loaded, so the API starts without it.
+PROFILES = {
+    "fp32": ("float32", False),
+    "bf16": ("bfloat16", False),
+    # Dynamic quantization needs float32 inputs, so everything else stays fp32
+    "int8": ("float32", True),
+}
+
+
+def cuda_available() -> bool:
+    import torch
+
+    return torch.cuda.is_available()
+
+
+class CPUProfile:
+    """How the model is loaded and run when there is no GPU.
+
+    ``intra_op_threads`` and ``inter_op_threads`` of 0 keep torch's defaults
+    (or the thread count an inference worker was given).
+    """
+
+    def __init__(
+        self,
+        name: str = "fp32",
+        compile: bool = False,
+        intra_op_threads: int = 0,
+        inter_op_threads: int = 0,
+    ):
+        if name not in PROFILES:
+            raise ValueError(f"Unknown CPU profile {name!r}, expected one of {', '.join(PROFILES)}")
+        self.name = name
+        self.compile = compile
+        self.intra_op_threads = intra_op_threads
+        self.inter_op_threads = inter_op_threads
+
+    @property
+    def dtype(self) -> "torch.dtype":
+        import torch
+
+        return getattr(torch, PROFILES[self.name][0])
+
+    @property
+    def quantize(self) -> bool:
+        return PROFILES[self.name][1]
+
+    @property
+    def supports_adapters(self) -> bool:
+        # LoRA layers can only wrap float nn.Linear modules
+        return not self.quantize
+
+    @property
+    def identity(self) -> str:
+        """Part of the result cache key; profiles can change the output."""
+        return "" if self.name == "fp32" else f"@{self.name}"
+
+    def to_dict(self) -> Dict[str, Any]:
+        import torch
+
+        return {
+            "name": self.name,
+            "dtype": PROFILES[self.name][0],
+            "quantize": "int8-dynamic" if self.quantize else None,
+            "compile": self.compile,
+            "intra_op_threads": torch.get_num_threads(),
+            "inter_op_threads": torch.get_num_interop_threads(),
+        }
+
+    def apply_threads(self):
+        import torch
+
+        if self.intra_op_threads:
+            torch.set_num_threads(self.intra_op_threads)
+        if self.inter_op_threads:
+            try:
+                torch.set_interop_threads(self.inter_op_threads)
+            except RuntimeError:
+                # Only possible before the first inter-op parallel work;
+                # to_dict reports what is actually in effect
+                pass
+
+    def prepare(self, model):
+        """Quantizes and compiles a model loaded with ``dtype``."""
+        import torch
+
+        if self.quantize:
+            model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+        if self.compile:
+            # Generation changes sequence lengths every step
+            model.forward = torch.compile(model.forward, dynamic=True)
+        return model.eval()
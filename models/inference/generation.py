@@ -0,0 +1,286 @@
+import time
+import threading
+from typing import Any, Dict, List, Optional, Tuple, Union
+import torch
+from transformers import StoppingCriteria, StoppingCriteriaList
+
+from .cancellation import CancelToken
+from .prompt_cache import PrefixCache, prompt_text
+from .stopping import StoppingConfig, build_row_stopper, finish_text
+from .vision_cache import ModelVisionCache
+
+
+def is_processor(tokenizer) -> bool:
+    return hasattr(tokenizer, 'tokenizer')
+
+
+def get_device() -> str:
+    return "cuda" if torch.cuda.is_available() else "cpu"
+
+
+def build_inputs(tokenizer, images: List[Any], device: str, timings: Optional[Dict[str, float]] = None):
+    """``timings``, if given, receives the time spent applying the chat template."""
+    started = time.perf_counter()
+    text = prompt_text(tokenizer, is_processor(tokenizer))
+    if timings is not None:
+        timings["template_ms"] = (time.perf_counter() - started) * 1000
+    if is_processor(tokenizer):
+        # Decoder-only generation needs the padding on the left so that every
+        # row's new tokens start at the same offset.
+        tokenizer.tokenizer.padding_side = "left"
+        return tokenizer(
+            text=[text] * len(images),
+            images=images,
+            return_tensors="pt",
+            padding=True
+        ).to(device)
+
+    if hasattr(tokenizer, 'padding_side'):
+        tokenizer.padding_side = "left"
+    return tokenizer(
+        images if len(images) > 1 else images[0],
+        [text] * len(images) if len(images) > 1 else text,
+        add_special_tokens=False,
+        return_tensors="pt",
+        padding=len(images) > 1,
+    ).to(device)
+
+
+def get_eos_token_id(model, tokenizer):
+    if is_processor(tokenizer):
+        return getattr(model.config, 'eos_token_id', None)
+    return getattr(tokenizer, 'eos_token_id', None) or getattr(model.config, 'eos_token_id', None)
+
+
+def decode(tokenizer, sequence) -> str:
+    if hasattr(tokenizer, 'decode'):
+        return tokenizer.decode(sequence, skip_special_tokens=True)
+    return tokenizer.tokenizer.decode(sequence, skip_special_tokens=True)
+
+
+class StageTimer(StoppingCriteria):
+    """Splits a generation into prefill and decode loop.
+
+    Stopping criteria run after every generation step, so the first call
+    marks the end of the prefill (the prompt pass and the first token).
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.first_token_at = None
+
+    def __call__(self, input_ids, scores, **kwargs):
+        if self.first_token_at is None:
+            self.first_token_at = time.perf_counter()
+        return torch.zeros(input_ids.shape[0], dtype=torch.bool, device=input_ids.device)
+
+    def timings(self) -> Dict[str, float]:
+        now = time.perf_counter()
+        first_token_at = self.first_token_at or now
+        return {
+            "prefill_ms": (first_token_at - self.started) * 1000,
+            "decode_loop_ms": (now - first_token_at) * 1000,
+        }
+
+
+def _generate(
+    model, tokenizer, inputs, max_new_tokens: int, temperature: float, min_p: float,
+    prefix_cache: Optional[PrefixCache] = None, vision_cache: Optional[ModelVisionCache] = None, **kwargs
+):
+    eos_token_id = get_eos_token_id(model, tokenizer)
+    # A temperature of 0 decodes greedily
+    sampling = {"do_sample": True, "temperature": temperature} if temperature > 0 else {"do_sample": False}
+    with torch.no_grad():
+        if is_processor(tokenizer):
+            if prefix_cache is not None:
+                kwargs.update(prefix_cache.generate_kwargs(model, tokenizer, inputs))
+            if vision_cache is not None:
+                inputs = vision_cache.encoder_inputs(model, inputs)
+            # Qwen2VL requires all inputs from processor
+            return model.generate(
+                **inputs,
+                max_new_tokens=max_new_tokens,
+                eos_token_id=eos_token_id,
+                pad_token_id=tokenizer.tokenizer.pad_token_id,
+                **sampling,
+                **kwargs
+            )
+        if temperature > 0:
+            sampling["min_p"] = min_p
+        return model.generate(
+            **inputs,
+            max_new_tokens=max_new_tokens,
+            use_cache=True,
+            pad_token_id=eos_token_id,
+            **sampling,
+            **kwargs
+        )
+
+
+def generate_batch(
+    model,
+    tokenizer,
+    images: List[Any],
+    max_new_tokens: Union[int, List[int]] = 256,
+    temperature: float = 0.7,
+    min_p: float = 0.1,
+    timings: Optional[Dict[str, float]] = None,
+    cancel_tokens: Optional[List[Optional[CancelToken]]] = None,
+    stopping: Optional[StoppingConfig] = None,
+    prefix_cache: Optional[PrefixCache] = None,
+    vision_cache: Optional[ModelVisionCache] = None,
+) -> List[Tuple[str, int, str]]:
+    """Returns (text, tokens, stop reason) per image.
+
+    ``timings``, if given, receives chat-template, tokenize, prefill and
+    decode-loop times in ms. ``cancel_tokens`` has one token (or None) per
+    image; cancelled rows stop at the next decode step and return what they
+    have generated. ``max_new_tokens`` may give each image its own limit.
+    ``stopping`` stops rows early, see StoppingConfig.
+    ``prefix_cache``, for the model and adapter in use, skips the prefill
+    of the prompt tokens before the image, and ``vision_cache`` the vision
+    encoder for images it has seen.
+    """
+    if cancel_tokens and all(token is not None and token.cancelled for token in cancel_tokens):
+        return [("", 0, "cancelled") for _ in images]
+    started = time.perf_counter()
+    template_timings: Dict[str, float] = {}
+    inputs = build_inputs(tokenizer, images, get_device(), template_timings)
+    eos_token_id = get_eos_token_id(model, tokenizer)
+    input_ids_len = inputs['input_ids'].shape[1]
+
+    stopper, max_new_tokens = build_row_stopper(
+        stopping, images, max_new_tokens, eos_token_id, lambda token: decode(tokenizer, [token]), cancel_tokens
+    )
+    timer = StageTimer()
+    outputs = _generate(
+        model, tokenizer, inputs, max_new_tokens, temperature, min_p, prefix_cache, vision_cache,
+        stopping_criteria=StoppingCriteriaList([timer, stopper])
+    )
+    if timings is not None:
+        timings.update(template_timings)
+        timings["tokenize_ms"] = (timer.started - started) * 1000 - template_timings["template_ms"]
+        timings.update(timer.timings())
+
+    results = []
+    for row, output in enumerate(outputs):
+        reason = stopper.reason(row)
+        results.append((
+            finish_text(decode(tokenizer, stopper.trim(row, output[input_ids_len:])), reason),
+            stopper.tokens(row),
+            reason,
+        ))
+    return results
+
+
+class StreamingGeneration:
+    """A generation running in a background thread.
+
+    Iterating yields decoded text fragments as they are produced; ``wait``
+    returns the number of generated tokens once the thread has finished,
+    ``timings`` the time spent in each stage, ``text`` the final output and
+    ``stop_reason`` why it ended.
+    """
+
+    def __init__(
+        self,
+        model,
+        tokenizer,
+        image: Any,
+        max_new_tokens: int,
+        temperature: float,
+        min_p: float,
+        timeout: float = None,
+        on_done=None,
+        cancel_token: Optional[CancelToken] = None,
+        stopping: Optional[StoppingConfig] = None,
+        prefix_cache: Optional[PrefixCache] = None,
+        vision_cache: Optional[ModelVisionCache] = None,
+    ):
+        from transformers import TextIteratorStreamer
+
+        started = time.perf_counter()
+        self._template_timings: Dict[str, float] = {}
+        inputs = build_inputs(tokenizer, [image], get_device(), self._template_timings)
+        self._eos_token_id = get_eos_token_id(model, tokenizer)
+        self._input_ids_len = inputs['input_ids'].shape[1]
+        text_tokenizer = tokenizer.tokenizer if is_processor(tokenizer) else tokenizer
+        self.streamer = TextIteratorStreamer(text_tokenizer, skip_prompt=True, skip_special_tokens=True, timeout=timeout)
+        self.tokens = 0
+        self.error = None
+        self.timer = StageTimer()
+        self._tokenize_ms = (self.timer.started - started) * 1000 - self._template_timings["template_ms"]
+        self._stage_timings: Dict[str, float] = {}
+        self._on_done = on_done
+        self._prefix_cache = prefix_cache
+        self._vision_cache = vision_cache
+        self._tokenizer = tokenizer
+        self._text = ""
+        self._stopper, max_new_tokens = build_row_stopper(
+            stopping, [image], max_new_tokens, self._eos_token_id,
+            lambda token: decode(tokenizer, [token]), [cancel_token] if cancel_token is not None else None
+        )
+        self._thread = threading.Thread(
+            target=self._run,
+            args=(model, tokenizer, inputs, max_new_tokens, temperature, min_p),
+            daemon=True,
+        )
+        self._thread.start()
+
+    def _run(self, model, tokenizer, inputs, max_new_tokens, temperature, min_p):
+        try:
+            outputs = _generate(
+                model, tokenizer, inputs, max_new_tokens, temperature, min_p, self._prefix_cache, self._vision_cache,
+                streamer=self.streamer,
+                stopping_criteria=StoppingCriteriaList([self.timer, self._stopper])
+            )
+            self._stage_timings = self.timer.timings()
+            self.tokens = self._stopper.tokens(0)
+            generated = self._stopper.trim(0, outputs[0][self._input_ids_len:])
+            self._text = finish_text(decode(self._tokenizer, generated), self._stopper.reason(0))
+        except Exception as e:
+            self.error = e
+            self.streamer.end()
+        finally:
+            if self._on_done is not None:
+                self._on_done()
+
+    def __iter__(self):
+        return iter(self.streamer)
+
+    def wait(self, timeout: float = None) -> int:
+        self._thread.join(timeout)
+        if self.error is not None:
+            raise self.error
+        return self.tokens
+
+    def timings(self) -> Dict[str, float]:
+        return {**self._template_timings, "tokenize_ms": self._tokenize_ms, **self._stage_timings}
+
+    def text(self) -> str:
+        """The output without anything generated after the stop; call after ``wait``."""
+        return self._text
+
+    def stop_reason(self) -> str:
+        return self._stopper.reason(0)
+
+
+def generate_stream(
+    model,
+    tokenizer,
+    image: Any,
+    max_new_tokens: int = 256,
+    temperature: float = 0.7,
+    min_p: float = 0.1,
+    timeout: float = None,
+    on_done=None,
+    cancel_token: Optional[CancelToken] = None,
+    stopping: Optional[StoppingConfig] = None,
+    prefix_cache: Optional[PrefixCache] = None,
+    vision_cache: Optional[ModelVisionCache] = None,
+) -> StreamingGeneration:
+    """``on_done`` is called from the generation thread once it has finished."""
+    return StreamingGeneration(
+        model, tokenizer, image, max_new_tokens, temperature, min_p, timeout, on_done, cancel_token, stopping,
+        prefix_cache, vision_cache
+    )
@@ -0,0 +1,133 @@
+import time
+from typing import Any, Dict, List, Optional, Tuple
+from PIL import Image
+
+from .preprocess import PreprocessConfig, ink_mask, preprocess_image
+
+Box = Tuple[int, int, int, int]
+
+
+class LayoutConfig:
+    """How a page is split into equation regions.
+
+    Rows without ink separate lines once at least ``min_line_gap`` pixels
+    tall, which keeps fraction bars and limits with their expression.
+    Within a line, blank columns at least ``min_column_gap`` wide separate
+    regions, so side-by-side equations are converted separately. Regions
+    smaller than ``min_region_size`` in both directions are specks and are
+    dropped.
+    """
+
+    def __init__(
+        self,
+        threshold: int = 32,
+        min_line_gap: int = 16,
+        min_column_gap: int = 48,
+        min_region_size: int = 8,
+        margin: int = 8,
+        max_regions: int = 64,
+    ):
+        self.threshold = threshold
+        self.min_line_gap = min_line_gap
+        self.min_column_gap = min_column_gap
+        self.min_region_size = min_region_size
+        self.margin = margin
+        self.max_regions = max_regions
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "threshold": self.threshold,
+            "min_line_gap": self.min_line_gap,
+            "min_column_gap": self.min_column_gap,
+            "min_region_size": self.min_region_size,
+            "margin": self.margin,
+            "max_regions": self.max_regions,
+        }
+
+
+def ink_runs(profile: List[int], min_gap: int) -> List[Tuple[int, int]]:
+    """Returns the [start, end) spans of a projection profile's ink.
+
+    Spans separated by fewer than ``min_gap`` blank entries are merged.
+    """
+    runs: List[Tuple[int, int]] = []
+    start = None
+    for i, ink in enumerate(profile):
+        if ink and start is None:
+            start = i
+        elif not ink and start is not None:
+            runs.append((start, i))
+            start = None
+    if start is not None:
+        runs.append((start, len(profile)))
+
+    merged: List[Tuple[int, int]] = []
+    for run in runs:
+        if merged and run[0] - merged[-1][1] < min_gap:
+            merged[-1] = (merged[-1][0], run[1])
+        else:
+            merged.append(run)
+    return merged
+
+
+def segment_page(image: Image.Image, config: Optional[LayoutConfig] = None) -> List[Box]:
+    """Finds the equation regions of a page, in reading order.
+
+    Lines come from the horizontal projection profile of the page's ink,
+    and regions from the vertical profile of each line; no model is
+    needed. Boxes are (left, top, right, bottom) with ``margin`` added.
+    """
+    config = config or LayoutConfig()
+    mask = ink_mask(image, config.threshold)
+    width, height = mask.size
+    boxes: List[Box] = []
+    for top, bottom in ink_runs(mask.getprojection()[1], config.min_line_gap):
+        line = mask.crop((0, top, width, bottom))
+        for left, right in ink_runs(line.getprojection()[0], config.min_column_gap):
+            # Tighten to the region's own ink; it may not span the whole line
+            bbox = line.crop((left, 0, right, bottom - top)).getbbox()
+            if bbox is None:
+                continue
+            box = (left + bbox[0], top + bbox[1], left + bbox[2], top + bbox[3])
+            if box[2] - box[0] < config.min_region_size and box[3] - box[1] < config.min_region_size:
+                continue
+            boxes.append((
+                max(0, box[0] - config.margin),
+                max(0, box[1] - config.margin),
+                min(width, box[2] + config.margin),
+                min(height, box[3] + config.margin),
+            ))
+    return boxes
+
+
+def load_page(
+    image_path: str,
+    layout: Optional[LayoutConfig] = None,
+    preprocess: Optional[PreprocessConfig] = None,
+) -> Tuple[List[Tuple[Box, Image.Image, Dict[str, Any]]], Dict[str, Any]]:
+    """Splits a page into preprocessed region crops.
+
+    Returns (box, crop, preprocess info) per region and the page info with
+    its size and the decode, layout and preprocess times in ms.
+    """
+    started = time.perf_counter()
+    page = Image.open(image_path).convert('RGB')
+    decoded = time.perf_counter()
+    boxes = segment_page(page, layout)
+    segmented = time.perf_counter()
+
+    regions = []
+    for box in boxes:
+        crop = page.crop(box)
+        if preprocess is None:
+            info = {"size": list(crop.size), "vision_tokens": None}
+        else:
+            crop, info = preprocess_image(crop, preprocess)
+        regions.append((box, crop, info))
+    info = {
+        "size": list(page.size),
+        "decode_ms": (decoded - started) * 1000,
+        "layout_ms": (segmented - decoded) * 1000,
+        "preprocess_ms": (time.perf_counter() - segmented) * 1000,
+    }
+    return regions, info
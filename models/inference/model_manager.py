@@ -1,107 +1,495 @@
+import gc
 import os
-import json
-import torch
-from typing import Optional, Dict, Any
+import time
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Callable, Optional, Dict, Any
 from pathlib import Path
 
-try:
-    from unsloth import FastVisionModel
-    UNSLOTH_AVAILABLE = True
-except (ImportError, NotImplementedError):
-    UNSLOTH_AVAILABLE = False
-    FastVisionModel = None
+from .adapter_index import AdapterIndex, same_base_model
+from .cpu_profile import CPUProfile, cuda_available
+from .prompt_cache import PrefixCache, clear_templates
+from .vision_cache import VisionCache
+
+
+# torch, transformers and Unsloth are imported on first use, so that the
+# API can start (and serve everything but inference) without them
+def load_model_and_tokenizer(cpu_profile: Optional[CPUProfile] = None):
+    from .unsloth_qwen import load_model_and_tokenizer as load
+
+    return load(cpu_profile)
+
+
+def get_base_model_name() -> str:
+    from .unsloth_qwen import get_base_model_name as base_model_name
+
+    return base_model_name()
+
+
+class ModelReplica:
+    """One loaded copy of the base model with its resident LoRA adapters.
+
+    Only the owning ModelManager mutates a replica, and only while no
+    generation is using it with a different adapter.
+    """
+
+    def __init__(self, index: int, model, tokenizer, max_resident_adapters: int):
+        self.index = index
+        self.model = model
+        self.tokenizer = tokenizer
+        self.max_resident_adapters = max_resident_adapters
+        # Resident LoRA adapters, adapter path -> adapter name, least recently used first
+        self.resident_adapters: "OrderedDict[str, str]" = OrderedDict()
+        # Adapter the model is set to (None for the base weights), how many
+        # handles are using it and whether it is being switched
+        self.active_adapter = None
+        self.users = 0
+        self.switching = False
+        self.retired = False
+        self._adapter_counter = 0
+        # Adapter path (None for the base weights) -> its prompt prefix cache
+        self.prefix_caches: Dict[Optional[str], PrefixCache] = {}
+        self._prefix_lock = threading.Lock()
+
+    def _attach_adapter(self, adapter_path: str, pinned: Optional[str]) -> str:
+        from peft import PeftModel
+
+        if adapter_path in self.resident_adapters:
+            self.resident_adapters.move_to_end(adapter_path)
+            return self.resident_adapters[adapter_path]
+
+        self._adapter_counter += 1
+        name = f"adapter_{self._adapter_counter}_{os.path.basename(os.path.normpath(adapter_path))}"
+        name = name.replace(".", "_")
+        if isinstance(self.model, PeftModel):
+            self.model.load_adapter(adapter_path, adapter_name=name)
+        else:
+            self.model = PeftModel.from_pretrained(self.model, adapter_path, adapter_name=name)
+            self.model.eval()
+        self.resident_adapters[adapter_path] = name
+        self._evict_adapters(keep=(adapter_path, pinned))
+        return name
+
+    def _evict_adapters(self, keep):
+        while len(self.resident_adapters) > max(1, self.max_resident_adapters):
+            evictable = [path for path in self.resident_adapters if path not in keep]
+            if not evictable:
+                break
+            path = evictable[0]
+            name = self.resident_adapters.pop(path)
+            self.model.delete_adapter(name)
+            with self._prefix_lock:
+                self.prefix_caches.pop(path, None)
+
+    def set_adapter(self, adapter_path: Optional[str], pinned: Optional[str] = None):
+        if adapter_path == self.active_adapter:
+            return
+        if adapter_path is None:
+            if self.resident_adapters:
+                self.model.base_model.disable_adapter_layers()
+        else:
+            name = self._attach_adapter(adapter_path, pinned)
+            self.model.set_adapter(name)
+            self.model.base_model.enable_adapter_layers()
+        self.active_adapter = adapter_path
+
+    def prefix_cache(self, adapter_path: Optional[str]) -> PrefixCache:
+        with self._prefix_lock:
+            cache = self.prefix_caches.get(adapter_path)
+            if cache is None:
+                cache = self.prefix_caches[adapter_path] = PrefixCache()
+            return cache
+
+    def clear_prefix_caches(self):
+        with self._prefix_lock:
+            self.prefix_caches.clear()
+
+    def free(self):
+        self.model = None
+        self.tokenizer = None
+        self.resident_adapters.clear()
+        self.clear_prefix_caches()
+        gc.collect()
+        if cuda_available():
+            import torch
+
+            torch.cuda.empty_cache()
+
+
+class ModelHandle:
+    """A reference to a replica for the duration of one generation."""
+
+    def __init__(self, manager: "ModelManager", replica: ModelReplica, adapter_path: Optional[str], identity: Optional[str]):
+        self._manager = manager
+        self.replica = replica
+        self.model = replica.model
+        self.tokenizer = replica.tokenizer
+        self.adapter_path = adapter_path
+        # Passed to the generation functions; None when caching is off
+        self.prefix_cache = replica.prefix_cache(adapter_path) if manager.prompt_prefix_cache else None
+        self.vision_cache = (
+            manager.vision_cache.for_model(identity)
+            if manager.vision_cache is not None and identity is not None else None
+        )
+        self.released = False
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self._manager._release(self.replica)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
 
-from .unsloth_qwen import get_model_and_tokenizer
 
 class ModelManager:
     def __init__(self):
-        self.base_model = None
-        self.base_tokenizer = None
         self.current_adapter = None
         self.adapter_path = None
         self.artifacts_dir = os.getenv("ARTIFACTS_DIR", "./models/training/outputs")
-        
+        self.adapter_index_path = os.getenv("ADAPTER_INDEX_PATH") or None
+        self.adapter_index_ttl = float(os.getenv("ADAPTER_INDEX_TTL", "2"))
+        # The newest adapters of a listing are read into the page cache
+        self.adapter_prefetch = int(os.getenv("ADAPTER_PREFETCH", "2"))
+        self._adapter_index: Optional[AdapterIndex] = None
+        self.max_resident_adapters = int(os.getenv("MAX_RESIDENT_ADAPTERS", "4"))
+        self.num_replicas = max(1, int(os.getenv("MODEL_REPLICAS", "1")))
+        # Ignored on GPUs
+        self.cpu_profile = CPUProfile()
+        # Reuse the key/value cache of the prompt tokens before the image
+        self.prompt_prefix_cache = False
+        # Reuse the vision encoder's outputs for images seen before
+        self.vision_cache: Optional[VisionCache] = None
+        self.replicas: list[ModelReplica] = []
+        # False when models are loaded by inference worker processes and this
+        # manager only tracks the default adapter
+        self.in_process = True
+        # Serializes loading; never held while waiting for handles
+        self._load_lock = threading.Lock()
+        self._cond = threading.Condition()
+        # Arrival ticket -> adapter path of every acquire not yet served
+        self._waiting: Dict[int, Optional[str]] = {}
+        self._tickets = 0
+        self.loads = 0
+        # Called as listener(event, seconds) after "base_load", "adapter_load"
+        # (an adapter attached for the first time) and "adapter_switch"
+        self.listeners: list[Callable[[str, float], None]] = []
+
+    @property
+    def base_model(self):
+        return self.replicas[0].model if self.replicas else None
+
+    @property
+    def base_tokenizer(self):
+        return self.replicas[0].tokenizer if self.replicas else None
+
+    @property
+    def resident_adapters(self) -> "OrderedDict[str, str]":
+        return self.replicas[0].resident_adapters if self.replicas else OrderedDict()
+
+    @property
+    def base_model_name(self) -> Optional[str]:
+        """Name or path the loaded base model was loaded from; None before loading."""
+        config = getattr(self.base_model, "config", None)
+        return getattr(config, "_name_or_path", None) or None
+
+    @property
+    def adapter_index(self) -> AdapterIndex:
+        if self._adapter_index is None or self._adapter_index.artifacts_dir != self.artifacts_dir:
+            self._adapter_index = AdapterIndex(self.artifacts_dir, self.adapter_index_path, self.adapter_index_ttl)
+        return self._adapter_index
+
+    def _load_replicas(self) -> list[ModelReplica]:
+        replicas = []
+        for index in range(self.num_replicas):
+            started = time.perf_counter()
+            model, tokenizer = load_model_and_tokenizer(self.cpu_profile)
+            replicas.append(ModelReplica(index, model, tokenizer, self.max_resident_adapters))
+            self.loads += 1
+            self._notify("base_load", time.perf_counter() - started)
+        return replicas
+
+    def _notify(self, event: str, seconds: float):
+        for listener in self.listeners:
+            try:
+                listener(event, seconds)
+            except Exception:
+                pass
+
     def load_base_model(self):
-        if self.base_model is None:
-            self.base_model, self.base_tokenizer = get_model_and_tokenizer()
-    
+        if self.replicas:
+            return
+        with self._load_lock:
+            if not self.replicas:
+                replicas = self._load_replicas()
+                with self._cond:
+                    self.replicas = replicas
+                    self._cond.notify_all()
+
+    def clear_prompt_caches(self):
+        """Drops the cached chat templates and prompt prefixes.
+
+        Prefixes are computed with the weights in use, so they are dropped
+        whenever the default model is switched.
+        """
+        clear_templates()
+        with self._cond:
+            replicas = list(self.replicas)
+        for replica in replicas:
+            replica.clear_prefix_caches()
+
+    def reload(self):
+        """Loads fresh replicas and swaps them in atomically.
+
+        Generations holding handles on the old replicas finish on them; each
+        old replica is freed when its last handle is released.
+        """
+        with self._load_lock:
+            replicas = self._load_replicas()
+            with self._cond:
+                old, self.replicas = self.replicas, replicas
+                for replica in old:
+                    replica.retired = True
+                    if replica.users == 0:
+                        replica.free()
+                self._cond.notify_all()
+
     def get_available_adapters(self) -> list[Dict[str, Any]]:
-        adapters = []
-        
-        if not os.path.exists(self.artifacts_dir):
-            return adapters
-            
-        for job_dir in os.listdir(self.artifacts_dir):
-            job_path = os.path.join(self.artifacts_dir, job_dir)
-            if os.path.isdir(job_path):
-                config_file = os.path.join(job_path, "training_config.json")
-                if os.path.exists(config_file):
-                    try:
-                        with open(config_file, 'r') as f:
-                            config = json.load(f)
-                        
-                        model_files = [f for f in os.listdir(job_path) if f.endswith('.safetensors')]
-                        if model_files:
-                            adapters.append({
-                                "job_id": job_dir,
-                                "path": job_path,
-                                "config": config,
-                                "created_at": os.path.getctime(job_path)
-                            })
-                    except Exception:
-                        pass
-        
-        adapters.sort(key=lambda x: x["created_at"], reverse=True)
+        """Indexed adapters, newest first, with whether they fit the loaded base model.
+
+        ``compatible`` is None while no base model is loaded in this process
+        or the adapter does not record its base model.
+        """
+        index = self.adapter_index
+        adapters = index.list()
+        base_model_name = self.base_model_name
+        for adapter in adapters:
+            adapter["compatible"] = (
+                same_base_model(adapter["base_model"], base_model_name)
+                if adapter["base_model"] and base_model_name else None
+            )
+        if self.adapter_prefetch > 0:
+            index.prefetch(adapter["path"] for adapter in adapters[:self.adapter_prefetch])
         return adapters
+
+    def check_compatible(self, adapter_path: str):
+        base_model_name = self.base_model_name
+        entry = self.adapter_index.find(adapter_path)
+        if entry is None or not entry["base_model"] or not base_model_name:
+            return
+        if not same_base_model(entry["base_model"], base_model_name):
+            raise ValueError(f"Adapter {entry['job_id']} was trained on {entry['base_model']}, not {base_model_name}")
     
+    def adapters_supported(self) -> bool:
+        return cuda_available() or self.cpu_profile.supports_adapters
+
+    def resolve_adapter(self, adapter: Optional[str]) -> Optional[str]:
+        if adapter is None or adapter == self.adapter_path:
+            return self.adapter_path
+        if adapter == "base":
+            return None
+        if not self.adapters_supported():
+            raise ValueError(f"Adapters are not supported with the {self.cpu_profile.name} CPU profile")
+        available = self.adapter_index.find(adapter)
+        if available is not None:
+            return available["path"]
+        if any(adapter in replica.resident_adapters for replica in self.replicas):
+            return adapter
+        raise ValueError(f"Unknown adapter: {adapter}")
+
+    def _pick_replica(self, adapter_path: Optional[str], ticket: int) -> Optional[ModelReplica]:
+        # Waits behind any request for another adapter that arrived first, so
+        # steady traffic for one adapter cannot keep its replicas from
+        # draining and switching
+        if any(t < ticket and path != adapter_path for t, path in self._waiting.items()):
+            return None
+        # Prefer joining a replica already set to the adapter, then an idle one
+        joinable = [
+            r for r in self.replicas
+            if not r.switching and r.active_adapter == adapter_path
+        ]
+        if joinable:
+            return min(joinable, key=lambda r: r.users)
+        idle = [r for r in self.replicas if r.users == 0]
+        if idle:
+            return max(idle, key=lambda r: adapter_path in r.resident_adapters)
+        return None
+
+    def acquire(self, adapter: Optional[str] = None) -> ModelHandle:
+        """Returns a handle on a replica set to ``adapter`` for one generation.
+
+        ``adapter`` is an adapter path or job id, ``"base"`` or ``None`` for the
+        current default. Handles for the same adapter share a replica; a
+        replica only switches adapters once all its handles are released.
+        Requests are served in arrival order across adapters: none joins a
+        replica while a request for another adapter that came first waits.
+        Every handle must be released.
+        """
+        adapter_path = self.resolve_adapter(adapter)
+        self.load_base_model()
+        if adapter_path is not None and adapter_path not in self.resident_adapters:
+            self.check_compatible(adapter_path)
+        # May read and hash adapter files, so it is looked up before taking the lock
+        identity = self.weights_identity(adapter_path) if self.vision_cache is not None else None
+        with self._cond:
+            self._tickets += 1
+            ticket = self._tickets
+            self._waiting[ticket] = adapter_path
+            try:
+                replica = self._pick_replica(adapter_path, ticket)
+                while replica is None:
+                    self._cond.wait()
+                    replica = self._pick_replica(adapter_path, ticket)
+            finally:
+                del self._waiting[ticket]
+                self._cond.notify_all()
+            replica.users += 1
+            ready = replica.active_adapter == adapter_path
+            if ready:
+                if adapter_path is not None:
+                    replica.resident_adapters.move_to_end(adapter_path)
+            else:
+                replica.switching = True
+        if ready:
+            return ModelHandle(self, replica, adapter_path, identity)
+
+        # The replica is reserved for us, so it can be switched without the lock
+        attaching = adapter_path is not None and adapter_path not in replica.resident_adapters
+        started = time.perf_counter()
+        try:
+            replica.set_adapter(adapter_path, pinned=self.adapter_path)
+        except Exception:
+            with self._cond:
+                replica.switching = False
+                replica.users -= 1
+                self._cond.notify_all()
+            raise
+        with self._cond:
+            replica.switching = False
+            self._cond.notify_all()
+        self._notify("adapter_load" if attaching else "adapter_switch", time.perf_counter() - started)
+        return ModelHandle(self, replica, adapter_path, identity)
+
+    def _release(self, replica: ModelReplica):
+        with self._cond:
+            replica.users -= 1
+            if replica.retired and replica.users == 0:
+                replica.free()
+            self._cond.notify_all()
+
+    @contextmanager
+    def activate(self, adapter: Optional[str] = None):
+        handle = self.acquire(adapter)
+        try:
+            yield handle
+        finally:
+            handle.release()
+
     def load_adapter(self, adapter_path: str) -> bool:
         try:
-            if not os.path.exists(adapter_path):
+            if not os.path.exists(adapter_path) or not self.adapters_supported():
                 return False
-            
-            self.load_base_model()
-            
-            adapter_model, adapter_tokenizer = FastVisionModel.from_pretrained(
-                adapter_path,
-                load_in_4bit=True,
-                use_gradient_checkpointing="unsloth"
-            )
-            
-            FastVisionModel.for_inference(adapter_model)
-            
-            self.base_model = adapter_model
-            self.base_tokenizer = adapter_tokenizer
+            if not self.in_process:
+                with self._cond:
+                    self.adapter_path = adapter_path
+                self.current_adapter = adapter_path
+                return True
+
+            # Attaching once surfaces loading errors before it becomes the default
+            with self._cond:
+                previous = self.adapter_path
+                self.adapter_path = adapter_path
+            try:
+                self.acquire(adapter_path).release()
+            except Exception:
+                with self._cond:
+                    self.adapter_path = previous
+                raise
             self.current_adapter = adapter_path
-            self.adapter_path = adapter_path
-            
+
             return True
-            
+
         except Exception:
             return False
-    
+
     def switch_to_base(self) -> bool:
         try:
-            self.base_model, self.base_tokenizer = get_model_and_tokenizer()
-            self.current_adapter = None
-            self.adapter_path = None
+            if self.in_process:
+                self.load_base_model()
+            with self._cond:
+                self.current_adapter = None
+                self.adapter_path = None
             return True
         except Exception:
             return False
-    
+
+    def get_cpu_profile_info(self) -> Optional[Dict[str, Any]]:
+        if cuda_available():
+            return None
+        info = self.cpu_profile.to_dict()
+        if not self.in_process:
+            # Thread counts of this process say nothing about the workers'
+            info["intra_op_threads"] = self.cpu_profile.intra_op_threads or None
+            info["inter_op_threads"] = self.cpu_profile.inter_op_threads or None
+        return info
+
     def get_current_model_info(self) -> Dict[str, Any]:
+        resident = [os.path.basename(path) for path in self.resident_adapters]
         if self.current_adapter:
             return {
                 "type": "adapter",
                 "path": self.adapter_path,
-                "name": os.path.basename(self.adapter_path)
+                "name": os.path.basename(self.adapter_path),
+                "resident_adapters": resident,
+                "replicas": len(self.replicas),
+                "cpu_profile": self.get_cpu_profile_info()
             }
         else:
             return {
                 "type": "base",
-                "path": "unsloth/Qwen2-VL-7B-Instruct",
-                "name": "Base Qwen2-VL"
+                "path": get_base_model_name(),
+                "name": "Base Qwen2-VL",
+                "resident_adapters": resident,
+                "replicas": len(self.replicas),
+                "cpu_profile": self.get_cpu_profile_info()
             }
-    
+
+    def get_stats(self) -> Dict[str, Any]:
+        adapter_index = self._adapter_index.stats() if self._adapter_index is not None else None
+        with self._cond:
+            return {
+                "loads": self.loads,
+                "adapter_index": adapter_index,
+                "vision_cache": self.vision_cache.stats() if self.vision_cache is not None else None,
+                "replicas": [
+                    {
+                        "index": r.index,
+                        "users": r.users,
+                        "active_adapter": r.active_adapter,
+                        "resident_adapters": list(r.resident_adapters),
+                        "prefix_cache_hits": sum(cache.hits for cache in r.prefix_caches.values()),
+                    }
+                    for r in self.replicas
+                ],
+            }
+
+    def weights_identity(self, adapter_path: Optional[str]) -> str:
+        """Names the weights by content, so retrained adapters at the same path get new cache keys."""
+        identity = get_base_model_name()
+        if adapter_path is not None:
+            entry = self.adapter_index.find(adapter_path)
+            identity = f"{adapter_path}@{entry['checksum']}" if entry is not None else adapter_path
+        if not cuda_available():
+            identity += self.cpu_profile.identity
+        return identity
+
+    def get_model_identity(self, adapter: Optional[str] = None) -> str:
+        return self.weights_identity(self.resolve_adapter(adapter))
+
     def get_model_and_tokenizer(self):
         self.load_base_model()
         return self.base_model, self.base_tokenizer
@@ -0,0 +1,128 @@
+import math
+import time
+from typing import Any, Dict, Optional, Tuple
+from PIL import Image, ImageChops, ImageOps
+
+# Qwen2-VL embeds 14x14 patches and merges 2x2 of them into one vision token,
+# so every 28x28 pixel cell of the resized image costs one token.
+PATCH_SIZE = 14
+MERGE_SIZE = 2
+TOKEN_CELL = PATCH_SIZE * MERGE_SIZE
+MIN_PIXELS = 56 * 56
+
+
+class PreprocessConfig:
+    def __init__(
+        self,
+        crop: bool = True,
+        crop_threshold: int = 32,
+        crop_margin: int = 8,
+        max_pixels: int = 1024 * TOKEN_CELL * TOKEN_CELL,
+        max_vision_tokens: int = 512,
+        grayscale: bool = False,
+    ):
+        self.crop = crop
+        self.crop_threshold = crop_threshold
+        self.crop_margin = crop_margin
+        self.max_pixels = max_pixels
+        self.max_vision_tokens = max_vision_tokens
+        self.grayscale = grayscale
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "crop": self.crop,
+            "crop_threshold": self.crop_threshold,
+            "crop_margin": self.crop_margin,
+            "max_pixels": self.max_pixels,
+            "max_vision_tokens": self.max_vision_tokens,
+            "grayscale": self.grayscale,
+        }
+
+
+def count_vision_tokens(width: int, height: int) -> int:
+    return (height // TOKEN_CELL) * (width // TOKEN_CELL)
+
+
+def ink_mask(image: Image.Image, threshold: int = 32) -> Image.Image:
+    """Pixels that differ from the background by more than ``threshold``, as 255."""
+    gray = ImageOps.grayscale(image)
+    width, height = gray.size
+    # The background is whatever colour dominates the border
+    border = [gray.getpixel((x, y)) for x in range(0, width, max(1, width // 32)) for y in (0, height - 1)]
+    border += [gray.getpixel((x, y)) for y in range(0, height, max(1, height // 32)) for x in (0, width - 1)]
+    background = sorted(border)[len(border) // 2]
+    diff = ImageChops.difference(gray, Image.new("L", gray.size, background))
+    return diff.point(lambda v: 255 if v > threshold else 0)
+
+
+def content_bbox(image: Image.Image, threshold: int = 32) -> Optional[Tuple[int, int, int, int]]:
+    return ink_mask(image, threshold).getbbox()
+
+
+def crop_to_content(image: Image.Image, threshold: int = 32, margin: int = 8) -> Tuple[Image.Image, Optional[Tuple[int, int, int, int]]]:
+    bbox = content_bbox(image, threshold)
+    if bbox is None:
+        return image, None
+    left, top, right, bottom = bbox
+    width, height = image.size
+    box = (
+        max(0, left - margin),
+        max(0, top - margin),
+        min(width, right + margin),
+        min(height, bottom + margin),
+    )
+    if box == (0, 0, width, height):
+        return image, None
+    return image.crop(box), box
+
+
+def fit_to_token_budget(width: int, height: int, max_pixels: int, max_vision_tokens: int) -> Tuple[int, int]:
+    """Returns a size on the 28-pixel token grid within both budgets.
+
+    The aspect ratio is kept as closely as the grid allows and images are
+    never upscaled beyond what the processor's minimum size requires.
+    """
+    max_pixels = min(max_pixels, max_vision_tokens * TOKEN_CELL * TOKEN_CELL)
+    scale = min(1.0, math.sqrt(max_pixels / float(width * height)))
+    new_width = max(TOKEN_CELL, int(width * scale) // TOKEN_CELL * TOKEN_CELL)
+    new_height = max(TOKEN_CELL, int(height * scale) // TOKEN_CELL * TOKEN_CELL)
+    if new_width * new_height < MIN_PIXELS:
+        factor = math.sqrt(MIN_PIXELS / float(new_width * new_height))
+        new_width = math.ceil(new_width * factor / TOKEN_CELL) * TOKEN_CELL
+        new_height = math.ceil(new_height * factor / TOKEN_CELL) * TOKEN_CELL
+    return new_width, new_height
+
+
+def preprocess_image(image: Image.Image, config: Optional[PreprocessConfig] = None) -> Tuple[Image.Image, Dict[str, Any]]:
+    config = config or PreprocessConfig()
+    info: Dict[str, Any] = {"original_size": list(image.size), "crop_box": None}
+
+    if config.crop:
+        image, box = crop_to_content(image, config.crop_threshold, config.crop_margin)
+        info["crop_box"] = list(box) if box else None
+
+    size = fit_to_token_budget(image.width, image.height, config.max_pixels, config.max_vision_tokens)
+    if size != image.size:
+        image = image.resize(size, Image.Resampling.LANCZOS)
+
+    if config.grayscale:
+        image = ImageOps.grayscale(image).convert("RGB")
+
+    info["size"] = list(image.size)
+    info["vision_tokens"] = count_vision_tokens(*image.size)
+    return image, info
+
+
+def load_image(image_path: str, config: Optional[PreprocessConfig] = None) -> Tuple[Image.Image, Dict[str, Any]]:
+    """Also reports the decode and preprocess times in ms in the info dict."""
+    started = time.perf_counter()
+    image = Image.open(image_path).convert('RGB')
+    decoded = time.perf_counter()
+    if config is None:
+        info = {"original_size": list(image.size), "size": list(image.size), "crop_box": None,
+                "vision_tokens": None}
+    else:
+        image, info = preprocess_image(image, config)
+    info["decode_ms"] = (decoded - started) * 1000
+    info["preprocess_ms"] = (time.perf_counter() - decoded) * 1000
+    return image, info
@@ -0,0 +1,163 @@
+import copy
+import inspect
+import threading
+import weakref
+from typing import TYPE_CHECKING, Any, Dict, Optional
+
+if TYPE_CHECKING:
+    import torch
+
+INSTRUCTION = "Write the LaTeX representation for this image."
+
+# tokenizer -> chat-templated prompt; the instruction never changes, so the
+# template only needs to be applied once per tokenizer
+_templates: "weakref.WeakKeyDictionary[Any, str]" = weakref.WeakKeyDictionary()
+_templates_lock = threading.Lock()
+
+
+def prompt_messages(processor: bool):
+    # Processors take the image before the instruction; the Unsloth
+    # tokenizer was trained with it after
+    image = {"type": "image"}
+    text = {"type": "text", "text": INSTRUCTION}
+    return [{"role": "user", "content": [image, text] if processor else [text, image]}]
+
+
+def prompt_text(tokenizer, processor: bool) -> str:
+    """The chat-templated prompt for ``tokenizer``, applied once and cached."""
+    text = _templates.get(tokenizer)
+    if text is None:
+        messages = prompt_messages(processor)
+        if processor:
+            text = tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+        else:
+            text = tokenizer.apply_chat_template(messages, add_generation_prompt=True)
+        with _templates_lock:
+            _templates[tokenizer] = text
+    return text
+
+
+def clear_templates():
+    with _templates_lock:
+        _templates.clear()
+
+
+def _rope_index(model):
+    """The model's multimodal (M-RoPE) position function, if it has one."""
+    base = model.get_base_model() if hasattr(model, "get_base_model") else model
+    return getattr(getattr(base, "model", None), "get_rope_index", None)
+
+
+def cache_supported() -> bool:
+    """Whether transformers has the cache API the prefix cache is built on.
+
+    ``DynamicCache(config=...)`` and ``batch_repeat_interleave`` are only in
+    recent releases; without them generations prefill the whole prompt.
+    """
+    from transformers import DynamicCache
+
+    return (
+        "config" in inspect.signature(DynamicCache.__init__).parameters
+        and hasattr(DynamicCache, "batch_repeat_interleave")
+    )
+
+
+class PrefixCache:
+    """Key/value cache of the prompt tokens every request shares, for one model and adapter.
+
+    The chat template puts the same tokens before every image. They are run
+    through the model once, on the first generation, and every later
+    generation starts from a copy of their cache, so its prefill only
+    covers the image and the tokens after it. The cache depends on the
+    weights, so it must be dropped when the adapter changes. With a
+    transformers release that lacks the cache API it is never used, see
+    ``cache_supported``.
+    """
+
+    def __init__(self):
+        self.prefix_ids: Optional["torch.Tensor"] = None
+        self.past_key_values = None
+        self.hits = 0
+        self._supported: Optional[bool] = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def prefix_length(tokenizer, input_ids: "torch.Tensor") -> int:
+        """Tokens before the first image token, which are the same for every image."""
+        image_token_id = getattr(tokenizer, "image_token_id", None)
+        if image_token_id is None:
+            return 0
+        positions = (input_ids[0] == image_token_id).nonzero()
+        return int(positions[0]) if len(positions) else 0
+
+    def _positions(self, model, inputs) -> Optional["torch.Tensor"]:
+        rope_index = _rope_index(model)
+        if rope_index is None:
+            return None
+        # M-RoPE positions depend on the image grid, so the model cannot
+        # infer them from the cache length; they are passed explicitly
+        parameters = inspect.signature(rope_index).parameters
+        kwargs = {
+            name: inputs[name]
+            for name in ("image_grid_thw", "attention_mask", "mm_token_type_ids")
+            if name in parameters and name in inputs
+        }
+        position_ids, _ = rope_index(inputs["input_ids"], **kwargs)
+        return position_ids
+
+    def _build(self, model, inputs, length: int, position_ids: Optional["torch.Tensor"]):
+        import torch
+        from transformers import DynamicCache
+
+        prefix_ids = inputs["input_ids"][:1, :length]
+        cache = DynamicCache(config=model.config)
+        kwargs = {}
+        if position_ids is not None:
+            kwargs["position_ids"] = position_ids[..., :1, :length]
+        with torch.no_grad():
+            model(
+                input_ids=prefix_ids,
+                attention_mask=torch.ones_like(prefix_ids),
+                past_key_values=cache,
+                use_cache=True,
+                **kwargs,
+            )
+        self.prefix_ids, self.past_key_values = prefix_ids, cache
+
+    def generate_kwargs(self, model, tokenizer, inputs) -> Dict[str, Any]:
+        """Extra ``model.generate`` arguments that start from the cached prefix.
+
+        Empty when the rows do not all start with the prefix, e.g. when
+        shorter rows of a batch are padded on the left.
+        """
+        import torch
+
+        if self._supported is None:
+            self._supported = cache_supported()
+        if not self._supported:
+            return {}
+        input_ids = inputs["input_ids"]
+        with self._lock:
+            if self.prefix_ids is None:
+                length = self.prefix_length(tokenizer, input_ids)
+                if length == 0:
+                    return {}
+            else:
+                length = self.prefix_ids.shape[1]
+            if input_ids.shape[1] <= length or not bool((input_ids[:, :length] == input_ids[:1, :length]).all()):
+                return {}
+            if "attention_mask" in inputs and not bool(inputs["attention_mask"][:, :length].all()):
+                return {}
+            position_ids = self._positions(model, inputs)
+            if self.prefix_ids is None:
+                self._build(model, inputs, length, position_ids)
+            elif not torch.equal(input_ids[:1, :length], self.prefix_ids):
+                return {}
+            self.hits += 1
+            past_key_values = copy.deepcopy(self.past_key_values)
+        if input_ids.shape[0] > 1:
+            past_key_values.batch_repeat_interleave(input_ids.shape[0])
+        kwargs = {"past_key_values": past_key_values}
+        if position_ids is not None:
+            kwargs["position_ids"] = position_ids
+        return kwargs
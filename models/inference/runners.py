@@ -0,0 +1,199 @@
+import time
+import queue
+import threading
+from concurrent.futures import Future
+from typing import Any, Dict, List, Optional, Tuple
+
+from .cancellation import CancelToken
+
+# A runner turns (images, generation settings, adapter path) into one
+# (latex, tokens, stage timings in ms, stop reason) tuple per image. Runners are used by
+# the API process directly or by inference worker processes. Rows whose
+# cancel token is cancelled stop early.
+
+
+class ModelRunner:
+    """Runs generations on the model of this process's model manager."""
+
+    def __init__(self, cpu_profile=None, prompt_prefix_cache: Optional[bool] = None, vision_cache: Optional[Dict[str, Any]] = None):
+        """``vision_cache`` holds the build_vision_cache arguments."""
+        from .model_manager import model_manager
+        from .vision_cache import build_vision_cache
+
+        self.model_manager = model_manager
+        if cpu_profile is not None:
+            self.model_manager.cpu_profile = cpu_profile
+        if prompt_prefix_cache is not None:
+            self.model_manager.prompt_prefix_cache = prompt_prefix_cache
+        if vision_cache is not None:
+            self.model_manager.vision_cache = build_vision_cache(**vision_cache)
+
+    def load(self):
+        self.model_manager.load_base_model()
+
+    def run_batch(
+        self,
+        images: List[Any],
+        generation: Dict[str, Any],
+        adapter_path: Optional[str],
+        cancel_tokens: Optional[List[Optional[CancelToken]]] = None,
+    ) -> List[Tuple[str, int, Dict[str, float], str]]:
+        from .generation import generate_batch
+
+        timings: Dict[str, float] = {}
+        with self.model_manager.activate(adapter_path or "base") as handle:
+            results = generate_batch(
+                handle.model, handle.tokenizer, images, timings=timings, cancel_tokens=cancel_tokens,
+                prefix_cache=handle.prefix_cache, vision_cache=handle.vision_cache, **generation
+            )
+        return [(text, tokens, timings, reason) for text, tokens, reason in results]
+
+    def stream(
+        self,
+        image: Any,
+        generation: Dict[str, Any],
+        adapter_path: Optional[str],
+        emit,
+        cancel_token: Optional[CancelToken] = None,
+    ) -> Tuple[str, int, Dict[str, float], str]:
+        from .generation import generate_stream
+
+        with self.model_manager.activate(adapter_path or "base") as handle:
+            stream = generate_stream(
+                handle.model, handle.tokenizer, image, cancel_token=cancel_token,
+                prefix_cache=handle.prefix_cache, vision_cache=handle.vision_cache, **generation
+            )
+            for text in stream:
+                if text:
+                    emit(text)
+            tokens = stream.wait()
+            return stream.text(), tokens, stream.timings(), stream.stop_reason()
+
+
+class StubRunner:
+    """Returns canned output without loading a model, for tests and benchmarks.
+
+    ``prefill_ms`` and ``token_ms`` simulate the cost of a batch's prefill
+    and of each of its ``tokens`` decode steps.
+    """
+
+    def __init__(self, prefill_ms: float = 0.0, token_ms: float = 0.0, tokens: int = 16):
+        self.prefill_ms = prefill_ms
+        self.token_ms = token_ms
+        self.tokens = tokens
+
+    def load(self):
+        pass
+
+    def _latex(self, image: Any) -> str:
+        return f"\\text{{{image.width}x{image.height}}}"
+
+    def run_batch(
+        self,
+        images: List[Any],
+        generation: Dict[str, Any],
+        adapter_path: Optional[str],
+        cancel_tokens: Optional[List[Optional[CancelToken]]] = None,
+    ) -> List[Tuple[str, int, Dict[str, float], str]]:
+        max_new_tokens = generation.get("max_new_tokens", self.tokens)
+        limits = max_new_tokens if isinstance(max_new_tokens, list) else [max_new_tokens] * len(images)
+        budgets = [min(self.tokens, limit) for limit in limits]
+        time.sleep(self.prefill_ms / 1000.0)
+        if not cancel_tokens:
+            counts = list(budgets)
+            time.sleep(max(budgets) * self.token_ms / 1000.0)
+        else:
+            # One step at a time so that cancelled rows can stop
+            counts = [0] * len(images)
+            for _ in range(max(budgets)):
+                live = [
+                    row for row, token in enumerate(cancel_tokens)
+                    if counts[row] < budgets[row] and (token is None or not token.cancelled)
+                ]
+                if not live:
+                    break
+                time.sleep(self.token_ms / 1000.0)
+                for row in live:
+                    counts[row] += 1
+        timings = {"template_ms": 0.0, "tokenize_ms": 0.0, "prefill_ms": self.prefill_ms, "decode_loop_ms": max(counts) * self.token_ms}
+        reasons = [
+            "cancelled" if tokens < budget else "length" if budget == limit else "eos"
+            for tokens, budget, limit in zip(counts, budgets, limits)
+        ]
+        return [(self._latex(image), tokens, timings, reason) for image, tokens, reason in zip(images, counts, reasons)]
+
+    def stream(
+        self,
+        image: Any,
+        generation: Dict[str, Any],
+        adapter_path: Optional[str],
+        emit,
+        cancel_token: Optional[CancelToken] = None,
+    ) -> Tuple[str, int, Dict[str, float], str]:
+        result = self.run_batch([image], generation, adapter_path, [cancel_token])[0]
+        emit(result[0])
+        return result
+
+
+RUNNERS = {"model": ModelRunner, "stub": StubRunner}
+
+
+def build_runner(name: str, **options):
+    if name not in RUNNERS:
+        raise ValueError(f"Unknown inference runner: {name}")
+    return RUNNERS[name](**options)
+
+
+class RunnerStream:
+    """A streamed generation, with the interface of StreamingGeneration.
+
+    ``future`` resolves to the runner's (latex, tokens, timings, stop reason)
+    tuple; the fragments queue ends with None.
+    """
+
+    def __init__(self, timeout: Optional[float] = None):
+        self.future = Future()
+        self.timeout = timeout
+        self.fragments: "queue.Queue[Optional[str]]" = queue.Queue()
+
+    def __iter__(self):
+        while True:
+            text = self.fragments.get(timeout=self.timeout)
+            if text is None:
+                return
+            yield text
+
+    def wait(self, timeout: Optional[float] = None) -> int:
+        return self.future.result(timeout)[1]
+
+    def timings(self) -> Dict[str, float]:
+        return self.future.result()[2]
+
+    def text(self) -> str:
+        return self.future.result()[0]
+
+    def stop_reason(self) -> str:
+        return self.future.result()[3]
+
+
+def start_stream(
+    runner,
+    image: Any,
+    generation: Dict[str, Any],
+    adapter_path: Optional[str],
+    timeout: Optional[float] = None,
+    cancel_token: Optional[CancelToken] = None,
+) -> RunnerStream:
+    """Runs ``runner.stream`` in a background thread."""
+    stream = RunnerStream(timeout)
+
+    def run():
+        try:
+            stream.future.set_result(runner.stream(image, generation, adapter_path, stream.fragments.put, cancel_token))
+        except Exception as e:
+            stream.future.set_exception(e)
+        finally:
+            stream.fragments.put(None)
+
+    threading.Thread(target=run, daemon=True).start()
+    return stream
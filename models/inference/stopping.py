@@ -0,0 +1,280 @@
+import re
+import math
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+from .cancellation import CancelToken
+from .preprocess import TOKEN_CELL
+
+# Why a row stopped: its end-of-sequence token, max_new_tokens, its
+# adaptive budget, a repetition loop, a complete LaTeX expression or a
+# cancelled request
+STOP_REASONS = ("eos", "length", "budget", "repetition", "complete", "cancelled")
+
+# Display-math delimiters an expression can be wrapped in; inline math
+# may be one segment of several, so it never completes the output
+DISPLAY_DELIMITERS = (("$$", "$$"), ("\\[", "\\]"))
+ENVIRONMENT = re.compile(r"\\(begin|end)\s*\{([^{}]*)\}")
+# Environments that hold a whole display; a matrix or cases environment
+# can be followed by more of the expression
+DISPLAY_ENVIRONMENTS = {
+    name + star
+    for name in ("equation", "align", "alignat", "gather", "multline", "flalign", "eqnarray", "displaymath")
+    for star in ("", "*")
+}
+# Only tokens containing one of these can complete an expression
+CLOSING_CHARS = set("}$])\n")
+
+
+class StoppingConfig:
+    """Stops generations before ``max_new_tokens`` when more tokens cannot help.
+
+    ``max_ngram`` and ``min_repeated_tokens`` stop outputs that end in the
+    same n-gram (n up to ``max_ngram``) repeated over at least
+    ``min_repeated_tokens`` tokens, keeping one copy. ``latex_complete``
+    stops once a display expression holding the whole output is complete,
+    see ``latex_end``. With ``adaptive_budget`` each image generates up to
+    a budget from its size instead of ``max_new_tokens``: fewer tokens for
+    small images, more for large ones up to ``budget_max``, see
+    ``token_budget``.
+    """
+
+    def __init__(
+        self,
+        repetition: bool = True,
+        max_ngram: int = 16,
+        min_repeated_tokens: int = 32,
+        latex_complete: bool = False,
+        adaptive_budget: bool = False,
+        budget_base: int = 64,
+        budget_per_vision_token: float = 0.5,
+        budget_per_aspect: float = 8.0,
+        budget_max: int = 1024,
+    ):
+        self.repetition = repetition
+        self.max_ngram = max_ngram
+        self.min_repeated_tokens = min_repeated_tokens
+        self.latex_complete = latex_complete
+        self.adaptive_budget = adaptive_budget
+        self.budget_base = budget_base
+        self.budget_per_vision_token = budget_per_vision_token
+        self.budget_per_aspect = budget_per_aspect
+        self.budget_max = budget_max
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "repetition": self.repetition,
+            "max_ngram": self.max_ngram,
+            "min_repeated_tokens": self.min_repeated_tokens,
+            "latex_complete": self.latex_complete,
+            "adaptive_budget": self.adaptive_budget,
+            "budget_base": self.budget_base,
+            "budget_per_vision_token": self.budget_per_vision_token,
+            "budget_per_aspect": self.budget_per_aspect,
+            "budget_max": self.budget_max,
+        }
+
+    # Part of the batch scheduler's key
+    def __eq__(self, other):
+        return isinstance(other, StoppingConfig) and self.to_dict() == other.to_dict()
+
+    def __hash__(self):
+        return hash(tuple(sorted(self.to_dict().items())))
+
+    def token_budget(self, size: Tuple[int, int], max_new_tokens: int) -> int:
+        """Returns how many tokens an image may generate: ``max_new_tokens``,
+        or with ``adaptive_budget`` what its LaTeX is likely to need.
+
+        The vision-token count tracks how much the image holds, and wide or
+        tall images hold long lines or many rows for their area. Small
+        images get less than ``max_new_tokens``, large ones up to
+        ``budget_max``. Callers turn it off for requests that set their own
+        limit.
+        """
+        if not self.adaptive_budget:
+            return max_new_tokens
+        width, height = size
+        cells = math.ceil(width / TOKEN_CELL) * math.ceil(height / TOKEN_CELL)
+        aspect = max(width / max(height, 1), height / max(width, 1))
+        budget = self.budget_base + self.budget_per_vision_token * cells + self.budget_per_aspect * aspect
+        return max(1, min(self.budget_max, math.ceil(budget)))
+
+
+def find_repetition(ids: List[int], max_ngram: int, min_tokens: int) -> Optional[int]:
+    """Returns how many tokens to keep if ``ids`` ends in a repeated n-gram.
+
+    The repeated tail must span ``min_tokens`` and at least three copies;
+    everything up to the end of its first copy is kept.
+    """
+    for n in range(1, max_ngram + 1):
+        span = max(min_tokens, 3 * n)
+        if len(ids) < span:
+            break
+        if ids[-span:-n] == ids[-span + n:]:
+            start = len(ids) - span
+            while start > 0 and ids[start - 1] == ids[start - 1 + n]:
+                start -= 1
+            return start + n
+    return None
+
+
+def latex_end(text: str) -> Optional[int]:
+    """Returns where the display expression at the start of ``text`` ends, if it is complete.
+
+    Only output that starts with ``$$``, ``\\[`` or a display environment
+    such as ``align`` can be complete, once that wrapper closes with every
+    brace and environment in between balanced. Inline math and unwrapped
+    text may be followed by more segments, so they never are.
+    """
+    start = len(text) - len(text.lstrip())
+    closer = None
+    for opening, closing in DISPLAY_DELIMITERS:
+        if text.startswith(opening, start):
+            closer = closing
+            start += len(opening)
+            break
+    if closer is None:
+        outer = ENVIRONMENT.match(text, start)
+        if outer is None or outer.group(1) != "begin" or outer.group(2) not in DISPLAY_ENVIRONMENTS:
+            return None
+
+    depth, environments = 0, []
+    i = start
+    while i < len(text):
+        char = text[i]
+        balanced = depth == 0 and not environments
+        if char == "\\":
+            match = ENVIRONMENT.match(text, i)
+            if match is not None:
+                if match.group(1) == "begin":
+                    environments.append(match.group(2))
+                elif not environments or environments.pop() != match.group(2):
+                    return None
+                elif closer is None and depth == 0 and not environments:
+                    return match.end()
+                i = match.end()
+                continue
+            if closer == "\\]" and balanced and text.startswith(closer, i):
+                return i + len(closer)
+            # Escaped characters such as \{ do not count
+            i += 2
+            continue
+        if char == "{":
+            depth += 1
+        elif char == "}":
+            depth -= 1
+            if depth < 0:
+                return None
+        elif char == "$" and closer == "$$" and balanced and text.startswith(closer, i):
+            return i + len(closer)
+        i += 1
+    return None
+
+
+class RowStopper:
+    """Stops the rows of a batch one at a time and records why.
+
+    Passed to ``generate`` as a stopping criterion, which only has to be
+    callable; it does not subclass StoppingCriteria so that this module
+    imports without transformers.
+
+    Each check is called with a row and its generated token ids after every
+    step and returns None, or the stop reason and how many tokens to keep.
+    Stopped rows are padded until the whole batch is done, so ``trim``
+    drops what came after their stop.
+    """
+
+    def __init__(self, rows: int, eos_token_id, checks: List[Callable[[int, List[int]], Optional[Tuple[str, int]]]]):
+        eos = eos_token_id if isinstance(eos_token_id, (list, tuple)) else [eos_token_id]
+        self.eos_ids = {token for token in eos if token is not None}
+        self.checks = checks
+        self.ids: List[List[int]] = [[] for _ in range(rows)]
+        self.reasons: List[Optional[str]] = [None] * rows
+        self.kept: List[Optional[int]] = [None] * rows
+
+    def __call__(self, input_ids, scores, **kwargs):
+        for row, token in enumerate(input_ids[:, -1].tolist()):
+            if self.reasons[row] is not None:
+                continue
+            ids = self.ids[row]
+            ids.append(token)
+            if token in self.eos_ids:
+                self.reasons[row] = "eos"
+                continue
+            for check in self.checks:
+                stop = check(row, ids)
+                if stop is not None:
+                    self.reasons[row], self.kept[row] = stop
+                    break
+        return input_ids.new_tensor([reason is not None for reason in self.reasons]).bool()
+
+    def reason(self, row: int) -> str:
+        return self.reasons[row] or "length"
+
+    def tokens(self, row: int) -> int:
+        """Tokens generated for ``row``, including any that ``trim`` drops."""
+        return len(self.ids[row])
+
+    def trim(self, row: int, generated):
+        kept = self.kept[row]
+        return generated if kept is None else generated[:kept]
+
+
+class LatexCompletion:
+    """Check that stops a row once its LaTeX expression is complete."""
+
+    def __init__(self, rows: int, decode_token: Callable[[int], str]):
+        self.decode_token = decode_token
+        self.texts = [""] * rows
+
+    def __call__(self, row: int, ids: List[int]) -> Optional[Tuple[str, int]]:
+        piece = self.decode_token(ids[-1])
+        self.texts[row] += piece
+        if CLOSING_CHARS.isdisjoint(piece) or latex_end(self.texts[row]) is None:
+            return None
+        return "complete", len(ids)
+
+
+def build_row_stopper(
+    config: Optional[StoppingConfig],
+    images: List[Any],
+    max_new_tokens: Union[int, List[int]],
+    eos_token_id,
+    decode_token: Callable[[int], str],
+    cancel_tokens: Optional[List[Optional[CancelToken]]] = None,
+) -> Tuple[RowStopper, int]:
+    """Returns the stopper for a batch and the ``max_new_tokens`` to generate with.
+
+    ``max_new_tokens`` is one limit for the batch or one per image; rows
+    with a lower limit than others stop at their own, with reason ``length``.
+    """
+    limits = max_new_tokens if isinstance(max_new_tokens, list) else [max_new_tokens] * len(images)
+    checks = []
+    if cancel_tokens:
+        checks.append(lambda row, ids: ("cancelled", len(ids)) if cancel_tokens[row] is not None and cancel_tokens[row].cancelled else None)
+    budgets = list(limits)
+    if config is not None:
+        if config.repetition:
+            def repetition(row, ids):
+                kept = find_repetition(ids, config.max_ngram, config.min_repeated_tokens)
+                return None if kept is None else ("repetition", kept)
+            checks.append(repetition)
+        if config.latex_complete:
+            checks.append(LatexCompletion(len(images), decode_token))
+        budgets = [config.token_budget(image.size, limit) for image, limit in zip(images, limits)]
+    longest = max(budgets)
+    if any(budget != limit or budget < longest for budget, limit in zip(budgets, limits)):
+        def budget(row, ids):
+            if len(ids) < budgets[row]:
+                return None
+            return ("budget" if budgets[row] != limits[row] else "length"), len(ids)
+        checks.append(budget)
+    return RowStopper(len(images), eos_token_id, checks), longest
+
+
+def finish_text(text: str, reason: str) -> str:
+    """Drops anything generated after a complete expression in the same token."""
+    if reason == "complete":
+        end = latex_end(text)
+        if end is not None:
+            text = text[:end]
+    return text.strip()
@@ -1,9 +1,8 @@
 import os
 import time
-import hashlib
 import tempfile
+import threading
 from typing import Optional, Tuple
-from PIL import Image
 import torch
 
 try:
@@ -14,57 +13,82 @@ except (ImportError, NotImplementedError):
     from transformers import Qwen2VLForConditionalGeneration, AutoProcessor
     FastVisionModel = None
 
+from .cpu_profile import CPUProfile
+from .preprocess import PreprocessConfig, load_image
+from .prompt_cache import prompt_text
+from .result_cache import build_result_cache, hash_file, make_cache_key
+
 # Global model and tokenizer instances
 _model = None
 _tokenizer = None
+_load_lock = threading.Lock()
+# The profile the global model is loaded with; the API's manager has its own
+_cpu_profile = CPUProfile()
+_result_caches = {}
 
 
-def get_model_and_tokenizer():
-    global _model, _tokenizer
+def get_base_model_name() -> str:
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    if UNSLOTH_AVAILABLE:
+        return "unsloth/Qwen2-VL-7B-Instruct"
+    if device == "cuda":
+        return "Qwen/Qwen2-VL-7B-Instruct"
+    return "Qwen/Qwen2-VL-2B-Instruct"
+
+
+def load_model_and_tokenizer(cpu_profile: Optional[CPUProfile] = None):
+    """``cpu_profile`` selects the dtype, quantization and threads without a GPU."""
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    if device == "cpu":
+        cpu_profile = cpu_profile or CPUProfile()
+        cpu_profile.apply_threads()
     
-    if _model is None or _tokenizer is None:
-        
-        device = "cuda" if torch.cuda.is_available() else "cpu"
-        
-        if UNSLOTH_AVAILABLE:
-            if device == "cuda":
-                _model, _tokenizer = FastVisionModel.from_pretrained(
-                    "unsloth/Qwen2-VL-7B-Instruct",
-                    load_in_4bit=True,
-                    use_gradient_checkpointing="unsloth"
-                )
-            else:
-                _model, _tokenizer = FastVisionModel.from_pretrained(
-                    "unsloth/Qwen2-VL-7B-Instruct",
-                    load_in_4bit=False,
-                    use_gradient_checkpointing="unsloth",
-                    torch_dtype=torch.float32
-                )
-            FastVisionModel.for_inference(_model)
+    if UNSLOTH_AVAILABLE:
+        if device == "cuda":
+            model, tokenizer = FastVisionModel.from_pretrained(
+                "unsloth/Qwen2-VL-7B-Instruct",
+                load_in_4bit=True,
+                use_gradient_checkpointing="unsloth"
+            )
         else:
-            if device == "cuda":
-                model_name = "Qwen/Qwen2-VL-7B-Instruct"
-            else:
-                model_name = "Qwen/Qwen2-VL-2B-Instruct"
-            
-            _processor = AutoProcessor.from_pretrained(model_name)
-            _model = Qwen2VLForConditionalGeneration.from_pretrained(
-                model_name,
-                torch_dtype=torch.float16 if device == "cuda" else torch.float32,
-                device_map="auto" if device == "cuda" else None,
-                low_cpu_mem_usage=True
+            model, tokenizer = FastVisionModel.from_pretrained(
+                "unsloth/Qwen2-VL-7B-Instruct",
+                load_in_4bit=False,
+                use_gradient_checkpointing="unsloth",
+                torch_dtype=cpu_profile.dtype
             )
-            _tokenizer = _processor
+        FastVisionModel.for_inference(model)
+    else:
+        model_name = get_base_model_name()
+        
+        processor = AutoProcessor.from_pretrained(model_name)
+        model = Qwen2VLForConditionalGeneration.from_pretrained(
+            model_name,
+            torch_dtype=torch.float16 if device == "cuda" else cpu_profile.dtype,
+            device_map="auto" if device == "cuda" else None,
+            low_cpu_mem_usage=True
+        )
+        tokenizer = processor
+
+    if device == "cpu":
+        model = cpu_profile.prepare(model)
     
-    return _model, _tokenizer
+    return model, tokenizer
 
 
-def get_image_hash(image_path: str) -> str:
-    with open(image_path, 'rb') as f:
-        return hashlib.md5(f.read()).hexdigest()
+def get_model_and_tokenizer():
+    global _model, _tokenizer
+    
+    # Concurrent first calls must not load the model twice
+    with _load_lock:
+        if _model is None or _tokenizer is None:
+            _model, _tokenizer = load_model_and_tokenizer(_cpu_profile)
+    
+    return _model, _tokenizer
 
 
-def run_inference(image_path: str, max_new_tokens: int = 256, temperature: float = 0.7, min_p: float = 0.1) -> Tuple[str, int, int]:
+def run_inference(image_path: str, max_new_tokens: int = 256, temperature: float = 0.0, min_p: float = 0.1, preprocess: bool = True) -> Tuple[str, int, int]:
+    """A temperature of 0 decodes greedily."""
     start_time = time.time()
     
     try:
@@ -75,22 +99,10 @@ def run_inference(image_path: str, max_new_tokens: int = 256, temperature: float
         model, tokenizer = get_model_and_tokenizer()
         
         # Load and preprocess image
-        image = Image.open(image_path).convert('RGB')
-        
-        # Prepare chat template
-        instruction = "Write the LaTeX representation for this image."
-        messages = [
-            {
-                "role": "user",
-                "content": [
-                    {"type": "text", "text": instruction},
-                    {"type": "image", "image": image}
-                ]
-            }
-        ]
+        image, _ = load_image(image_path, PreprocessConfig() if preprocess else None)
         
-        # Apply chat template
-        input_text = tokenizer.apply_chat_template(messages, add_generation_prompt=True)
+        # Chat template, applied once per tokenizer
+        input_text = prompt_text(tokenizer, processor=False)
         
         # Tokenize inputs
         inputs = tokenizer(
@@ -100,15 +112,14 @@ def run_inference(image_path: str, max_new_tokens: int = 256, temperature: float
         ).to(device)
         
         # Generate
+        sampling = {"do_sample": True, "temperature": temperature, "min_p": min_p} if temperature > 0 else {"do_sample": False}
         with torch.no_grad():
             outputs = model.generate(
                 **inputs,
                 max_new_tokens=max_new_tokens,
                 use_cache=True,
-                temperature=temperature,
-                min_p=min_p,
-                do_sample=True,
-                pad_token_id=tokenizer.eos_token_id
+                pad_token_id=tokenizer.eos_token_id,
+                **sampling
             )
         
         # Decode output
@@ -127,32 +138,38 @@ def run_inference(image_path: str, max_new_tokens: int = 256, temperature: float
 
 
 def run_inference_with_cache(image_path: str, cache_dir: Optional[str] = None, **kwargs) -> Tuple[str, int, int]:
+    """``run_inference`` through the result cache; sampled outputs are never cached."""
+    if kwargs.get("temperature", 0.0) > 0:
+        return run_inference(image_path, **kwargs)
+
     if cache_dir is None:
-        cache_dir = tempfile.gettempdir()
+        cache_dir = os.path.join(tempfile.gettempdir(), "img2latex_cache")
+    
+    cache = _result_caches.get(cache_dir)
+    if cache is None:
+        cache = _result_caches[cache_dir] = build_result_cache("sqlite", cache_dir)
     
     # Generate cache key
-    image_hash = get_image_hash(image_path)
-    cache_file = os.path.join(cache_dir, f"latex_cache_{image_hash}.txt")
+    generation = {
+        "max_new_tokens": kwargs.get("max_new_tokens", 256),
+        "temperature": 0.0,
+        "preprocess": PreprocessConfig().to_dict() if kwargs.get("preprocess", True) else None,
+    }
+    # Named like the API's base weights, with the profile this module loads them with
+    identity = get_base_model_name()
+    if not torch.cuda.is_available():
+        identity += _cpu_profile.identity
+    key = make_cache_key(hash_file(image_path), identity, generation)
     
     # Check cache
-    if os.path.exists(cache_file):
-        try:
-            with open(cache_file, 'r') as f:
-                cached_data = f.read().strip().split('|')
-                if len(cached_data) == 3:
-                    latex, tokens, time_ms = cached_data
-                    return latex, int(tokens), int(time_ms)
-        except:
-            pass
+    cached = cache.get(key)
+    if cached is not None:
+        return cached["latex"], cached["tokens"], cached["time_ms"]
     
     # Run inference
     latex, tokens, time_ms = run_inference(image_path, **kwargs)
     
     # Cache result
-    try:
-        with open(cache_file, 'w') as f:
-            f.write(f"{latex}|{tokens}|{time_ms}")
-    except:
-        pass
+    cache.set(key, {"latex": latex, "tokens": tokens, "time_ms": time_ms})
     
     return latex, tokens, time_ms
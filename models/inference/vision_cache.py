@@ -0,0 +1,226 @@
+import io
+import os
+import time
+import inspect
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
+
+if TYPE_CHECKING:
+    import torch
+
+
+def tensor_bytes(tensor: "torch.Tensor") -> int:
+    return tensor.element_size() * tensor.numel()
+
+
+class _DiskTier:
+    """Embeddings evicted from memory, in SQLite, least recently used out first."""
+
+    def __init__(self, path: str, max_bytes: int):
+        self.max_bytes = max_bytes
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        # Inference workers share the file
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS ix_embeddings_accessed_at ON embeddings (accessed_at)")
+
+    def get(self, key: str) -> Optional[Tuple["torch.Tensor", "torch.Tensor"]]:
+        import torch
+
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM embeddings WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            self._conn.execute("UPDATE embeddings SET accessed_at = ? WHERE key = ?", (time.time(), key))
+        try:
+            value = torch.load(io.BytesIO(row[0]), weights_only=True)
+            return value["embeds"], value["grid"]
+        except Exception:
+            return None
+
+    def set(self, key: str, embeds: "torch.Tensor", grid: "torch.Tensor") -> None:
+        import torch
+
+        buffer = io.BytesIO()
+        torch.save({"embeds": embeds.cpu(), "grid": grid.cpu()}, buffer)
+        data = buffer.getvalue()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO embeddings (key, value, size, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, data, len(data), time.time()),
+            )
+            total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM embeddings").fetchone()[0]
+            if total <= self.max_bytes:
+                return
+            evict = []
+            for old, size in self._conn.execute("SELECT key, size FROM embeddings ORDER BY accessed_at"):
+                if total <= self.max_bytes:
+                    break
+                evict.append((old,))
+                total -= size
+            self._conn.executemany("DELETE FROM embeddings WHERE key = ?", evict)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM embeddings")
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+
+class VisionCache:
+    """Vision-encoder outputs by image pixels and model weights.
+
+    Entries are the encoder's embeddings of one image with its patch grid,
+    kept in memory up to ``max_bytes``, least recently used out first. With
+    ``disk_dir`` evicted entries spill to disk (up to ``disk_max_bytes``)
+    and are promoted back on a hit. Generations of a cached image skip the
+    vision encoder, so resampling it with other settings only decodes.
+    """
+
+    def __init__(self, max_bytes: int = 256 * 1024 * 1024, disk_dir: Optional[str] = None, disk_max_bytes: int = 1024 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.disk = _DiskTier(os.path.join(disk_dir, "vision.sqlite3"), disk_max_bytes) if disk_dir else None
+        self._entries: "OrderedDict[str, Tuple[torch.Tensor, torch.Tensor]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = {"memory": 0, "disk": 0}
+        self.misses = 0
+
+    @staticmethod
+    def make_key(identity: str, pixel_values: "torch.Tensor", grid: "torch.Tensor") -> str:
+        digest = hashlib.sha256(identity.encode("utf-8"))
+        digest.update(str(grid.tolist()).encode("utf-8"))
+        digest.update(str(pixel_values.dtype).encode("utf-8"))
+        digest.update(pixel_values.detach().cpu().contiguous().numpy().tobytes())
+        return digest.hexdigest()
+
+    def get(self, key: str) -> Optional[Tuple["torch.Tensor", "torch.Tensor"]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits["memory"] += 1
+                return entry
+        entry = self.disk.get(key) if self.disk is not None else None
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits["disk"] += 1
+        if entry is not None:
+            self._store(key, *entry)
+        return entry
+
+    def set(self, key: str, embeds: "torch.Tensor", grid: "torch.Tensor") -> None:
+        self._store(key, embeds.detach(), grid)
+
+    def _store(self, key: str, embeds: "torch.Tensor", grid: "torch.Tensor") -> None:
+        size = tensor_bytes(embeds)
+        if size > self.max_bytes:
+            return
+        evicted = []
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return
+            self._entries[key] = (embeds, grid)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                old, (old_embeds, old_grid) = self._entries.popitem(last=False)
+                self._bytes -= tensor_bytes(old_embeds)
+                evicted.append((old, old_embeds, old_grid))
+        if self.disk is not None:
+            for old, old_embeds, old_grid in evicted:
+                self.disk.set(old, old_embeds, old_grid)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+        if self.disk is not None:
+            self.disk.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = sum(self.hits.values()) + self.misses
+            return {
+                "hits": dict(self.hits),
+                "misses": self.misses,
+                "hit_rate": sum(self.hits.values()) / lookups if lookups else 0.0,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "disk_entries": len(self.disk) if self.disk is not None else None,
+            }
+
+    def for_model(self, identity: str) -> "ModelVisionCache":
+        return ModelVisionCache(self, identity)
+
+    def encoder_inputs(self, model, identity: str, inputs) -> Dict[str, Any]:
+        """Replaces the images' ``pixel_values`` with their encoder outputs.
+
+        Only images missing from the cache go through the vision encoder.
+        Returns ``inputs`` unchanged if the model cannot take precomputed
+        encoder outputs.
+        """
+        import torch
+        from transformers.modeling_outputs import BaseModelOutputWithPooling
+
+        base = model.get_base_model() if hasattr(model, "get_base_model") else model
+        get_image_features = getattr(base, "get_image_features", None)
+        if (
+            get_image_features is None
+            or "mm_encoder_outputs" not in inspect.signature(base.forward).parameters
+            or "pixel_values" not in inputs
+            or "image_grid_thw" not in inputs
+        ):
+            return inputs
+
+        grids = inputs["image_grid_thw"]
+        pixel_values = torch.split(inputs["pixel_values"], grids.prod(dim=-1).tolist())
+        keys = [self.make_key(identity, pixels, grid) for pixels, grid in zip(pixel_values, grids)]
+        embeds: List[Optional["torch.Tensor"]] = []
+        for key, grid in zip(keys, grids):
+            entry = self.get(key)
+            embeds.append(entry[0] if entry is not None and torch.equal(entry[1].cpu(), grid.cpu()) else None)
+
+        missing = [i for i, e in enumerate(embeds) if e is None]
+        if missing:
+            with torch.no_grad():
+                outputs = get_image_features(
+                    torch.cat([pixel_values[i] for i in missing]), grids[missing], return_dict=True
+                )
+            for i, image_embeds in zip(missing, outputs.pooler_output):
+                embeds[i] = image_embeds
+                self.set(keys[i], image_embeds, grids[i])
+
+        device = inputs["input_ids"].device
+        encoded = {name: value for name, value in inputs.items() if name != "pixel_values"}
+        encoded["mm_encoder_outputs"] = {"image": BaseModelOutputWithPooling(pooler_output=[e.to(device) for e in embeds])}
+        return encoded
+
+
+class ModelVisionCache:
+    """A VisionCache for one model's weights, as passed to the generation functions."""
+
+    def __init__(self, cache: VisionCache, identity: str):
+        self.cache = cache
+        self.identity = identity
+
+    def encoder_inputs(self, model, inputs) -> Dict[str, Any]:
+        return self.cache.encoder_inputs(model, self.identity, inputs)
+
+
+def build_vision_cache(max_bytes: int, disk_dir: Optional[str] = None, disk_max_bytes: int = 1024 * 1024 * 1024) -> Optional[VisionCache]:
+    if max_bytes <= 0:
+        return None
+    return VisionCache(max_bytes, disk_dir or None, disk_max_bytes)
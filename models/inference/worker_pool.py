@@ -0,0 +1,538 @@
+import os
+import time
+import itertools
+import threading
+import multiprocessing
+from multiprocessing.connection import wait
+from collections import deque
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from .cancellation import CancelToken
+from .runners import RUNNERS, RunnerStream, build_runner
+
+
+def partition_cpus(num_workers: int, cpus: Optional[List[int]] = None) -> List[List[int]]:
+    """Splits the usable CPUs into one contiguous block per worker.
+
+    CPUs on the same socket or NUMA node are numbered contiguously on most
+    machines, so contiguous blocks keep each worker on one node where the
+    counts allow it.
+    """
+    if cpus is None:
+        cpus = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else list(range(os.cpu_count() or 1))
+    num_workers = max(1, num_workers)
+    if len(cpus) < num_workers:
+        return [list(cpus) for _ in range(num_workers)]
+    size, extra = divmod(len(cpus), num_workers)
+    blocks, start = [], 0
+    for index in range(num_workers):
+        end = start + size + (1 if index < extra else 0)
+        blocks.append(list(cpus[start:end]))
+        start = end
+    return blocks
+
+
+def _worker_main(index: int, runner: str, runner_options: Dict[str, Any], num_threads: int, cpus: Optional[List[int]], tasks, control, conn, heartbeat_interval: float):
+    # Thread counts must be fixed before torch is imported
+    if num_threads:
+        for name in ("OMP_NUM_THREADS", "MKL_NUM_THREADS"):
+            os.environ[name] = str(num_threads)
+    if cpus and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cpus)
+
+    # Each worker reports on its own pipe, so a worker killed mid-write
+    # cannot leave a lock held that the other workers need
+    send_lock = threading.Lock()
+
+    def send(message):
+        with send_lock:
+            conn.send(message)
+
+    stopped = threading.Event()
+
+    def heartbeat():
+        while not stopped.wait(heartbeat_interval):
+            send(("heartbeat", index, None))
+
+    threading.Thread(target=heartbeat, daemon=True).start()
+
+    # Cancellations arrive on their own queue while a task runs. A row can
+    # be cancelled before its task has been picked up, so those are kept
+    # until the task starts.
+    cancel_lock = threading.Lock()
+    active: Dict[int, List[CancelToken]] = {}
+    early: Dict[int, set] = {}
+
+    def receive_cancellations():
+        while True:
+            message = control.get()
+            if message is None:
+                return
+            if message == "clear_prompt_caches":
+                if runner == "model":
+                    from .model_manager import model_manager
+
+                    model_manager.clear_prompt_caches()
+                continue
+            task_id, row = message
+            with cancel_lock:
+                tokens = active.get(task_id)
+                if tokens is None:
+                    early.setdefault(task_id, set()).add(row)
+            if tokens is not None:
+                tokens[row].cancel()
+
+    threading.Thread(target=receive_cancellations, daemon=True).start()
+
+    try:
+        if num_threads and runner == "model":
+            import torch
+
+            torch.set_num_threads(num_threads)
+        if runner == "model":
+            from .model_manager import model_manager
+
+            # Load and switch times are reported to the API process
+            model_manager.listeners.append(lambda event, seconds: send(("event", index, (event, seconds))))
+        instance = build_runner(runner, **runner_options)
+        instance.load()
+    except Exception as e:
+        send(("failed", index, f"{type(e).__name__}: {str(e)}"))
+        stopped.set()
+        return
+
+    send(("ready", index, os.getpid()))
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        task_id, kind, payload, cancelled = task
+        tokens = [CancelToken() for _ in range(len(payload[0]) if kind == "batch" else 1)]
+        with cancel_lock:
+            # Task ids only grow, so older entries belong to finished tasks
+            for stale in [i for i in early if i < task_id]:
+                del early[stale]
+            cancelled = set(cancelled) | early.pop(task_id, set())
+            active[task_id] = tokens
+        for row in cancelled:
+            tokens[row].cancel()
+        try:
+            if kind == "stream":
+                image, generation, adapter_path = payload
+                value = instance.stream(
+                    image, generation, adapter_path,
+                    lambda text: send(("token", task_id, text)),
+                    tokens[0],
+                )
+            else:
+                value = instance.run_batch(*payload, tokens)
+            send(("result", task_id, value))
+        except Exception as e:
+            send(("error", task_id, f"{type(e).__name__}: {str(e)}"))
+        finally:
+            with cancel_lock:
+                del active[task_id]
+    stopped.set()
+
+
+class _Task:
+    __slots__ = ("id", "kind", "payload", "future", "stream", "worker", "rows", "cancelled")
+
+    def __init__(self, task_id: int, kind: str, payload: Any, stream: Optional[RunnerStream] = None):
+        self.id = task_id
+        self.kind = kind
+        self.payload = payload
+        self.future = stream.future if stream is not None else Future()
+        self.stream = stream
+        self.worker: Optional[int] = None
+        self.rows = len(payload[0]) if kind == "batch" else 1
+        self.cancelled: set = set()
+
+    def finish(self, value: Any = None, error: Optional[Exception] = None):
+        if self.stream is not None:
+            self.stream.fragments.put(None)
+        if self.future.done():
+            return
+        if error is not None:
+            self.future.set_exception(error)
+        else:
+            self.future.set_result(value)
+
+
+class _Worker:
+    def __init__(self, index: int, cpus: Optional[List[int]], num_threads: int):
+        self.index = index
+        self.cpus = cpus
+        self.num_threads = num_threads
+        self.process = None
+        self.tasks = None
+        self.control = None
+        self.conn = None
+        self.pid: Optional[int] = None
+        self.state = "stopped"
+        self.task: Optional[_Task] = None
+        self.last_seen = 0.0
+        self.started_at = 0.0
+        self.restart_at = 0.0
+        self.restarts = 0
+        self.failures = 0
+        self.completed = 0
+        self.retiring = False
+        self.error: Optional[str] = None
+
+
+class WorkerPool:
+    """Runs generations in separate worker processes, one task per worker at a time.
+
+    Each worker loads its own model and is pinned to a block of CPUs. Tasks
+    wait in a local queue until a worker is idle and results come back as
+    futures. A monitor thread restarts workers that exit or stop sending
+    heartbeats and fails the task they were running. Cancelled tasks are
+    dropped while they wait and stopped at the next decode step once running.
+    """
+
+    def __init__(
+        self,
+        num_workers: int,
+        runner: str = "model",
+        runner_options: Optional[Dict[str, Any]] = None,
+        threads_per_worker: int = 0,
+        pin_cpus: bool = True,
+        heartbeat_interval: float = 1.0,
+        health_timeout: float = 30.0,
+    ):
+        if runner not in RUNNERS:
+            raise ValueError(f"Unknown worker runner: {runner}")
+        self.runner = runner
+        self.runner_options = runner_options or {}
+        self.heartbeat_interval = heartbeat_interval
+        self.health_timeout = health_timeout
+        blocks = partition_cpus(num_workers)
+        self.workers = [
+            _Worker(
+                index,
+                blocks[index] if pin_cpus else None,
+                threads_per_worker or len(blocks[index]),
+            )
+            for index in range(max(1, num_workers))
+        ]
+        self._context = multiprocessing.get_context("spawn")
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._pending: deque = deque()
+        self._tasks: Dict[int, _Task] = {}
+        self._ids = itertools.count()
+        self._monitor: Optional[threading.Thread] = None
+        self._running = False
+        # Receive the workers' model manager events, see ModelManager.listeners
+        self.listeners: List[Callable[[str, float], None]] = []
+
+    @property
+    def num_workers(self) -> int:
+        return len(self.workers)
+
+    def start(self):
+        with self._lock:
+            if self._running:
+                return
+            self._running = True
+            for worker in self.workers:
+                self._spawn(worker)
+        self._monitor = threading.Thread(target=self._monitor_loop, name="worker-pool-monitor", daemon=True)
+        self._monitor.start()
+
+    def _spawn(self, worker: _Worker):
+        worker.tasks = self._context.Queue()
+        worker.control = self._context.Queue()
+        worker.conn, child_conn = self._context.Pipe(duplex=False)
+        worker.process = self._context.Process(
+            target=_worker_main,
+            args=(
+                worker.index, self.runner, self.runner_options, worker.num_threads, worker.cpus,
+                worker.tasks, worker.control, child_conn, self.heartbeat_interval,
+            ),
+            name=f"inference-worker-{worker.index}",
+            daemon=True,
+        )
+        worker.process.start()
+        child_conn.close()
+        worker.pid = worker.process.pid
+        worker.state = "starting"
+        worker.retiring = False
+        worker.started_at = worker.last_seen = time.monotonic()
+
+    def stop(self, timeout: float = 10.0):
+        with self._lock:
+            if not self._running:
+                return
+            self._running = False
+            workers = list(self.workers)
+            for worker in workers:
+                if worker.process is not None and worker.process.is_alive():
+                    worker.tasks.put(None)
+            self._changed.notify_all()
+        for worker in workers:
+            if worker.process is None:
+                continue
+            worker.process.join(timeout)
+            if worker.process.is_alive():
+                worker.process.kill()
+                worker.process.join()
+            worker.state = "stopped"
+        if self._monitor is not None:
+            self._monitor.join(timeout)
+        with self._lock:
+            error = RuntimeError("Worker pool stopped")
+            for task in list(self._tasks.values()):
+                task.finish(error=error)
+            self._tasks.clear()
+            self._pending.clear()
+
+    def restart(self):
+        """Restarts every worker once its current task has finished."""
+        with self._lock:
+            for worker in self.workers:
+                if worker.state in ("starting", "idle", "busy"):
+                    worker.tasks.put(None)
+                    worker.retiring = True
+                    if worker.state == "idle":
+                        worker.state = "stopping"
+
+    def clear_prompt_caches(self):
+        """Makes every worker drop its cached prompts and prompt prefixes."""
+        with self._lock:
+            for worker in self.workers:
+                if worker.state in ("starting", "idle", "busy"):
+                    worker.control.put("clear_prompt_caches")
+
+    def wait_ready(self, timeout: Optional[float] = None, all_workers: bool = False) -> bool:
+        """Waits for one (or every) worker to load its model.
+
+        Raises RuntimeError once every worker has failed to start.
+        """
+        self.start()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._changed:
+            while True:
+                ready = [w for w in self.workers if w.state in ("idle", "busy")]
+                if ready and (not all_workers or len(ready) == len(self.workers)):
+                    return True
+                if all(w.failures for w in self.workers):
+                    raise RuntimeError(f"Inference workers failed to start: {self.workers[0].error}")
+                if not self._running:
+                    return False
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._changed.wait(remaining)
+
+    def _submit(self, kind: str, payload: Any, stream: Optional[RunnerStream] = None) -> _Task:
+        self.start()
+        task = _Task(next(self._ids), kind, payload, stream)
+        with self._lock:
+            self._tasks[task.id] = task
+            self._pending.append(task)
+            self._dispatch()
+        return task
+
+    def submit_batch(
+        self,
+        images: List[Any],
+        generation: Dict[str, Any],
+        adapter_path: Optional[str] = None,
+        cancel_tokens: Optional[List[Optional[CancelToken]]] = None,
+    ) -> Future:
+        task = self._submit("batch", (images, generation, adapter_path))
+        for row, token in enumerate(cancel_tokens or []):
+            if token is not None:
+                token.add_callback(lambda row=row: self._cancel(task, row))
+        return task.future
+
+    def run_batch(
+        self,
+        images: List[Any],
+        generation: Dict[str, Any],
+        adapter_path: Optional[str] = None,
+        cancel_tokens: Optional[List[Optional[CancelToken]]] = None,
+    ) -> List[Tuple[str, int, Dict[str, float], str]]:
+        return self.submit_batch(images, generation, adapter_path, cancel_tokens).result()
+
+    def stream(
+        self,
+        image: Any,
+        generation: Dict[str, Any],
+        adapter_path: Optional[str] = None,
+        timeout: Optional[float] = None,
+        cancel_token: Optional[CancelToken] = None,
+    ) -> RunnerStream:
+        stream = RunnerStream(timeout)
+        task = self._submit("stream", (image, generation, adapter_path), stream)
+        if cancel_token is not None:
+            cancel_token.add_callback(lambda: self._cancel(task, 0))
+        return stream
+
+    def _cancel(self, task: _Task, row: int):
+        with self._lock:
+            if self._tasks.get(task.id) is not task:
+                return
+            task.cancelled.add(row)
+            if task.worker is None:
+                # Still waiting: drop it once no row is wanted
+                if len(task.cancelled) == task.rows:
+                    self._pending.remove(task)
+                    del self._tasks[task.id]
+                    task.finish(error=RuntimeError("Cancelled"))
+                return
+            worker = self.workers[task.worker]
+            if worker.task is task:
+                worker.control.put((task.id, row))
+
+    def _dispatch(self):
+        # Called with the lock held
+        for worker in self.workers:
+            if not self._pending:
+                return
+            if worker.state != "idle":
+                continue
+            task = self._pending.popleft()
+            if task.future.done():
+                self._tasks.pop(task.id, None)
+                continue
+            task.worker = worker.index
+            worker.task = task
+            worker.state = "busy"
+            worker.tasks.put((task.id, task.kind, task.payload, sorted(task.cancelled)))
+
+    def _monitor_loop(self):
+        while self._running:
+            with self._lock:
+                conns = [w.conn for w in self.workers if w.conn is not None]
+            if conns:
+                readable = wait(conns, timeout=self.heartbeat_interval)
+            else:
+                readable = []
+                time.sleep(self.heartbeat_interval)
+            with self._lock:
+                for worker in self.workers:
+                    if worker.conn is not None and worker.conn in readable:
+                        self._receive(worker)
+                self._check_health()
+                self._dispatch()
+                self._changed.notify_all()
+
+    def _receive(self, worker: _Worker):
+        try:
+            while worker.conn.poll():
+                self._handle(*worker.conn.recv())
+        except (EOFError, OSError):
+            # The worker has exited; the health check restarts it
+            worker.conn.close()
+            worker.conn = None
+
+    def _handle(self, kind: str, key: int, value: Any):
+        if kind in ("heartbeat", "ready", "failed"):
+            worker = self.workers[key]
+            worker.last_seen = time.monotonic()
+            if kind == "ready" and worker.state == "starting":
+                worker.state = "stopping" if worker.retiring else "idle"
+                worker.failures = 0
+                worker.error = None
+            elif kind == "failed":
+                worker.error = value
+            return
+        if kind == "event":
+            self.workers[key].last_seen = time.monotonic()
+            for listener in self.listeners:
+                try:
+                    listener(*value)
+                except Exception:
+                    pass
+            return
+
+        task = self._tasks.get(key)
+        if task is None:
+            return
+        if kind == "token":
+            if task.stream is not None:
+                task.stream.fragments.put(value)
+            return
+
+        del self._tasks[key]
+        worker = self.workers[task.worker]
+        worker.last_seen = time.monotonic()
+        if worker.task is task:
+            worker.task = None
+            worker.state = "stopping" if worker.retiring else "idle"
+            worker.completed += 1
+        if kind == "result":
+            task.finish(value)
+        else:
+            task.finish(error=RuntimeError(value))
+
+    def _check_health(self):
+        # Called with the lock held
+        now = time.monotonic()
+        for worker in self.workers:
+            if worker.state in ("starting", "idle", "busy", "stopping"):
+                alive = worker.process.is_alive()
+                if not alive and worker.conn is not None:
+                    # Pick up anything it sent before exiting
+                    self._receive(worker)
+                if alive and now - worker.last_seen <= self.health_timeout:
+                    continue
+                if alive:
+                    worker.error = f"No heartbeat for {now - worker.last_seen:.0f}s"
+                    worker.process.kill()
+                    worker.process.join()
+                elif worker.process.exitcode != 0:
+                    worker.error = worker.error or f"Exited with code {worker.process.exitcode}"
+                if worker.state == "starting":
+                    worker.failures += 1
+                self._retire(worker, now)
+            elif worker.state == "dead" and self._running and now >= worker.restart_at:
+                worker.restarts += 1
+                self._spawn(worker)
+
+        if self._pending and all(w.failures for w in self.workers):
+            error = RuntimeError(f"Inference workers failed to start: {self.workers[0].error}")
+            while self._pending:
+                task = self._pending.popleft()
+                self._tasks.pop(task.id, None)
+                task.finish(error=error)
+
+    def _retire(self, worker: _Worker, now: float):
+        task, worker.task = worker.task, None
+        if task is not None:
+            self._tasks.pop(task.id, None)
+            task.finish(error=RuntimeError(f"Inference worker {worker.index} died: {worker.error}"))
+        worker.state = "dead"
+        worker.process.join()
+        if worker.conn is not None:
+            worker.conn.close()
+            worker.conn = None
+        for queue in (worker.tasks, worker.control):
+            queue.close()
+            queue.cancel_join_thread()
+        # Workers that keep failing to start back off exponentially
+        worker.restart_at = now + (min(30.0, 2.0 ** worker.failures) if worker.failures else 0.0)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "runner": self.runner,
+                "pending": len(self._pending),
+                "workers": [
+                    {
+                        "index": w.index,
+                        "pid": w.pid,
+                        "state": w.state,
+                        "cpus": w.cpus,
+                        "threads": w.num_threads,
+                        "restarts": w.restarts,
+                        "completed": w.completed,
+                        "error": w.error,
+                    }
+                    for w in self.workers
+                ],
+            }